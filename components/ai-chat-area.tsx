@@ -2,7 +2,7 @@ import { useRAG } from '@/hooks/useRAG';
 import { Button } from "@/components/ui/button";
 import { Input } from "@/components/ui/input";
 import { ScrollArea } from "@/components/ui/scroll-area";
-import { Bot, Send, Trash2, ChevronDown, ChevronUp } from "lucide-react";
+import { Bot, Send, Trash2, ChevronDown, ChevronUp, History } from "lucide-react";
 import { cn } from "@/lib/utils";
 import { useParams } from 'next/navigation';
 import { Avatar, AvatarImage, AvatarFallback } from "@/components/ui/avatar";
@@ -22,6 +22,7 @@ export function AIChatArea() {
 
   const {
     messages,
+    compactedRanges,
     context,
     isLoading,
     error,
@@ -34,6 +35,7 @@ export function AIChatArea() {
   });
 
   const [openContexts, setOpenContexts] = useState<{[key: number]: boolean}>({});
+  const [isEarlierOpen, setIsEarlierOpen] = useState(false);
 
   const toggleContext = (index: number) => {
     setOpenContexts(prev => ({
@@ -90,7 +92,7 @@ export function AIChatArea() {
           variant="ghost"
           size="icon"
           onClick={handleClearConversation}
-          disabled={isLoading || messages.length === 0}
+          disabled={isLoading || (messages.length === 0 && compactedRanges.length === 0)}
           title="Clear conversation history"
         >
           <Trash2 className="h-4 w-4" />
@@ -99,7 +101,36 @@ export function AIChatArea() {
 
       <ScrollArea className="flex-1 p-4">
         <div className="space-y-4 max-w-4xl mx-auto">
-          {messages.length === 0 && (
+          {compactedRanges.length > 0 && (
+            <Collapsible
+              open={isEarlierOpen}
+              onOpenChange={setIsEarlierOpen}
+              className="text-xs text-muted-foreground border rounded-lg p-2"
+            >
+              <CollapsibleTrigger asChild>
+                <Button variant="ghost" size="sm" className="w-full flex justify-between items-center p-2 hover:bg-accent">
+                  <span className="flex items-center gap-2 font-semibold">
+                    <History className="h-4 w-4" />
+                    Earlier conversation ({compactedRanges.reduce((total, range) => total + range.turn_count, 0)} messages summarized)
+                  </span>
+                  {isEarlierOpen ? <ChevronUp className="h-4 w-4" /> : <ChevronDown className="h-4 w-4" />}
+                </Button>
+              </CollapsibleTrigger>
+              <CollapsibleContent>
+                <div className="space-y-2 mt-2">
+                  {compactedRanges.map((range) => (
+                    <div key={range.id} className="p-2 rounded bg-muted">
+                      <p className="text-xs opacity-50 mb-1">
+                        {new Date(range.first_turn_at).toLocaleDateString()} – {new Date(range.last_turn_at).toLocaleDateString()} · {range.turn_count} messages
+                      </p>
+                      <p className="whitespace-pre-wrap">{range.summary}</p>
+                    </div>
+                  ))}
+                </div>
+              </CollapsibleContent>
+            </Collapsible>
+          )}
+          {messages.length === 0 && compactedRanges.length === 0 && (
             <div className="flex flex-col items-center justify-center py-8 text-center">
               <Avatar className="h-16 w-16 mb-4">
                 <AvatarImage src="/kia-avatar.svg" alt="KIA" />
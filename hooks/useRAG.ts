@@ -14,6 +14,15 @@ interface ChatHistoryRecord {
   created_at: string;
 }
 
+// A range of old turns that rag/compact_chat_history.py replaced by a summary
+interface CompactedRange {
+  id: string;
+  summary: string;
+  first_turn_at: string;
+  last_turn_at: string;
+  turn_count: number;
+}
+
 interface LastAction {
   type: 'send_message';
   payload: {
@@ -30,6 +39,7 @@ interface UseRAGOptions {
 
 export function useRAG({ teamId, similarityThreshold = 0.7 }: UseRAGOptions) {
   const [messages, setMessages] = useState<Message[]>([]);
+  const [compactedRanges, setCompactedRanges] = useState<CompactedRange[]>([]);
   const [context, setContext] = useState<any>(null);
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState<Error | null>(null);
@@ -71,6 +81,17 @@ export function useRAG({ teamId, similarityThreshold = 0.7 }: UseRAGOptions) {
           .reverse();
 
         setMessages(historicalMessages);
+
+        // Turns older than these were compacted; show their summaries instead
+        const { data: ranges, error: rangesError } = await supabase
+          .from('ai_chat_summaries')
+          .select('id, summary, first_turn_at, last_turn_at, turn_count')
+          .match({ user_id: user.id, team_id: teamId })
+          .order('first_turn_at', { ascending: true });
+
+        if (rangesError) throw rangesError;
+
+        setCompactedRanges((ranges || []) as CompactedRange[]);
       } catch (err) {
         console.error('Error loading chat history:', err);
         setError(err as Error);
@@ -155,7 +176,18 @@ export function useRAG({ teamId, similarityThreshold = 0.7 }: UseRAGOptions) {
 
       if (error) throw error;
 
+      // Summaries of compacted turns (rag/compact_chat_history.py) go with them
+      for (const table of ['ai_chat_summaries', 'ai_chat_compaction_state']) {
+        const { error: summaryError } = await supabase
+          .from(table)
+          .delete()
+          .match({ user_id: user.id, team_id: teamId });
+
+        if (summaryError) throw summaryError;
+      }
+
       setMessages([]);
+      setCompactedRanges([]);
       setContext(null);
       setLastAction(null);
       setIsHistoryCleared(true);
@@ -167,6 +199,7 @@ export function useRAG({ teamId, similarityThreshold = 0.7 }: UseRAGOptions) {
 
   return {
     messages,
+    compactedRanges,
     context,
     isLoading,
     error,
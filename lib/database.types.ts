@@ -37,6 +37,8 @@ export interface Database {
           team_id: string;
           content: string;
           embedding: number[];
+          embedding_model: string | null;
+          embedding_version: number | null;
           metadata?: Record<string, any>;
           created_at: string;
           updated_at: string;
@@ -47,6 +49,8 @@ export interface Database {
           team_id: string;
           content: string;
           embedding: number[];
+          embedding_model?: string | null;
+          embedding_version?: number | null;
           metadata?: Record<string, any>;
           created_at?: string;
           updated_at?: string;
@@ -57,6 +61,8 @@ export interface Database {
           team_id?: string;
           content?: string;
           embedding?: number[];
+          embedding_model?: string | null;
+          embedding_version?: number | null;
           metadata?: Record<string, any>;
           created_at?: string;
           updated_at?: string;
@@ -0,0 +1,71 @@
+import { SupabaseClient } from '@supabase/supabase-js';
+import OpenAI from 'openai';
+
+// Used until migrations/006_embedding_models.sql is applied
+export const DEFAULT_EMBEDDING_MODEL = 'text-embedding-ada-002';
+
+export interface EmbeddingModels {
+  model: string;
+  version: number;
+  // Set while a re-index is running; new rows are then embedded with both models
+  target_model: string | null;
+  target_version: number | null;
+}
+
+/**
+ * Active (and, during a re-index, target) model of an embedding table, from
+ * the embedding_models registry that rag/reindex_embeddings.py maintains.
+ * Read on every call rather than cached, so a cutover takes effect at once.
+ */
+export async function getEmbeddingModels(
+  supabase: SupabaseClient<any>,
+  table: string
+): Promise<EmbeddingModels> {
+  const { data, error } = await supabase
+    .from('embedding_models')
+    .select('model, version, target_model, target_version')
+    .eq('table_name', table)
+    .maybeSingle();
+
+  if (error || !data) {
+    console.warn(`No embedding model registry for ${table}; using ${DEFAULT_EMBEDDING_MODEL}`, error);
+    return { model: DEFAULT_EMBEDDING_MODEL, version: 1, target_model: null, target_version: null };
+  }
+
+  return data as EmbeddingModels;
+}
+
+export async function embedText(openai: OpenAI, model: string, text: string): Promise<number[]> {
+  const response = await openai.embeddings.create({
+    model,
+    input: text.replace(/\n/g, ' '),
+  });
+
+  return response.data[0].embedding;
+}
+
+/**
+ * Embedding columns for a new or edited row: the vector for the active model,
+ * plus the shadow vector for the target model while a re-index runs
+ * (dual-write), so rows written mid-re-index never block the cutover.
+ */
+export async function embeddingFields(
+  openai: OpenAI,
+  models: EmbeddingModels,
+  text: string
+): Promise<Record<string, any>> {
+  const fields: Record<string, any> = {
+    embedding: await embedText(openai, models.model, text),
+    // Tagged so the database never files it under a different model
+    embedding_model: models.model,
+    embedding_version: models.version,
+  };
+
+  if (models.target_model) {
+    fields.embedding_next = await embedText(openai, models.target_model, text);
+    fields.embedding_next_model = models.target_model;
+    fields.embedding_next_version = models.target_version;
+  }
+
+  return fields;
+}
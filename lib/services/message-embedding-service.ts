@@ -1,6 +1,7 @@
 import { createClient } from '@supabase/supabase-js';
 import OpenAI from 'openai';
 import { Database } from '@/lib/database.types';
+import { embeddingFields, getEmbeddingModels } from './embedding-models';
 
 if (!process.env.OPENAI_API_KEY) {
   throw new Error('OPENAI_API_KEY is not set in environment variables');
@@ -44,20 +45,6 @@ export class OpenAIMessageEmbeddingService implements MessageEmbeddingService {
     );
   }
 
-  private async generateEmbedding(text: string): Promise<number[]> {
-    try {
-      const response = await openai.embeddings.create({
-        model: 'text-embedding-ada-002',
-        input: text.replace(/\n/g, ' '),
-      });
-
-      return response.data[0].embedding;
-    } catch (error) {
-      console.error('Error generating embedding:', error);
-      throw new Error('Failed to generate embedding');
-    }
-  }
-
   async processMessage(message: {
     id: string;
     content: string;
@@ -65,8 +52,15 @@ export class OpenAIMessageEmbeddingService implements MessageEmbeddingService {
     metadata?: Record<string, any>;
   }): Promise<void> {
     try {
-      // Generate embedding
-      const embedding = await this.generateEmbedding(message.content);
+      // Embed with the model message_embeddings currently serves (and the re-index target, if any)
+      const models = await getEmbeddingModels(this.supabase, 'message_embeddings');
+      let fields: Record<string, any>;
+      try {
+        fields = await embeddingFields(openai, models, message.content);
+      } catch (error) {
+        console.error('Error generating embedding:', error);
+        throw new Error('Failed to generate embedding');
+      }
 
       // Store in database
       const { error } = await this.supabase
@@ -75,9 +69,9 @@ export class OpenAIMessageEmbeddingService implements MessageEmbeddingService {
           message_id: message.id,
           team_id: message.team_id,
           content: message.content,
-          embedding,
+          ...fields,
           metadata: message.metadata || {},
-        });
+        }, { onConflict: 'message_id' });
 
       if (error) {
         console.error('Error storing embedding:', error);
@@ -2,12 +2,19 @@ import OpenAI from 'openai';
 import { createClient } from '@supabase/supabase-js';
 import { Database } from '@/lib/database.types';
 import { messageEmbeddingService } from './message-embedding-service';
+import { embedText, getEmbeddingModels } from './embedding-models';
 
 // Initialize OpenAI
 const openai = new OpenAI({
   apiKey: process.env.OPENAI_API_KEY,
 });
 
+// Model rag/compact_chat_history.py embeds conversation summaries with
+const CHAT_SUMMARY_EMBEDDING_MODEL = 'text-embedding-3-small';
+
+// Compacted ranges of the conversation recalled per question
+const CHAT_SUMMARY_MATCHES = 3;
+
 // Initialize Supabase
 const supabase = createClient<Database>(
   process.env.NEXT_PUBLIC_SUPABASE_URL!,
@@ -67,12 +74,9 @@ export interface RAGService {
 
 export class OpenAIRAGService implements RAGService {
   private async generateEmbedding(text: string): Promise<number[]> {
-    const response = await openai.embeddings.create({
-      model: 'text-embedding-ada-002',
-      input: text.replace(/\n/g, ' '),
-    });
-
-    return response.data[0].embedding;
+    // Queries must use the model of the vectors find_similar_messages compares them with
+    const { model } = await getEmbeddingModels(serviceClient, 'message_embeddings');
+    return embedText(openai, model, text);
   }
 
   private async findSimilarMessages(params: {
@@ -102,6 +106,53 @@ export class OpenAIRAGService implements RAGService {
     return messages || [];
   }
 
+  /**
+   * What the model needs to know of turns that rag/compact_chat_history.py
+   * has compacted out of ai_chat_history: the conversation's rolling summary,
+   * plus the summaries of the compacted ranges closest to the question.
+   * Empty when nothing has been compacted yet.
+   */
+  private async getChatMemory(params: {
+    question: string;
+    teamId: string;
+    userId: string;
+  }): Promise<string> {
+    try {
+      const { data: state, error } = await serviceClient.rpc('get_user_chat_summary', {
+        p_user_id: params.userId,
+        p_team_id: params.teamId
+      });
+
+      if (error) throw error;
+      const summary = (state as any[] | null)?.[0];
+      if (!summary?.rolling_summary) return '';
+
+      const embedding = await embedText(openai, CHAT_SUMMARY_EMBEDDING_MODEL, params.question);
+      const { data: ranges, error: matchError } = await serviceClient.rpc('match_chat_summaries', {
+        query_embedding: embedding,
+        p_user_id: params.userId,
+        p_team_id: params.teamId,
+        max_results: CHAT_SUMMARY_MATCHES
+      });
+
+      if (matchError) throw matchError;
+
+      const recalled = ((ranges as any[] | null) || [])
+        .map(range => `- ${range.first_turn_at.slice(0, 10)} to ${range.last_turn_at.slice(0, 10)}: ${range.summary}`)
+        .join('\n');
+
+      return `Summary of your earlier conversation with this user (${summary.compacted_turns} older messages):
+        ${summary.rolling_summary}` + (recalled ? `
+
+        Earlier parts of the conversation related to this question:
+        ${recalled}` : '');
+    } catch (error) {
+      // Answer from the recent turns alone rather than fail the question
+      console.error('Error loading chat summaries:', error);
+      return '';
+    }
+  }
+
   private async findUserByName(name: string): Promise<{ id: string; email: string } | null> {
     const { data: profile, error } = await serviceClient
       .from('user_profiles')
@@ -300,8 +351,9 @@ export class OpenAIRAGService implements RAGService {
     question: string;
     context: string;
     conversationHistory?: ConversationMessage[];
+    chatMemory?: string;
   }): Promise<{ answer: string; action?: ActionIntent }> {
-    const { question, context, conversationHistory = [] } = params;
+    const { question, context, conversationHistory = [], chatMemory } = params;
 
     // Filter out any messages with null content
     const validHistory = conversationHistory.filter(msg => msg && msg.content && msg.role);
@@ -375,6 +427,8 @@ export class OpenAIRAGService implements RAGService {
         Remember to ALWAYS format your response as a JSON object with an "answer" field, and optionally an "action" field for message sending or channel creation.
         Note: For finding users, you can use partial names - the system will match them to full names.`
       },
+      // Turns older than conversationHistory were compacted into summaries
+      ...(chatMemory ? [{ role: 'system' as const, content: chatMemory }] : []),
       ...validHistory,
       {
         role: 'user' as const,
@@ -530,8 +584,11 @@ export class OpenAIRAGService implements RAGService {
         throw new Error('Could not find sender name');
       }
 
-      // Generate embedding for the question
-      const embedding = await this.generateEmbedding(params.question);
+      // Generate embedding for the question, and recall compacted conversation meanwhile
+      const [embedding, chatMemory] = await Promise.all([
+        this.generateEmbedding(params.question),
+        this.getChatMemory(params)
+      ]);
 
       // Find similar messages
       const similarMessages = await this.findSimilarMessages({
@@ -549,7 +606,8 @@ export class OpenAIRAGService implements RAGService {
       const { answer, action } = await this.generateAnswer({
         question: `[Sender: ${senderName}] ${params.question}`,
         context,
-        conversationHistory: params.conversationHistory
+        conversationHistory: params.conversationHistory,
+        chatMemory
       });
 
       // Handle actions based on type
@@ -0,0 +1,285 @@
+-- Record which model produced every stored vector, and support changing models
+-- by re-embedding into shadow columns and cutting over atomically.
+
+-- Active (and, during a re-index, target) embedding model per table
+CREATE TABLE IF NOT EXISTS embedding_models (
+    table_name TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    version INT NOT NULL DEFAULT 1,
+    target_model TEXT,
+    target_version INT,
+    started_at TIMESTAMP WITH TIME ZONE,
+    cut_over_at TIMESTAMP WITH TIME ZONE
+);
+
+INSERT INTO embedding_models (table_name, model, version) VALUES
+    ('message_embeddings', 'text-embedding-ada-002', 1),
+    ('tweets', 'text-embedding-3-small', 1)
+ON CONFLICT (table_name) DO NOTHING;
+
+-- Model tags plus the shadow column a re-index writes into
+ALTER TABLE message_embeddings
+    ADD COLUMN IF NOT EXISTS embedding_model TEXT,
+    ADD COLUMN IF NOT EXISTS embedding_version INT,
+    ADD COLUMN IF NOT EXISTS embedding_next vector(1536),
+    ADD COLUMN IF NOT EXISTS embedding_next_model TEXT,
+    ADD COLUMN IF NOT EXISTS embedding_next_version INT;
+
+ALTER TABLE tweets
+    ADD COLUMN IF NOT EXISTS embedding_model TEXT,
+    ADD COLUMN IF NOT EXISTS embedding_version INT,
+    ADD COLUMN IF NOT EXISTS embedding_next vector,
+    ADD COLUMN IF NOT EXISTS embedding_next_model TEXT,
+    ADD COLUMN IF NOT EXISTS embedding_next_version INT;
+
+-- Existing vectors were all written by the original models
+UPDATE message_embeddings
+SET embedding_model = 'text-embedding-ada-002', embedding_version = 1
+WHERE embedding IS NOT NULL AND embedding_model IS NULL;
+
+UPDATE tweets
+SET embedding_model = 'text-embedding-3-small', embedding_version = 1
+WHERE embedding IS NOT NULL AND embedding_model IS NULL;
+
+-- Keep every vector in the column for the model that produced it:
+-- * untagged vectors are tagged with the table's active model
+-- * vectors tagged with the re-index target are moved to the shadow column
+-- * vectors tagged with any other model are dropped rather than mixed in;
+--   the row then counts as missing an embedding and is picked up again
+-- A content change also marks the row's shadow vector stale for the re-index.
+CREATE OR REPLACE FUNCTION tag_embedding_model()
+RETURNS TRIGGER AS $$
+DECLARE
+    active embedding_models;
+    previous_model TEXT;
+BEGIN
+    SELECT * INTO active FROM embedding_models WHERE table_name = TG_TABLE_NAME;
+    previous_model := CASE WHEN TG_OP = 'UPDATE' THEN OLD.embedding_model END;
+
+    IF NEW.embedding IS NOT NULL AND (TG_OP = 'INSERT' OR NEW.embedding IS DISTINCT FROM OLD.embedding) THEN
+        IF NEW.embedding_model IS NOT DISTINCT FROM previous_model OR NEW.embedding_model = active.model THEN
+            NEW.embedding_model := active.model;
+            NEW.embedding_version := active.version;
+        ELSIF NEW.embedding_model = active.target_model THEN
+            NEW.embedding_next := NEW.embedding;
+            NEW.embedding_next_model := active.target_model;
+            NEW.embedding_next_version := active.target_version;
+            NEW.embedding := CASE WHEN TG_OP = 'UPDATE' THEN OLD.embedding END;
+            NEW.embedding_model := previous_model;
+        ELSE
+            RAISE WARNING 'Dropping % vector for %; % uses %',
+                NEW.embedding_model, TG_TABLE_NAME, TG_TABLE_NAME, active.model;
+            NEW.embedding := NULL;
+            NEW.embedding_model := NULL;
+            NEW.embedding_version := NULL;
+        END IF;
+    END IF;
+
+    IF TG_OP = 'UPDATE' AND NEW.content IS DISTINCT FROM OLD.content
+        AND NEW.embedding_next IS NOT DISTINCT FROM OLD.embedding_next THEN
+        NEW.embedding_next := NULL;
+        NEW.embedding_next_model := NULL;
+        NEW.embedding_next_version := NULL;
+    END IF;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tag_message_embeddings_model ON message_embeddings;
+CREATE TRIGGER tag_message_embeddings_model
+    BEFORE INSERT OR UPDATE ON message_embeddings
+    FOR EACH ROW
+    EXECUTE FUNCTION tag_embedding_model();
+
+DROP TRIGGER IF EXISTS tag_tweets_model ON tweets;
+CREATE TRIGGER tag_tweets_model
+    BEFORE INSERT OR UPDATE ON tweets
+    FOR EACH ROW
+    EXECUTE FUNCTION tag_embedding_model();
+
+-- Begin re-indexing a table into its shadow column with a new model
+CREATE OR REPLACE FUNCTION start_embedding_reindex(
+    p_table TEXT,
+    p_model TEXT,
+    p_version INT DEFAULT 1
+)
+RETURNS embedding_models LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    result embedding_models;
+BEGIN
+    UPDATE embedding_models
+    SET target_model = p_model, target_version = p_version, started_at = CURRENT_TIMESTAMP
+    WHERE table_name = p_table
+    RETURNING * INTO result;
+
+    IF result IS NULL THEN
+        RAISE EXCEPTION 'Unknown embedding table %', p_table;
+    END IF;
+    RETURN result;
+END;
+$$;
+
+-- Write re-embedded vectors into the shadow column. Rows whose content no
+-- longer matches the hash that was embedded are skipped and stay pending.
+CREATE OR REPLACE FUNCTION write_shadow_embeddings(
+    p_table TEXT,
+    p_rows JSONB -- [{"id": ..., "content_md5": ..., "embedding": [...]}]
+)
+RETURNS INT LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    target embedding_models;
+    written INT;
+BEGIN
+    SELECT * INTO target FROM embedding_models WHERE table_name = p_table;
+    IF target.target_model IS NULL THEN
+        RAISE EXCEPTION 'No re-index in progress for %', p_table;
+    END IF;
+
+    EXECUTE format(
+        'UPDATE %I t
+         SET embedding_next = r.embedding::text::vector,
+             embedding_next_model = $1,
+             embedding_next_version = $2
+         FROM jsonb_to_recordset($3) AS r(id TEXT, content_md5 TEXT, embedding JSONB)
+         WHERE t.id::text = r.id AND md5(t.content) = r.content_md5',
+        p_table
+    ) USING target.target_model, target.target_version, p_rows;
+
+    GET DIAGNOSTICS written = ROW_COUNT;
+    RETURN written;
+END;
+$$;
+
+-- Build the vector index on the shadow column ahead of cutover.
+-- Reads are never blocked; writes wait while the index builds.
+CREATE OR REPLACE FUNCTION build_shadow_embedding_index(
+    p_table TEXT,
+    p_lists INT DEFAULT 100
+)
+RETURNS VOID LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    EXECUTE format('DROP INDEX IF EXISTS %I', 'idx_' || p_table || '_embedding_next');
+    EXECUTE format(
+        'CREATE INDEX %I ON %I USING ivfflat (embedding_next vector_cosine_ops) WITH (lists = %s)',
+        'idx_' || p_table || '_embedding_next', p_table, p_lists
+    );
+END;
+$$;
+
+-- Atomically switch a table to its re-indexed vectors. Writers are blocked
+-- for the check and the swap, which only renames columns and indexes, so
+-- queries see either every old vector or every new one, never a mix.
+CREATE OR REPLACE FUNCTION cutover_embedding_model(p_table TEXT)
+RETURNS embedding_models LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    target embedding_models;
+    result embedding_models;
+    pending BIGINT;
+    vector_type TEXT;
+BEGIN
+    SELECT * INTO target FROM embedding_models WHERE table_name = p_table FOR UPDATE;
+    IF target.target_model IS NULL THEN
+        RAISE EXCEPTION 'No re-index in progress for %', p_table;
+    END IF;
+
+    EXECUTE format('LOCK TABLE %I IN SHARE ROW EXCLUSIVE MODE', p_table);
+
+    EXECUTE format(
+        'SELECT count(*) FROM %I
+         WHERE embedding_next IS NULL
+            OR embedding_next_model IS DISTINCT FROM $1
+            OR embedding_next_version IS DISTINCT FROM $2',
+        p_table
+    ) INTO pending USING target.target_model, target.target_version;
+
+    IF pending > 0 THEN
+        RAISE EXCEPTION '% rows in % still lack % embeddings', pending, p_table, target.target_model;
+    END IF;
+
+    SELECT format_type(atttypid, atttypmod) INTO vector_type
+    FROM pg_attribute
+    WHERE attrelid = p_table::regclass AND attname = 'embedding';
+
+    -- Vectors from the cutover before last are no longer needed
+    EXECUTE format(
+        'ALTER TABLE %I
+         DROP COLUMN IF EXISTS embedding_previous,
+         DROP COLUMN IF EXISTS embedding_previous_model,
+         DROP COLUMN IF EXISTS embedding_previous_version',
+        p_table
+    );
+
+    EXECUTE format('ALTER TABLE %I RENAME COLUMN embedding TO embedding_previous', p_table);
+    EXECUTE format('ALTER TABLE %I RENAME COLUMN embedding_model TO embedding_previous_model', p_table);
+    EXECUTE format('ALTER TABLE %I RENAME COLUMN embedding_version TO embedding_previous_version', p_table);
+    EXECUTE format('ALTER TABLE %I RENAME COLUMN embedding_next TO embedding', p_table);
+    EXECUTE format('ALTER TABLE %I RENAME COLUMN embedding_next_model TO embedding_model', p_table);
+    EXECUTE format('ALTER TABLE %I RENAME COLUMN embedding_next_version TO embedding_version', p_table);
+    EXECUTE format(
+        'ALTER TABLE %I
+         ADD COLUMN embedding_next %s,
+         ADD COLUMN embedding_next_model TEXT,
+         ADD COLUMN embedding_next_version INT',
+        p_table, vector_type
+    );
+
+    EXECUTE format('ALTER INDEX IF EXISTS %I RENAME TO %I',
+                   'idx_' || p_table || '_embedding', 'idx_' || p_table || '_embedding_previous');
+    EXECUTE format('ALTER INDEX IF EXISTS %I RENAME TO %I',
+                   'idx_' || p_table || '_embedding_next', 'idx_' || p_table || '_embedding');
+
+    UPDATE embedding_models
+    SET model = target_model,
+        version = target_version,
+        target_model = NULL,
+        target_version = NULL,
+        cut_over_at = CURRENT_TIMESTAMP
+    WHERE table_name = p_table
+    RETURNING * INTO result;
+
+    RETURN result;
+END;
+$$;
+
+-- Abandon a re-index, clearing the shadow column
+CREATE OR REPLACE FUNCTION abort_embedding_reindex(p_table TEXT)
+RETURNS VOID LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    UPDATE embedding_models
+    SET target_model = NULL, target_version = NULL, started_at = NULL
+    WHERE table_name = p_table;
+
+    EXECUTE format(
+        'UPDATE %I SET embedding_next = NULL, embedding_next_model = NULL, embedding_next_version = NULL
+         WHERE embedding_next IS NOT NULL',
+        p_table
+    );
+    EXECUTE format('DROP INDEX IF EXISTS %I', 'idx_' || p_table || '_embedding_next');
+END;
+$$;
+
+GRANT SELECT ON embedding_models TO anon, authenticated, service_role;
+
+-- These run DDL and rewrite vectors as their owner: only the service role may
+-- call them, not PUBLIC (which Supabase's anon and authenticated roles hold)
+REVOKE EXECUTE ON FUNCTION start_embedding_reindex(TEXT, TEXT, INT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION write_shadow_embeddings(TEXT, JSONB) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION build_shadow_embedding_index(TEXT, INT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION cutover_embedding_model(TEXT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION abort_embedding_reindex(TEXT) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION start_embedding_reindex(TEXT, TEXT, INT) TO service_role;
+GRANT EXECUTE ON FUNCTION write_shadow_embeddings(TEXT, JSONB) TO service_role;
+GRANT EXECUTE ON FUNCTION build_shadow_embedding_index(TEXT, INT) TO service_role;
+GRANT EXECUTE ON FUNCTION cutover_embedding_model(TEXT) TO service_role;
+GRANT EXECUTE ON FUNCTION abort_embedding_reindex(TEXT) TO service_role;
@@ -0,0 +1,161 @@
+-- Support for retraining the message_embeddings ivfflat index as the table grows
+-- and tuning ivfflat.probes to a target recall (driven by rag/vector_maintenance.py).
+
+-- How the vector index was last built and tuned
+CREATE TABLE IF NOT EXISTS vector_index_settings (
+    index_name TEXT PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    lists INT NOT NULL,
+    probes INT NOT NULL DEFAULT 1,
+    -- Rows in the table when the index was (re)built; centroids go stale as it grows
+    row_count BIGINT NOT NULL DEFAULT 0,
+    target_recall FLOAT,
+    measured_recall FLOAT,
+    built_at TIMESTAMP WITH TIME ZONE,
+    tuned_at TIMESTAMP WITH TIME ZONE
+);
+
+INSERT INTO vector_index_settings (index_name, table_name, lists, probes)
+VALUES ('idx_message_embeddings_embedding', 'message_embeddings', 100, 1)
+ON CONFLICT (index_name) DO NOTHING;
+
+-- Current size of the table and its index
+CREATE OR REPLACE FUNCTION vector_index_stats()
+RETURNS TABLE (
+    index_name TEXT,
+    lists INT,
+    row_count BIGINT,
+    index_bytes BIGINT
+) LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    RETURN QUERY
+    SELECT
+        c.relname::TEXT,
+        (SELECT split_part(opt, '=', 2)::INT FROM unnest(c.reloptions) AS opt WHERE opt LIKE 'lists=%'),
+        (SELECT count(*) FROM message_embeddings WHERE embedding IS NOT NULL),
+        pg_relation_size(c.oid)
+    FROM pg_class c
+    WHERE c.relname = 'idx_message_embeddings_embedding';
+END;
+$$;
+
+-- Random stored vectors, used as the query set for recall measurements
+CREATE OR REPLACE FUNCTION sample_message_embeddings(p_count INT DEFAULT 100)
+RETURNS TABLE (
+    message_id UUID,
+    team_id UUID,
+    embedding vector(1536)
+) LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    RETURN QUERY
+    SELECT me.message_id, me.team_id, me.embedding
+    FROM message_embeddings me
+    WHERE me.embedding IS NOT NULL
+    ORDER BY random()
+    LIMIT p_count;
+END;
+$$;
+
+-- Nearest messages with a given number of probes; p_probes <= 0 forces an exact scan
+CREATE OR REPLACE FUNCTION probe_similar_messages(
+    query_embedding vector(1536),
+    team_id_filter UUID,
+    max_results INT DEFAULT 10,
+    p_probes INT DEFAULT 1
+)
+RETURNS TABLE (message_id UUID) LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    IF p_probes <= 0 THEN
+        PERFORM set_config('enable_indexscan', 'off', true);
+        PERFORM set_config('enable_bitmapscan', 'off', true);
+    ELSE
+        PERFORM set_config('ivfflat.probes', p_probes::TEXT, true);
+    END IF;
+
+    RETURN QUERY
+    SELECT me.message_id
+    FROM message_embeddings me
+    WHERE me.team_id = team_id_filter
+    ORDER BY me.embedding <=> query_embedding
+    LIMIT max_results;
+END;
+$$;
+
+-- Retrain the index with a new number of lists. The replacement is built
+-- before the old index is dropped, so searches keep using an index throughout.
+CREATE OR REPLACE FUNCTION rebuild_message_embeddings_index(p_lists INT)
+RETURNS vector_index_settings LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    result vector_index_settings;
+BEGIN
+    DROP INDEX IF EXISTS idx_message_embeddings_embedding_rebuild;
+    EXECUTE format(
+        'CREATE INDEX idx_message_embeddings_embedding_rebuild ON message_embeddings
+         USING ivfflat (embedding vector_cosine_ops) WITH (lists = %s)',
+        p_lists
+    );
+    DROP INDEX IF EXISTS idx_message_embeddings_embedding;
+    ALTER INDEX idx_message_embeddings_embedding_rebuild RENAME TO idx_message_embeddings_embedding;
+
+    UPDATE vector_index_settings
+    SET lists = p_lists,
+        row_count = (SELECT count(*) FROM message_embeddings WHERE embedding IS NOT NULL),
+        built_at = CURRENT_TIMESTAMP
+    WHERE index_name = 'idx_message_embeddings_embedding'
+    RETURNING * INTO result;
+
+    RETURN result;
+END;
+$$;
+
+-- Make every message search function scan p_probes lists
+CREATE OR REPLACE FUNCTION set_ivfflat_probes(
+    p_probes INT,
+    p_target_recall FLOAT DEFAULT NULL,
+    p_measured_recall FLOAT DEFAULT NULL
+)
+RETURNS vector_index_settings LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    result vector_index_settings;
+BEGIN
+    EXECUTE format('ALTER FUNCTION find_similar_messages(vector, UUID, FLOAT, INT) SET ivfflat.probes = %s', p_probes);
+    EXECUTE format('ALTER FUNCTION get_rag_context(vector, UUID, INT, FLOAT) SET ivfflat.probes = %s', p_probes);
+    EXECUTE format('ALTER FUNCTION search_messages_by_text(TEXT, UUID, vector, INT) SET ivfflat.probes = %s', p_probes);
+
+    UPDATE vector_index_settings
+    SET probes = p_probes,
+        target_recall = COALESCE(p_target_recall, target_recall),
+        measured_recall = COALESCE(p_measured_recall, measured_recall),
+        tuned_at = CURRENT_TIMESTAMP
+    WHERE index_name = 'idx_message_embeddings_embedding'
+    RETURNING * INTO result;
+
+    RETURN result;
+END;
+$$;
+
+GRANT SELECT ON vector_index_settings TO service_role;
+GRANT EXECUTE ON FUNCTION vector_index_stats() TO service_role;
+GRANT EXECUTE ON FUNCTION sample_message_embeddings(INT) TO service_role;
+GRANT EXECUTE ON FUNCTION probe_similar_messages(vector, UUID, INT, INT) TO service_role;
+GRANT EXECUTE ON FUNCTION rebuild_message_embeddings_index(INT) TO service_role;
+GRANT EXECUTE ON FUNCTION set_ivfflat_probes(INT, FLOAT, FLOAT) TO service_role;
+
+-- These read every team's vectors or rebuild the index as their owner: only
+-- the service role may call them, not PUBLIC (which Supabase's anon and
+-- authenticated roles hold)
+REVOKE EXECUTE ON FUNCTION vector_index_stats() FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION sample_message_embeddings(INT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION probe_similar_messages(vector, UUID, INT, INT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION rebuild_message_embeddings_index(INT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION set_ivfflat_probes(INT, FLOAT, FLOAT) FROM PUBLIC, anon, authenticated;
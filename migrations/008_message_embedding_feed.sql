@@ -0,0 +1,147 @@
+-- Change feed for message embeddings, consumed by rag/embedding_worker.py.
+-- Every new or edited message is queued in an outbox table (so nothing is
+-- lost while the worker is down) and announced with NOTIFY (so a listening
+-- worker picks it up within its batching window instead of a cron interval).
+
+CREATE TABLE IF NOT EXISTS message_embedding_changes (
+    id BIGSERIAL PRIMARY KEY,
+    message_id UUID NOT NULL,
+    changed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_message_embedding_changes_message_id
+    ON message_embedding_changes(message_id);
+
+-- Only the worker (service role) reads the outbox
+ALTER TABLE message_embedding_changes ENABLE ROW LEVEL SECURITY;
+
+-- Runs as its owner: messages are inserted and edited by clients (authenticated
+-- role), which have no access to the outbox, its RLS or its sequence, and a
+-- failing trigger would abort their write
+CREATE OR REPLACE FUNCTION queue_message_embedding_change()
+RETURNS TRIGGER
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    INSERT INTO message_embedding_changes (message_id) VALUES (NEW.id);
+    -- Delivered on commit; the payload is only a wake-up, the outbox is the source of truth
+    PERFORM pg_notify('message_embedding_changes', NEW.id::TEXT);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS queue_message_embedding_insert ON messages;
+CREATE TRIGGER queue_message_embedding_insert
+    AFTER INSERT ON messages
+    FOR EACH ROW
+    EXECUTE FUNCTION queue_message_embedding_change();
+
+DROP TRIGGER IF EXISTS queue_message_embedding_update ON messages;
+CREATE TRIGGER queue_message_embedding_update
+    AFTER UPDATE OF content ON messages
+    FOR EACH ROW
+    WHEN (OLD.content IS DISTINCT FROM NEW.content)
+    EXECUTE FUNCTION queue_message_embedding_change();
+
+-- Queue the messages the cron job has not embedded yet
+INSERT INTO message_embedding_changes (message_id)
+SELECT m.id
+FROM messages m
+WHERE NOT EXISTS (SELECT 1 FROM message_embeddings me WHERE me.message_id = m.id)
+  AND NOT EXISTS (SELECT 1 FROM message_embedding_changes c WHERE c.message_id = m.id)
+ORDER BY m.created_at;
+
+-- One embedding per message, so bulk writes can upsert on message_id
+DELETE FROM message_embeddings me
+USING message_embeddings newer
+WHERE newer.message_id = me.message_id
+  AND (newer.updated_at, newer.id) > (me.updated_at, me.id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_message_embeddings_message_id
+    ON message_embeddings(message_id);
+
+-- Queued changes after an id (by default all of them, oldest first), with the
+-- message's current content (NULL content means the message has since been
+-- deleted)
+CREATE OR REPLACE FUNCTION pending_message_embedding_changes(
+    p_after BIGINT DEFAULT 0,
+    p_limit INT DEFAULT 500
+)
+RETURNS TABLE (
+    change_id BIGINT,
+    message_id UUID,
+    team_id UUID,
+    content TEXT,
+    changed_at TIMESTAMP WITH TIME ZONE
+) LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    RETURN QUERY
+    SELECT c.id, c.message_id, ch.team_id, m.content, c.changed_at
+    FROM message_embedding_changes c
+    LEFT JOIN messages m ON m.id = c.message_id
+    LEFT JOIN channels ch ON ch.id = m.channel_id
+    WHERE c.id > p_after
+    ORDER BY c.id
+    LIMIT p_limit;
+END;
+$$;
+
+-- Upsert a batch of embeddings and remove the changes they cover. A row whose
+-- message was edited after it was embedded is skipped; the edit queued a
+-- newer change, which is embedded in a later batch.
+CREATE OR REPLACE FUNCTION store_message_embeddings(
+    p_rows JSONB, -- [{"message_id", "team_id", "content_md5", "embedding", "embedding_model", "embedding_version", ...}]
+    p_change_ids BIGINT[]
+)
+RETURNS INT LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    stored INT;
+BEGIN
+    INSERT INTO message_embeddings (
+        message_id, team_id, content, embedding, embedding_model, embedding_version,
+        embedding_next, embedding_next_model, embedding_next_version, metadata
+    )
+    SELECT r.message_id, r.team_id, m.content, r.embedding, r.embedding_model, r.embedding_version,
+           r.embedding_next, r.embedding_next_model, r.embedding_next_version, '{}'::JSONB
+    FROM jsonb_to_recordset(p_rows) AS r(
+        message_id UUID,
+        team_id UUID,
+        content_md5 TEXT,
+        embedding vector(1536),
+        embedding_model TEXT,
+        embedding_version INT,
+        embedding_next vector(1536),
+        embedding_next_model TEXT,
+        embedding_next_version INT
+    )
+    JOIN messages m ON m.id = r.message_id AND md5(m.content) = r.content_md5
+    ON CONFLICT (message_id) DO UPDATE
+    SET team_id = EXCLUDED.team_id,
+        content = EXCLUDED.content,
+        embedding = EXCLUDED.embedding,
+        embedding_model = EXCLUDED.embedding_model,
+        embedding_version = EXCLUDED.embedding_version,
+        embedding_next = EXCLUDED.embedding_next,
+        embedding_next_model = EXCLUDED.embedding_next_model,
+        embedding_next_version = EXCLUDED.embedding_next_version;
+    GET DIAGNOSTICS stored = ROW_COUNT;
+
+    DELETE FROM message_embedding_changes WHERE id = ANY(p_change_ids);
+    RETURN stored;
+END;
+$$;
+
+GRANT SELECT, DELETE ON message_embedding_changes TO service_role;
+GRANT EXECUTE ON FUNCTION pending_message_embedding_changes(BIGINT, INT) TO service_role;
+GRANT EXECUTE ON FUNCTION store_message_embeddings(JSONB, BIGINT[]) TO service_role;
+
+-- These read every team's messages and write any embedding as their owner:
+-- only the service role may call them, not PUBLIC (which Supabase's anon and
+-- authenticated roles hold)
+REVOKE EXECUTE ON FUNCTION pending_message_embedding_changes(BIGINT, INT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION store_message_embeddings(JSONB, BIGINT[]) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,108 @@
+-- Embeddings for direct messages, which message_embeddings cannot hold
+-- (its message_id references messages). Filled by rag/backfill_embeddings.py.
+
+CREATE TABLE IF NOT EXISTS direct_message_embeddings (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    message_id UUID NOT NULL UNIQUE REFERENCES direct_messages(id) ON DELETE CASCADE,
+    channel_id UUID REFERENCES direct_message_channels(id) ON DELETE CASCADE,
+    embedding vector(1536),
+    content TEXT NOT NULL,
+    metadata JSONB,
+    embedding_model TEXT,
+    embedding_version INT,
+    embedding_next vector(1536),
+    embedding_next_model TEXT,
+    embedding_next_version INT,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_direct_message_embeddings_channel_id
+    ON direct_message_embeddings(channel_id);
+
+CREATE INDEX IF NOT EXISTS idx_direct_message_embeddings_embedding
+    ON direct_message_embeddings
+    USING ivfflat (embedding vector_cosine_ops)
+    WITH (lists = 100);
+
+DROP TRIGGER IF EXISTS update_direct_message_embeddings_updated_at ON direct_message_embeddings;
+CREATE TRIGGER update_direct_message_embeddings_updated_at
+    BEFORE UPDATE ON direct_message_embeddings
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
+
+-- Same model tagging and re-index support as the other embedding tables
+INSERT INTO embedding_models (table_name, model, version)
+VALUES ('direct_message_embeddings', 'text-embedding-ada-002', 1)
+ON CONFLICT (table_name) DO NOTHING;
+
+DROP TRIGGER IF EXISTS tag_direct_message_embeddings_model ON direct_message_embeddings;
+CREATE TRIGGER tag_direct_message_embeddings_model
+    BEFORE INSERT OR UPDATE ON direct_message_embeddings
+    FOR EACH ROW
+    EXECUTE FUNCTION tag_embedding_model();
+
+-- Only the participants of a conversation can read its embeddings
+ALTER TABLE direct_message_embeddings ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Participants can read direct message embeddings" ON direct_message_embeddings;
+CREATE POLICY "Participants can read direct message embeddings"
+    ON direct_message_embeddings
+    FOR SELECT
+    USING (
+        channel_id IN (
+            SELECT channel_id
+            FROM direct_message_participants
+            WHERE user_id = auth.uid()
+        )
+    );
+
+-- Upsert a batch of direct message embeddings, skipping rows whose message
+-- was edited after it was embedded (as store_message_embeddings does)
+CREATE OR REPLACE FUNCTION store_direct_message_embeddings(
+    p_rows JSONB -- [{"message_id", "channel_id", "content_md5", "embedding", "embedding_model", "embedding_version", ...}]
+)
+RETURNS INT LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    stored INT;
+BEGIN
+    INSERT INTO direct_message_embeddings (
+        message_id, channel_id, content, embedding, embedding_model, embedding_version,
+        embedding_next, embedding_next_model, embedding_next_version, metadata
+    )
+    SELECT r.message_id, dm.channel_id, dm.content, r.embedding, r.embedding_model, r.embedding_version,
+           r.embedding_next, r.embedding_next_model, r.embedding_next_version, '{}'::JSONB
+    FROM jsonb_to_recordset(p_rows) AS r(
+        message_id UUID,
+        content_md5 TEXT,
+        embedding vector(1536),
+        embedding_model TEXT,
+        embedding_version INT,
+        embedding_next vector(1536),
+        embedding_next_model TEXT,
+        embedding_next_version INT
+    )
+    JOIN direct_messages dm ON dm.id = r.message_id AND md5(dm.content) = r.content_md5
+    ON CONFLICT (message_id) DO UPDATE
+    SET channel_id = EXCLUDED.channel_id,
+        content = EXCLUDED.content,
+        embedding = EXCLUDED.embedding,
+        embedding_model = EXCLUDED.embedding_model,
+        embedding_version = EXCLUDED.embedding_version,
+        embedding_next = EXCLUDED.embedding_next,
+        embedding_next_model = EXCLUDED.embedding_next_model,
+        embedding_next_version = EXCLUDED.embedding_next_version;
+    GET DIAGNOSTICS stored = ROW_COUNT;
+    RETURN stored;
+END;
+$$;
+
+GRANT SELECT ON direct_message_embeddings TO authenticated;
+GRANT SELECT ON direct_message_embeddings TO service_role;
+GRANT EXECUTE ON FUNCTION store_direct_message_embeddings(JSONB) TO service_role;
+
+-- Writes any channel's embeddings as its owner: only the service role may
+-- call it, not PUBLIC (which Supabase's anon and authenticated roles hold)
+REVOKE EXECUTE ON FUNCTION store_direct_message_embeddings(JSONB) FROM PUBLIC, anon, authenticated;
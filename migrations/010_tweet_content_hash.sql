@@ -0,0 +1,14 @@
+-- Identify tweets by their content, so a retried insert (e.g. from a job
+-- re-leased after a worker crash) updates the existing row instead of
+-- adding a duplicate. Used by rag/embedding_jobs.py.
+
+ALTER TABLE tweets
+    ADD COLUMN IF NOT EXISTS content_md5 TEXT GENERATED ALWAYS AS (md5(content)) STORED;
+
+-- Keep the oldest copy of any tweet stored more than once
+DELETE FROM tweets t
+USING tweets kept
+WHERE kept.content_md5 = t.content_md5
+  AND kept.id < t.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_tweets_content_md5 ON tweets(content_md5);
@@ -0,0 +1,221 @@
+-- Compaction of ai_chat_history, run by rag/compact_chat_history.py. Old
+-- turns of a conversation (one user in one team) are replaced by a summary
+-- per compacted range, embedded for recall, and a rolling summary of
+-- everything compacted so far, so the raw history stays short.
+
+-- One row per compacted range of turns
+CREATE TABLE IF NOT EXISTS ai_chat_summaries (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+    team_id UUID NOT NULL REFERENCES teams(id) ON DELETE CASCADE,
+    first_turn_at TIMESTAMPTZ NOT NULL,
+    last_turn_at TIMESTAMPTZ NOT NULL,
+    turn_count INT NOT NULL,
+    summary TEXT NOT NULL,
+    embedding vector(1536),
+    embedding_model TEXT,
+    summary_model TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    CONSTRAINT ai_chat_summaries_range_idx UNIQUE (user_id, team_id, last_turn_at)
+);
+
+-- Where each conversation has been compacted up to, and its rolling summary
+CREATE TABLE IF NOT EXISTS ai_chat_compaction_state (
+    user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+    team_id UUID NOT NULL REFERENCES teams(id) ON DELETE CASCADE,
+    compacted_through TIMESTAMPTZ NOT NULL,
+    compacted_turns INT NOT NULL DEFAULT 0,
+    rolling_summary TEXT NOT NULL,
+    summary_tokens INT,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, team_id)
+);
+
+ALTER TABLE ai_chat_summaries ENABLE ROW LEVEL SECURITY;
+ALTER TABLE ai_chat_compaction_state ENABLE ROW LEVEL SECURITY;
+
+-- Users read and clear their own summaries; only the job (service role) writes them
+CREATE POLICY "Users can view their own chat summaries"
+  ON ai_chat_summaries
+  FOR SELECT
+  USING (auth.uid() = user_id);
+
+CREATE POLICY "Users can delete their own chat summaries"
+  ON ai_chat_summaries
+  FOR DELETE
+  USING (auth.uid() = user_id);
+
+CREATE POLICY "Users can view their own chat compaction state"
+  ON ai_chat_compaction_state
+  FOR SELECT
+  USING (auth.uid() = user_id);
+
+CREATE POLICY "Users can delete their own chat compaction state"
+  ON ai_chat_compaction_state
+  FOR DELETE
+  USING (auth.uid() = user_id);
+
+-- Conversations with at least p_min_turns turns that are older than p_before
+-- and not among their p_keep_recent newest, after a (user, team) cursor
+CREATE OR REPLACE FUNCTION chat_compaction_candidates(
+    p_keep_recent INT,
+    p_before TIMESTAMPTZ,
+    p_min_turns INT,
+    p_after_user UUID DEFAULT NULL,
+    p_after_team UUID DEFAULT NULL,
+    p_limit INT DEFAULT 100
+)
+RETURNS TABLE (
+    user_id UUID,
+    team_id UUID,
+    compactable INT,
+    compacted_through TIMESTAMPTZ,
+    rolling_summary TEXT
+) LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    RETURN QUERY
+    WITH ranked AS (
+        SELECT ch.user_id, ch.team_id, ch.created_at,
+               row_number() OVER (PARTITION BY ch.user_id, ch.team_id ORDER BY ch.created_at DESC) AS recency
+        FROM ai_chat_history ch
+        WHERE p_after_user IS NULL OR (ch.user_id, ch.team_id) > (p_after_user, p_after_team)
+    ), counts AS (
+        SELECT r.user_id, r.team_id, count(*)::INT AS compactable
+        FROM ranked r
+        WHERE r.recency > p_keep_recent AND r.created_at < p_before
+        GROUP BY r.user_id, r.team_id
+        HAVING count(*) >= p_min_turns
+    )
+    SELECT c.user_id, c.team_id, c.compactable, s.compacted_through, s.rolling_summary
+    FROM counts c
+    LEFT JOIN ai_chat_compaction_state s ON s.user_id = c.user_id AND s.team_id = c.team_id
+    ORDER BY c.user_id, c.team_id
+    LIMIT p_limit;
+END;
+$$;
+
+-- Store the summary of one range of turns, delete those turns and advance
+-- the conversation's state, all or nothing. p_expected_through is the state
+-- the summary was built on; if another run has moved it since, or the range
+-- no longer holds p_turn_count turns, nothing is written.
+CREATE OR REPLACE FUNCTION compact_chat_turns(
+    p_user_id UUID,
+    p_team_id UUID,
+    p_expected_through TIMESTAMPTZ,
+    p_first_turn_at TIMESTAMPTZ,
+    p_last_turn_at TIMESTAMPTZ,
+    p_turn_count INT,
+    p_summary TEXT,
+    p_rolling_summary TEXT,
+    p_summary_tokens INT,
+    p_embedding vector(1536),
+    p_embedding_model TEXT,
+    p_summary_model TEXT
+)
+RETURNS INT LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    deleted INT;
+    advanced INT;
+BEGIN
+    INSERT INTO ai_chat_compaction_state (user_id, team_id, compacted_through, compacted_turns, rolling_summary, summary_tokens)
+    VALUES (p_user_id, p_team_id, p_last_turn_at, p_turn_count, p_rolling_summary, p_summary_tokens)
+    ON CONFLICT (user_id, team_id) DO UPDATE
+    SET compacted_through = EXCLUDED.compacted_through,
+        compacted_turns = ai_chat_compaction_state.compacted_turns + EXCLUDED.compacted_turns,
+        rolling_summary = EXCLUDED.rolling_summary,
+        summary_tokens = EXCLUDED.summary_tokens,
+        updated_at = NOW()
+    WHERE ai_chat_compaction_state.compacted_through IS NOT DISTINCT FROM p_expected_through;
+    GET DIAGNOSTICS advanced = ROW_COUNT;
+    IF advanced = 0 THEN
+        RAISE EXCEPTION 'Compaction state of % in % has moved', p_user_id, p_team_id USING ERRCODE = '40001';
+    END IF;
+
+    DELETE FROM ai_chat_history ch
+    WHERE ch.user_id = p_user_id
+      AND ch.team_id = p_team_id
+      AND ch.created_at >= p_first_turn_at
+      AND ch.created_at <= p_last_turn_at;
+    GET DIAGNOSTICS deleted = ROW_COUNT;
+    IF deleted <> p_turn_count THEN
+        RAISE EXCEPTION 'Expected % turns of % in % between % and %, found %',
+            p_turn_count, p_user_id, p_team_id, p_first_turn_at, p_last_turn_at, deleted USING ERRCODE = '40001';
+    END IF;
+
+    INSERT INTO ai_chat_summaries (user_id, team_id, first_turn_at, last_turn_at, turn_count, summary,
+                                   embedding, embedding_model, summary_model)
+    VALUES (p_user_id, p_team_id, p_first_turn_at, p_last_turn_at, p_turn_count, p_summary,
+            p_embedding, p_embedding_model, p_summary_model);
+    RETURN deleted;
+END;
+$$;
+
+-- Rolling summary of a conversation's compacted turns, to put ahead of
+-- get_user_chat_history's recent turns in a prompt
+CREATE OR REPLACE FUNCTION get_user_chat_summary(
+    p_user_id UUID,
+    p_team_id UUID
+)
+RETURNS TABLE (
+    rolling_summary TEXT,
+    compacted_through TIMESTAMPTZ,
+    compacted_turns INT
+) AS $$
+BEGIN
+  RETURN QUERY
+  SELECT s.rolling_summary, s.compacted_through, s.compacted_turns
+  FROM ai_chat_compaction_state s
+  WHERE s.user_id = p_user_id
+    AND s.team_id = p_team_id;
+END;
+$$ LANGUAGE plpgsql SECURITY DEFINER;
+
+-- Compacted ranges of a conversation most similar to a query, for recalling
+-- older context than the rolling summary keeps
+CREATE OR REPLACE FUNCTION match_chat_summaries(
+    query_embedding vector(1536),
+    p_user_id UUID,
+    p_team_id UUID,
+    max_results INT DEFAULT 3
+)
+RETURNS TABLE (
+    id UUID,
+    summary TEXT,
+    first_turn_at TIMESTAMPTZ,
+    last_turn_at TIMESTAMPTZ,
+    similarity FLOAT
+) LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    RETURN QUERY
+    SELECT cs.id, cs.summary, cs.first_turn_at, cs.last_turn_at,
+           1 - (cs.embedding <=> query_embedding) AS similarity
+    FROM ai_chat_summaries cs
+    WHERE cs.user_id = p_user_id
+      AND cs.team_id = p_team_id
+      AND cs.embedding IS NOT NULL
+    ORDER BY cs.embedding <=> query_embedding
+    LIMIT max_results;
+END;
+$$;
+
+GRANT EXECUTE ON FUNCTION chat_compaction_candidates(INT, TIMESTAMPTZ, INT, UUID, UUID, INT) TO service_role;
+GRANT EXECUTE ON FUNCTION compact_chat_turns(UUID, UUID, TIMESTAMPTZ, TIMESTAMPTZ, TIMESTAMPTZ, INT, TEXT, TEXT, INT,
+                                             vector, TEXT, TEXT) TO service_role;
+GRANT EXECUTE ON FUNCTION get_user_chat_summary(UUID, UUID) TO service_role;
+GRANT EXECUTE ON FUNCTION match_chat_summaries(vector, UUID, UUID, INT) TO service_role;
+
+-- These take the user as a parameter and run as their owner, past RLS: only
+-- the service role (rag/compact_chat_history.py, lib/services/rag-service.ts)
+-- may call them, not PUBLIC (which Supabase's anon and authenticated roles
+-- hold). Clients read their own summaries from the tables, under RLS.
+REVOKE EXECUTE ON FUNCTION chat_compaction_candidates(INT, TIMESTAMPTZ, INT, UUID, UUID, INT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION compact_chat_turns(UUID, UUID, TIMESTAMPTZ, TIMESTAMPTZ, TIMESTAMPTZ, INT, TEXT, TEXT, INT,
+                                              vector, TEXT, TEXT) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION get_user_chat_summary(UUID, UUID) FROM PUBLIC, anon, authenticated;
+REVOKE EXECUTE ON FUNCTION match_chat_summaries(vector, UUID, UUID, INT) FROM PUBLIC, anon, authenticated;
@@ -0,0 +1,46 @@
+-- Log of deleted messages and direct messages, read by
+-- oldstuff/prepare_rag_data.py --incremental so it can drop deleted rows
+-- from its export without scanning every id. A delete leaves no row behind
+-- to carry a newer updated_at, so it is recorded here instead.
+
+CREATE TABLE IF NOT EXISTS message_delete_log (
+    id BIGSERIAL PRIMARY KEY,
+    source TEXT NOT NULL CHECK (source IN ('messages', 'direct_messages')),
+    message_id UUID NOT NULL,
+    channel_id UUID,
+    deleted_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_message_delete_log_source_id
+    ON message_delete_log(source, id);
+
+-- Only the export (service role) reads the log
+ALTER TABLE message_delete_log ENABLE ROW LEVEL SECURITY;
+
+-- Runs as its owner, so deletes by clients (authenticated role) can write
+-- the log despite RLS and without grants on its sequence
+CREATE OR REPLACE FUNCTION log_message_delete()
+RETURNS TRIGGER
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    INSERT INTO message_delete_log (source, message_id, channel_id)
+    VALUES (TG_TABLE_NAME, OLD.id, OLD.channel_id);
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS log_message_delete ON messages;
+CREATE TRIGGER log_message_delete
+    AFTER DELETE ON messages
+    FOR EACH ROW
+    EXECUTE FUNCTION log_message_delete();
+
+DROP TRIGGER IF EXISTS log_direct_message_delete ON direct_messages;
+CREATE TRIGGER log_direct_message_delete
+    AFTER DELETE ON direct_messages
+    FOR EACH ROW
+    EXECUTE FUNCTION log_message_delete();
+
+GRANT SELECT, DELETE ON message_delete_log TO service_role;
@@ -0,0 +1,51 @@
+-- A writer that read the embedding_models registry just before a cutover
+-- sends the old model's vector in embedding and the new (now active) model's
+-- in embedding_next. tag_embedding_model used to drop such a row's vector;
+-- it now promotes the shadow vector instead, so the row stays searchable.
+-- Otherwise unchanged from migrations/006_embedding_models.sql.
+CREATE OR REPLACE FUNCTION tag_embedding_model()
+RETURNS TRIGGER AS $$
+DECLARE
+    active embedding_models;
+    previous_model TEXT;
+BEGIN
+    SELECT * INTO active FROM embedding_models WHERE table_name = TG_TABLE_NAME;
+    previous_model := CASE WHEN TG_OP = 'UPDATE' THEN OLD.embedding_model END;
+
+    IF NEW.embedding IS NOT NULL AND (TG_OP = 'INSERT' OR NEW.embedding IS DISTINCT FROM OLD.embedding) THEN
+        IF NEW.embedding_model IS NOT DISTINCT FROM previous_model OR NEW.embedding_model = active.model THEN
+            NEW.embedding_model := active.model;
+            NEW.embedding_version := active.version;
+        ELSIF NEW.embedding_model = active.target_model THEN
+            NEW.embedding_next := NEW.embedding;
+            NEW.embedding_next_model := active.target_model;
+            NEW.embedding_next_version := active.target_version;
+            NEW.embedding := CASE WHEN TG_OP = 'UPDATE' THEN OLD.embedding END;
+            NEW.embedding_model := previous_model;
+        ELSIF NEW.embedding_next IS NOT NULL AND NEW.embedding_next_model = active.model THEN
+            -- Dual-written across a cutover: the shadow vector is the active model's
+            NEW.embedding := NEW.embedding_next;
+            NEW.embedding_model := active.model;
+            NEW.embedding_version := active.version;
+            NEW.embedding_next := NULL;
+            NEW.embedding_next_model := NULL;
+            NEW.embedding_next_version := NULL;
+        ELSE
+            RAISE WARNING 'Dropping % vector for %; % uses %',
+                NEW.embedding_model, TG_TABLE_NAME, TG_TABLE_NAME, active.model;
+            NEW.embedding := NULL;
+            NEW.embedding_model := NULL;
+            NEW.embedding_version := NULL;
+        END IF;
+    END IF;
+
+    IF TG_OP = 'UPDATE' AND NEW.content IS DISTINCT FROM OLD.content
+        AND NEW.embedding_next IS NOT DISTINCT FROM OLD.embedding_next THEN
+        NEW.embedding_next := NULL;
+        NEW.embedding_next_model := NULL;
+        NEW.embedding_next_version := NULL;
+    END IF;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,20 @@
+-- Keep updated_at current on edits to messages and direct messages.
+-- oldstuff/prepare_rag_data.py --incremental reads rows changed after an
+-- (updated_at, id) watermark, so an edit that left updated_at at its insert
+-- time would never be exported.
+
+DROP TRIGGER IF EXISTS update_messages_updated_at ON messages;
+CREATE TRIGGER update_messages_updated_at
+    BEFORE UPDATE ON messages
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
+
+DROP TRIGGER IF EXISTS update_direct_messages_updated_at ON direct_messages;
+CREATE TRIGGER update_direct_messages_updated_at
+    BEFORE UPDATE ON direct_messages
+    FOR EACH ROW
+    EXECUTE FUNCTION update_updated_at_column();
+
+-- The incremental export pages through each table in (updated_at, id) order
+CREATE INDEX IF NOT EXISTS idx_messages_updated_at_id ON messages(updated_at, id);
+CREATE INDEX IF NOT EXISTS idx_direct_messages_updated_at_id ON direct_messages(updated_at, id);
@@ -1,85 +1,743 @@
 import os
+import sys
 import json
-from datetime import datetime
-from typing import List, Dict
-from dotenv import load_dotenv
-from supabase import create_client, Client
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import List, Dict, Optional
 
-# Load environment variables
-load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env.local'))
+# Shared pipeline helpers live in rag/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rag'))
+from clients import get_supabase, LazyClient
+from instrumentation import metrics
+from message_export import MANIFEST_FILE, SHARD_DIR, apply_delta_documents, channel_key, load_manifest, read_delta
+from normalization import count_tokens, normalize_many
+from resilience import call_with_retries
 
-# Initialize Supabase client
-supabase: Client = create_client(
-    os.getenv('NEXT_PUBLIC_SUPABASE_URL', ''),
-    os.getenv('NEXT_PUBLIC_SUPABASE_ANON_KEY', '')
-)
+# Supabase client, built on first use
+supabase = LazyClient(get_supabase)
+
+# Output locations; readers load the shards through rag/message_export.py
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'rag', 'data')
+STATE_FILE = os.path.join(OUTPUT_DIR, 'processed_messages_state.json')
+
+# Single-file export of earlier versions, which rewrote it whole on every run
+MERGED_FILE = os.path.join(OUTPUT_DIR, 'processed_messages.json')
+
+# Deleted rows are read from here by incremental runs (see migrations/012_message_delete_log.sql)
+DELETE_LOG = 'message_delete_log'
+
+# Tombstones are kept this long, so consumers that sync less often still see the deletes
+TOMBSTONE_RETENTION = timedelta(days=30)
+
+# A shard's delta log is folded into its base file once it holds this fraction of the base's records
+DELTA_COMPACT_RATIO = 0.25
+
+# Top-level messages further apart than this start a new document
+THREAD_WINDOW = timedelta(minutes=30)
+
+# Documents longer than this are split, repeating a thread's opening message
+MAX_DOCUMENT_CHARS = 4000
+# ...or longer than this many tokens (dense scripts hit it well before the character limit)
+MAX_DOCUMENT_TOKENS = 1000
+
+# Tokens a line's "Message: "/"Thread: "/"Reply: " prefix adds to its content
+LINE_PREFIX_TOKENS = 2
+
+# Partitions exported concurrently
+DEFAULT_WORKERS = 8
+
+# Rows fetched per request when paging through a source
+PAGE_SIZE = 1000
+
+# Columns selected from each source table
+SOURCES = {
+    'messages': 'id, content, channel_id, user_id, parent_id, created_at, updated_at, channels(name, team_id, teams(name))',
+    'direct_messages': 'id, content, channel_id, sender_id, created_at, updated_at',
+}
+
+def fetch_source(source: str, watermark: Optional[Dict] = None,
+                 channel_ids: Optional[List[str]] = None) -> List[Dict]:
+    """Fetch rows from a source table changed after the (updated_at, id) watermark"""
+    rows = []
+    cursor = watermark
+
+    while True:
+        query = supabase.table(source).select(SOURCES[source])
+        if channel_ids is not None:
+            query = query.in_('channel_id', channel_ids)
+        if cursor:
+            # Keyset pagination: strictly after the last (updated_at, id) seen
+            query = query.or_(
+                f'updated_at.gt."{cursor["updated_at"]}",'
+                f'and(updated_at.eq."{cursor["updated_at"]}",id.gt.{cursor["id"]})'
+            )
+        page = call_with_retries(query.order('updated_at').order('id').limit(PAGE_SIZE).execute, 'supabase').data
+        rows.extend(page)
+
+        if len(page) < PAGE_SIZE:
+            break
+        cursor = {'updated_at': page[-1]['updated_at'], 'id': page[-1]['id']}
+
+    return rows
+
+def scan_table(table: str, columns: str, channel_ids: Optional[List[str]] = None) -> List[Dict]:
+    """Page through every row of a table in id order"""
+    rows = []
+    last_id = None
+
+    while True:
+        query = supabase.table(table).select(columns)
+        if channel_ids is not None:
+            query = query.in_('channel_id', channel_ids)
+        if last_id:
+            query = query.gt('id', last_id)
+        page = call_with_retries(query.order('id').limit(PAGE_SIZE).execute, 'supabase').data
+        rows.extend(page)
+
+        if len(page) < PAGE_SIZE:
+            break
+        last_id = page[-1]['id']
+
+    return rows
+
+def delete_log_head() -> Optional[int]:
+    """Id of the newest delete log entry (0 when empty), or None without migrations/012_message_delete_log.sql"""
+    try:
+        rows = call_with_retries(supabase.table(DELETE_LOG).select('id').order('id', desc=True).limit(1).execute,
+                                 'supabase').data
+    except Exception as e:
+        print(f"⚠️  No {DELETE_LOG} ({e}); deletions are only dropped by a full export")
+        return None
+    return rows[0]['id'] if rows else 0
+
+def fetch_deletions(source: str, after: int, through: int, channel_ids: Optional[List[str]] = None) -> List[Dict]:
+    """Delete log entries of a source in (after, through], paging in log order"""
+    rows = []
+    cursor = after
+
+    while cursor < through:
+        query = (supabase.table(DELETE_LOG).select('id, message_id, channel_id, deleted_at')
+                 .eq('source', source).gt('id', cursor).lte('id', through))
+        if channel_ids is not None:
+            query = query.in_('channel_id', channel_ids)
+        page = call_with_retries(query.order('id').limit(PAGE_SIZE).execute, 'supabase').data
+        rows.extend(page)
+
+        if len(page) < PAGE_SIZE:
+            break
+        cursor = page[-1]['id']
+
+    return rows
+
+def prune_delete_log(through: int) -> None:
+    """Drop log entries a full export has made redundant"""
+    call_with_retries(supabase.table(DELETE_LOG).delete().lte('id', through).execute, 'supabase')
+
+def fetch_partitions() -> List[Dict]:
+    """Split the export into one partition per team plus one for direct messages"""
+    teams = {}
+    for channel in scan_table('channels', 'id, team_id, teams(name)'):
+        team = teams.setdefault(channel['team_id'], {
+            'name': f"team_{channel['team_id']}",
+            'source': 'messages',
+            'team_id': channel['team_id'],
+            'team_name': (channel.get('teams') or {}).get('name'),
+            'channel_ids': [],
+        })
+        team['channel_ids'].append(channel['id'])
+
+    partitions = sorted(teams.values(), key=lambda p: p['name'])
+    partitions.append({
+        'name': 'direct_messages',
+        'source': 'direct_messages',
+        'team_id': None,
+        'team_name': None,
+        'channel_ids': None,
+    })
+    return partitions
 
 def fetch_all_messages() -> List[Dict]:
     """Fetch all messages from both channels and DMs"""
-    # Fetch channel messages
-    channel_messages = supabase.table('messages').select(
-        'id, content, channel_id, user_id, parent_id, created_at, channels(name, team_id, teams(name))'
-    ).execute()
-    
-    # Fetch DM messages
-    dm_messages = supabase.table('direct_messages').select(
-        'id, content, channel_id, sender_id, created_at'
-    ).execute()
-    
-    return channel_messages.data + dm_messages.data
+    return fetch_source('messages') + fetch_source('direct_messages')
+
+def process_message(msg: Dict) -> Optional[str]:
+    """Format a single message for RAG, or None if it has no content"""
+    # Skip messages without content
+    if not msg.get('content'):
+        return None
+
+    # Process channel messages
+    if 'channels' in msg:
+        context = f"Team: {msg['channels']['teams']['name']}, Channel: {msg['channels']['name']}"
+        return f"Context: {context}\nMessage: {msg['content']}"
+
+    # Process DM messages
+    return f"Context: Direct Message\nMessage: {msg['content']}"
 
 def process_messages(messages: List[Dict]) -> List[str]:
     """Process messages into a format suitable for RAG"""
     processed_messages = []
-    
+
     for msg in messages:
-        # Skip messages without content
-        if not msg.get('content'):
-            continue
-        
-        # Process channel messages
-        if 'channels' in msg:
-            context = f"Team: {msg['channels']['teams']['name']}, Channel: {msg['channels']['name']}"
-            processed_text = f"Context: {context}\nMessage: {msg['content']}"
-        # Process DM messages
-        else:
-            processed_text = f"Context: Direct Message\nMessage: {msg['content']}"
-        
-        processed_messages.append(processed_text)
-    
+        processed_text = process_message(msg)
+        if processed_text is not None:
+            processed_messages.append(processed_text)
+
     return processed_messages
 
-def save_for_rag(processed_messages: List[str]) -> None:
-    """Save processed messages for RAG training"""
-    output_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'rag', 'data')
-    os.makedirs(output_dir, exist_ok=True)
-    
-    output_file = os.path.join(output_dir, 'processed_messages.json')
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump({
-            'messages': processed_messages,
-            'metadata': {
+def build_records(source: str, messages: List[Dict], normalize_workers: Optional[int] = None) -> List[Dict]:
+    """Flatten messages into export records keyed by source and id
+
+    Content is normalized on a process pool (see rag/normalization.py), which
+    also supplies the language, token count, URLs and mentions kept per record.
+    """
+    records = []
+
+    # Skip messages without content
+    messages = [msg for msg in messages if msg.get('content')]
+    normalized = normalize_many([msg['content'] for msg in messages], normalize_workers)
+
+    for msg, features in zip(messages, normalized):
+        if not features['text']:
+            continue
+        channel = msg.get('channels') or {}
+        records.append({
+            'id': msg['id'],
+            'source': source,
+            'channel_id': msg.get('channel_id'),
+            'team_name': (channel.get('teams') or {}).get('name'),
+            'channel_name': channel.get('name'),
+            'parent_id': msg.get('parent_id'),
+            'content': features['text'],
+            'language': features['language'],
+            'tokens': features['tokens'],
+            'urls': features['urls'],
+            'mentions': features['mentions'],
+            'created_at': msg.get('created_at'),
+            'updated_at': msg.get('updated_at') or msg.get('created_at'),
+        })
+
+    return records
+
+def record_context(record: Dict) -> str:
+    """The "Context:" header shared by every message in a channel"""
+    if record['source'] == 'direct_messages':
+        return "Context: Direct Message"
+    return f"Context: Team: {record['team_name']}, Channel: {record['channel_name']}"
+
+def record_text(record: Dict) -> str:
+    """Format a single record the way process_message() formats a row"""
+    return f"{record_context(record)}\nMessage: {record['content']}"
+
+def parse_timestamp(value: Optional[str]) -> datetime:
+    """Parse a Postgres timestamp, ordering missing values first"""
+    if not value:
+        return datetime.min.replace(tzinfo=timezone.utc)
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def normalize_line(text: str) -> str:
+    """Key used to drop repeated lines within one document"""
+    return ' '.join(text.lower().split())
+
+def line_tokens(record: Dict, text: str) -> int:
+    """Tokens in a rendered line, from the record's count when the export has one"""
+    if record.get('tokens') is not None:
+        return record['tokens'] + LINE_PREFIX_TOKENS
+    return count_tokens(text)
+
+def render_documents(unit: Dict, lines: List[tuple]) -> List[Dict]:
+    """Render a conversation unit's lines into documents under MAX_DOCUMENT_CHARS and MAX_DOCUMENT_TOKENS
+
+    Each line is a (message_id, text, record) triple. Repeated lines are dropped
+    but their ids stay in message_ids. Thread continuations repeat the opening
+    line so a reply never loses the question it answers. Each document carries
+    its token count and the most common language of its messages.
+    """
+    documents = []
+    base_id = f"{unit['source']}:{lines[0][0]}"
+    header = unit['context']
+    header_tokens = count_tokens(header)
+    lead = lines[0] if unit['kind'] == 'thread' else None
+    current = []
+    message_ids = []
+    languages = Counter()
+    seen = set()
+    size = len(header)
+    tokens = header_tokens
+
+    def flush():
+        if current:
+            documents.append({
+                'id': f"{base_id}:{len(documents)}" if documents else base_id,
+                'source': unit['source'],
+                'kind': unit['kind'],
+                'channel_id': unit['channel_id'],
+                'message_ids': list(message_ids),
+                'start': unit['start'],
+                'end': unit['end'],
+                'text': '\n'.join([header] + current),
+                'tokens': tokens,
+                'language': languages.most_common(1)[0][0] if languages else None,
+            })
+
+    for message_id, text, record in lines:
+        key = normalize_line(text.split(': ', 1)[-1])
+        if key in seen:
+            message_ids.append(message_id)
+            continue
+        seen.add(key)
+        text_tokens = line_tokens(record, text)
+
+        if current and (size + len(text) + 1 > MAX_DOCUMENT_CHARS
+                        or tokens + text_tokens > MAX_DOCUMENT_TOKENS):
+            flush()
+            current = []
+            message_ids = []
+            languages = Counter()
+            size = len(header)
+            tokens = header_tokens
+            if lead:
+                current.append(lead[1])
+                size += len(lead[1]) + 1
+                tokens += line_tokens(lead[2], lead[1])
+
+        current.append(text)
+        message_ids.append(message_id)
+        if record.get('language'):
+            languages[record['language']] += 1
+        size += len(text) + 1
+        tokens += text_tokens
+
+    flush()
+    return documents
+
+def build_documents(records: List[Dict]) -> List[Dict]:
+    """Group records into threads and time windows, one document per conversation unit
+
+    Replies are attached to the root of their thread through a single index
+    over parent_id. Top-level messages without replies are packed into windows
+    of consecutive messages no more than THREAD_WINDOW apart. The channel
+    context is written once per document instead of once per message.
+    """
+    by_id = {r['id']: r for r in records}
+    children = {}
+    for record in records:
+        if record.get('parent_id') in by_id:
+            children.setdefault(record['parent_id'], []).append(record)
+
+    def thread_of(root: Dict) -> List[Dict]:
+        thread = []
+        stack = [root]
+        while stack:
+            record = stack.pop()
+            thread.append(record)
+            stack.extend(children.get(record['id'], []))
+        return sorted(thread, key=lambda r: parse_timestamp(r['created_at']))
+
+    # Roots are messages whose parent is absent from this export
+    channels = {}
+    for record in records:
+        if record.get('parent_id') not in by_id:
+            channels.setdefault((record['source'], record['channel_id']), []).append(record)
+
+    documents = []
+    for (source, channel_id), roots in channels.items():
+        roots.sort(key=lambda r: (parse_timestamp(r['created_at']), r['id']))
+        window = []
+
+        def close_window():
+            if window:
+                unit = {
+                    'kind': 'window',
+                    'source': source,
+                    'channel_id': channel_id,
+                    'context': record_context(window[0]),
+                    'start': window[0]['created_at'],
+                    'end': window[-1]['created_at'],
+                }
+                documents.extend(render_documents(
+                    unit, [(r['id'], f"Message: {r['content']}", r) for r in window]))
+                window.clear()
+
+        for root in roots:
+            if root['id'] in children:
+                close_window()
+                thread = thread_of(root)
+                unit = {
+                    'kind': 'thread',
+                    'source': source,
+                    'channel_id': channel_id,
+                    'context': record_context(root),
+                    'start': thread[0]['created_at'],
+                    'end': thread[-1]['created_at'],
+                }
+                lines = [(root['id'], f"Thread: {root['content']}", root)]
+                lines.extend((r['id'], f"Reply: {r['content']}", r) for r in thread[1:])
+                documents.extend(render_documents(unit, lines))
+                continue
+
+            if window and (parse_timestamp(root['created_at'])
+                           - parse_timestamp(window[-1]['created_at'])) > THREAD_WINDOW:
+                close_window()
+            window.append(root)
+
+        close_window()
+
+    return documents
+
+def load_export(path: str) -> Dict:
+    """Load an existing export, or an empty one if none has been written yet"""
+    if not os.path.exists(path):
+        return {'records': [], 'tombstones': [], 'documents': []}
+
+    with open(path, 'r', encoding='utf-8') as f:
+        export = json.load(f)
+
+    # Older exports lack the per-message records documents are rebuilt from
+    if 'records' not in export or 'documents' not in export:
+        raise ValueError(f"{path} has no records; run a full export first")
+
+    return export
+
+def load_state() -> Dict:
+    """Load per-partition watermarks from the last successful run"""
+    if not os.path.exists(STATE_FILE):
+        return {'watermarks': {}}
+
+    with open(STATE_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_state(state: Dict) -> None:
+    """Persist per-partition watermarks for the next incremental run"""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+    with open(STATE_FILE, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+
+def next_watermark(rows: List[Dict], watermark: Optional[Dict]) -> Optional[Dict]:
+    """Advance a watermark past rows fetched in (updated_at, id) order"""
+    if not rows:
+        return watermark
+
+    return {'updated_at': rows[-1]['updated_at'], 'id': rows[-1]['id']}
+
+def merge_export(export: Dict, records: List[Dict], deleted: List[Dict]) -> Dict:
+    """Upsert changed records and apply tombstones to an existing export"""
+    merged = {(r['source'], r['id']): r for r in export['records']}
+    tombstones = {(t['source'], t['id']): t for t in export['tombstones']}
+
+    for record in records:
+        key = (record['source'], record['id'])
+        merged[key] = record
+        # A row that reappears (e.g. restored) is no longer deleted
+        tombstones.pop(key, None)
+
+    for tombstone in deleted:
+        key = (tombstone['source'], tombstone['id'])
+        merged.pop(key, None)
+        tombstones[key] = tombstone
+
+    return {
+        'records': list(merged.values()),
+        'tombstones': list(tombstones.values()),
+    }
+
+def prune_tombstones(tombstones: List[Dict]) -> List[Dict]:
+    """Drop tombstones older than TOMBSTONE_RETENTION"""
+    cutoff = datetime.now(timezone.utc) - TOMBSTONE_RETENTION
+    return [t for t in tombstones if parse_timestamp(t.get('deleted_at')) >= cutoff]
+
+def apply_delta(export: Dict, delta: Dict) -> Dict:
+    """An export with one delta log entry applied"""
+    merged = merge_export(export, delta['records'], delta['deleted'])
+    merged['documents'] = apply_delta_documents(export['documents'], delta)
+    return merged
+
+def write_export(path: str, records: List[Dict], tombstones: List[Dict], mode: str,
+                 documents: Optional[List[Dict]] = None) -> None:
+    """Write an export file atomically so a failed run never truncates it"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if documents is None:
+        documents = build_documents(records)
+
+    export = {
+        'messages': [record_text(r) for r in records],
+        'documents': documents,
+        'records': records,
+        'tombstones': tombstones,
+        'metadata': {
+            'created_at': datetime.now().isoformat(),
+            'count': len(records),
+            'documents': len(documents),
+            'mode': mode,
+        }
+    }
+
+    tmp_file = f"{path}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(export, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, path)
+
+def shard_path(partition: Dict) -> str:
+    """Location of the shard file for a partition"""
+    return os.path.join(SHARD_DIR, f"{partition['name']}.json")
+
+def delta_path(partition: Dict) -> str:
+    """Location of a shard's delta log: one JSON line per incremental run that changed it"""
+    return os.path.join(SHARD_DIR, f"{partition['name']}.delta.jsonl")
+
+def load_shard(partition: Dict) -> tuple:
+    """A shard with its delta log applied, plus the record count of its base file and of its deltas"""
+    export = load_export(shard_path(partition))
+    base_count = len(export['records'])
+    pending = 0
+
+    if base_count:
+        for delta in read_delta(delta_path(partition)):
+            export = apply_delta(export, delta)
+            pending += len(delta['records']) + len(delta['deleted'])
+
+    export['tombstones'] = prune_tombstones(export['tombstones'])
+    return export, base_count, pending
+
+def append_delta(partition: Dict, delta: Dict) -> None:
+    with open(delta_path(partition), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(delta, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def remove_delta(partition: Dict) -> None:
+    if os.path.exists(delta_path(partition)):
+        os.remove(delta_path(partition))
+
+def export_partition(partition: Dict, watermark: Optional[Dict], incremental: bool,
+                     deletes: Optional[tuple] = None, normalize_workers: Optional[int] = None) -> Dict:
+    """Fetch, process and write one partition's shard; returns its summary
+
+    An incremental run appends what changed to the shard's delta log, with
+    the documents of the channels it touched re-rendered, so its cost follows
+    the changes rather than the partition's history; a partition without
+    changes is not even read. deletes is the (after, through) range of the
+    delete log to apply. The summary's counts are None when the shard was
+    not read.
+    """
+    source = partition['source']
+    path = shard_path(partition)
+    appending = incremental and os.path.exists(path)
+    if not appending:
+        # No shard to merge into (full run, or a team new since the last run)
+        watermark = None
+
+    with metrics.stage('fetch'):
+        rows = fetch_source(source, watermark, partition['channel_ids'])
+    metrics.item('messages', len(rows))
+    entries = []
+    if appending and deletes:
+        with metrics.stage('deletions'):
+            entries = fetch_deletions(source, deletes[0], deletes[1], partition['channel_ids'])
+
+    summary = {
+        'name': partition['name'],
+        'file': os.path.basename(path),
+        'delta': os.path.basename(delta_path(partition)),
+        'team_id': partition['team_id'],
+        'team_name': partition['team_name'],
+        'count': None,
+        'documents': None,
+        'changed': 0,
+        'deleted': 0,
+        'written': not appending,
+        'watermark': next_watermark(rows, watermark),
+    }
+    if appending and not rows and not entries:
+        return summary
+
+    with metrics.stage('process'):
+        changed = build_records(source, rows, normalize_workers)
+    if appending:
+        export, base_count, pending = load_shard(partition)
+    else:
+        export, base_count, pending = {'records': [], 'tombstones': [], 'documents': []}, 0, 0
+
+    exported = {r['id']: r for r in export['records']}
+    deleted = []
+    if entries:
+        deleted = [{
+            'id': entry['message_id'],
+            'source': source,
+            'channel_id': entry['channel_id'],
+            'deleted_at': entry['deleted_at'],
+        } for entry in entries if entry['message_id'] in exported]
+
+    merged = merge_export(export, changed, deleted)
+    merged['tombstones'] = prune_tombstones(merged['tombstones'])
+    summary.update({
+        'count': len(merged['records']),
+        'documents': len(export['documents']),
+        'changed': len(changed),
+        'deleted': len(deleted),
+        'written': bool(changed or deleted) or not appending,
+    })
+    if not summary['written']:
+        return summary
+
+    if not appending:
+        merged['documents'] = build_documents(merged['records'])
+        summary['documents'] = len(merged['documents'])
+        with metrics.stage('write_shard'):
+            write_export(path, merged['records'], merged['tombstones'], 'full', merged['documents'])
+            remove_delta(partition)
+        return summary
+
+    # Re-render only the channels holding a changed or deleted message (before or after the change)
+    touched = {channel_key(r) for r in changed}
+    touched.update(channel_key(exported[r['id']]) for r in changed + deleted if r['id'] in exported)
+    documents = build_documents([r for r in merged['records'] if channel_key(r) in touched])
+    merged['documents'] = [d for d in export['documents'] if channel_key(d) not in touched] + documents
+    summary['documents'] = len(merged['documents'])
+
+    with metrics.stage('write_shard'):
+        if pending + len(changed) + len(deleted) > DELTA_COMPACT_RATIO * base_count:
+            # Fold the delta log into the base file, so loading a shard stays cheap
+            write_export(path, merged['records'], merged['tombstones'], 'incremental', merged['documents'])
+            remove_delta(partition)
+        else:
+            append_delta(partition, {
                 'created_at': datetime.now().isoformat(),
-                'count': len(processed_messages)
-            }
-        }, f, indent=2, ensure_ascii=False)
-    
-    print(f"✅ Saved {len(processed_messages)} processed messages to {output_file}")
+                'records': changed,
+                'deleted': deleted,
+                'channels': [list(channel) for channel in touched],
+                'documents': documents,
+            })
+    return summary
+
+def write_manifest(summaries: List[Dict], mode: str) -> None:
+    """List the shards for readers; shards this run did not read keep their counts from the last manifest"""
+    previous = {shard['name']: shard for shard in load_manifest(MANIFEST_FILE)['shards']}
+    shards = []
+    for summary in summaries:
+        shard = {key: summary[key] for key in ('name', 'file', 'delta', 'team_id', 'team_name', 'count', 'documents')}
+        if shard['count'] is None:
+            if summary['name'] in previous:
+                shard.update({key: previous[summary['name']][key] for key in ('count', 'documents')})
+            else:
+                export = load_shard(summary)[0]
+                shard.update({'count': len(export['records']), 'documents': len(export['documents'])})
+        shards.append(shard)
+
+    manifest = {
+        'created_at': datetime.now().isoformat(),
+        'mode': mode,
+        'count': sum(shard['count'] for shard in shards),
+        'documents': sum(shard['documents'] for shard in shards),
+        'shards': shards,
+    }
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    tmp_file = f"{MANIFEST_FILE}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, MANIFEST_FILE)
+
+    print(f"✅ {manifest['count']} processed messages as {manifest['documents']} documents "
+          f"in {len(shards)} shards, listed in {MANIFEST_FILE}")
+
+def remove_stale_shards(partitions: List[Dict]) -> int:
+    """Delete shard files (and delta logs) for teams that no longer exist; returns how many"""
+    if not os.path.isdir(SHARD_DIR):
+        return 0
+
+    current = {os.path.basename(path) for p in partitions for path in (shard_path(p), delta_path(p))}
+    removed = 0
+    for filename in os.listdir(SHARD_DIR):
+        if filename.endswith(('.json', '.jsonl')) and filename not in current | {os.path.basename(MANIFEST_FILE)}:
+            os.remove(os.path.join(SHARD_DIR, filename))
+            print(f"Removed stale shard {filename}")
+            removed += 1
+    return removed
+
+def run_export(incremental: bool, workers: int, normalize_workers: Optional[int] = None) -> None:
+    """Export every partition concurrently and list the shards in the manifest
+
+    Partitions share one pool of normalization processes, so CPU-bound text
+    work runs in parallel while the export threads wait on the network.
+    """
+    state = load_state() if incremental else {'watermarks': {}}
+    mode = 'incremental' if incremental else 'full'
+
+    # Deletes up to the log's current head are applied this run; later ones are left for the next
+    head = delete_log_head()
+    deletes = None
+    if incremental and head is not None:
+        if state.get('delete_cursor') is None:
+            print("No delete log cursor from the last run; deletions are dropped by the next full export")
+        else:
+            deletes = (state['delete_cursor'], head)
+
+    print("Fetching partitions...")
+    with metrics.stage('partitions'):
+        partitions = fetch_partitions()
+    print(f"Exporting {len(partitions)} partitions with {workers} workers...")
+
+    # The Supabase client keeps a single pooled HTTP session, shared by all workers
+    summaries = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(export_partition, partition,
+                            state['watermarks'].get(partition['name']), incremental,
+                            deletes, normalize_workers): partition
+            for partition in partitions
+        }
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries.append(summary)
+            print(f"  {summary['name']}: {summary['changed']} changed, {summary['deleted']} deleted")
+
+    summaries.sort(key=lambda s: s['name'])
+    removed = remove_stale_shards(partitions)
+    if any(s['written'] for s in summaries) or removed or not os.path.exists(MANIFEST_FILE):
+        with metrics.stage('manifest'):
+            write_manifest(summaries, mode)
+    else:
+        print("✅ No changes since the last run")
+    if os.path.exists(MERGED_FILE):
+        os.remove(MERGED_FILE)
+        print(f"Removed {MERGED_FILE}; readers now load the shards listed in the manifest")
+
+    if not incremental and head:
+        # A full export reflects every delete so far
+        prune_delete_log(head)
+
+    state = {
+        'watermarks': {s['name']: s['watermark'] for s in summaries},
+        'delete_cursor': head,
+        'updated_at': datetime.now().isoformat(),
+    }
+    save_state(state)
 
 def main():
     """Main function to prepare data for RAG"""
+    parser = argparse.ArgumentParser(description="Export chat messages for RAG")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only export messages changed since the last run")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help="number of partitions exported concurrently")
+    parser.add_argument('--normalize-workers', type=int,
+                        help="processes used to normalize message text (default: one per core)")
+    args = parser.parse_args()
+    metrics.start_profiling()
+
     print("🔄 Starting RAG data preparation...")
-    
-    print("Fetching messages...")
-    messages = fetch_all_messages()
-    
-    print("Processing messages...")
-    processed_messages = process_messages(messages)
-    
-    print("Saving processed messages...")
-    save_for_rag(processed_messages)
-    
+
+    incremental = args.incremental and os.path.exists(STATE_FILE)
+    if args.incremental and not incremental:
+        print("No previous watermarks found, running a full export")
+    run_export(incremental, args.workers, args.normalize_workers)
+
     print("✅ RAG data preparation completed!")
+    metrics.finish()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -1,28 +1,22 @@
 import json
 import os
 import random
+import sys
 import time
 from datetime import datetime, timedelta
 from typing import Dict, List
 import uuid
-from faker import Faker
-import openai
-from dotenv import load_dotenv
-from supabase import create_client, Client
-import httpx
-from functools import wraps
 
-# Load environment variables
-load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env.local'))
+# Shared pipeline helpers live in rag/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rag'))
+from clients import get_faker, get_supabase, LazyClient
+from instrumentation import metrics
+from resilience import with_retries
+from table_planner import delete_waves, run_waves
 
-# Initialize Faker
-fake = Faker()
-
-# Initialize Supabase client
-supabase: Client = create_client(
-    os.getenv('NEXT_PUBLIC_SUPABASE_URL', ''),
-    os.getenv('SUPABASE_SERVICE_ROLE_KEY', ''),  # Use service role key for admin access
-)
+# Faker and Supabase (service role key for admin access), built on first use
+fake = LazyClient(get_faker)
+supabase = LazyClient(lambda: get_supabase('service'))
 
 # Constants
 NUM_USERS = 20
@@ -31,30 +25,14 @@ CHANNELS_PER_TEAM = 5
 MESSAGES_PER_CHANNEL = 50
 DMS_PER_USER = 10
 MESSAGES_PER_DM = 20
-MAX_RETRIES = 3
-RETRY_DELAY = 1  # seconds
-
-def retry_on_network_error(max_retries=MAX_RETRIES, delay=RETRY_DELAY):
-    """Decorator to retry functions on network errors"""
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            for attempt in range(max_retries):
-                try:
-                    return func(*args, **kwargs)
-                except (httpx.NetworkError, httpx.ReadError) as e:
-                    if attempt == max_retries - 1:
-                        print(f"Failed after {max_retries} attempts: {str(e)}")
-                        raise
-                    print(f"Network error, retrying in {delay} seconds... ({attempt + 1}/{max_retries})")
-                    time.sleep(delay * (attempt + 1))  # Exponential backoff
-            return None
-        return wrapper
-    return decorator
 
-@retry_on_network_error()
+@with_retries('supabase')
 def safe_supabase_operation(operation_func):
-    """Safely execute a Supabase operation with retry logic"""
+    """Safely execute a Supabase operation with retry logic
+
+    Every row this script inserts carries its own key, so operations are safe
+    to retry.
+    """
     try:
         result = operation_func()
         time.sleep(0.1)  # Small delay between operations
@@ -128,24 +106,25 @@ def cleanup_database():
             os.remove(file_path)
             print(f"Cleaned up {file}")
     
-    # Delete existing data in reverse order of dependencies
-    tables_with_conditions = [
-        ('reactions', 'id'),
-        ('direct_message_reactions', 'id'),
-        ('messages', 'id'),
-        ('direct_messages', 'id'),
-        ('channel_members', 'channel_id'),
-        ('direct_message_participants', 'channel_id'),
-        ('channels', 'id'),
-        ('direct_message_channels', 'id'),
-        ('team_members', 'team_id'),
-        ('teams', 'id'),
-        ('user_profiles', 'id')
-    ]
+    # Column each table's rows are selected and deleted by; the order comes from the foreign keys
+    key_columns = {
+        'reactions': 'id',
+        'direct_message_reactions': 'id',
+        'messages': 'id',
+        'direct_messages': 'id',
+        'channel_members': 'channel_id',
+        'direct_message_participants': 'channel_id',
+        'channels': 'id',
+        'direct_message_channels': 'id',
+        'team_members': 'team_id',
+        'teams': 'id',
+        'user_profiles': 'id',
+    }
     
     BATCH_SIZE = 50  # Reduced batch size
     
-    for table, key_column in tables_with_conditions:
+    def clean_table(table):
+        key_column = key_columns[table]
         try:
             # Get total count first
             count_result = safe_supabase_operation(
@@ -183,7 +162,9 @@ def cleanup_database():
                 
         except Exception as e:
             print(f"Error cleaning up {table}: {str(e)}")
-            continue
+    
+    # Tables nothing else still references are cleaned together, a wave at a time
+    run_waves(delete_waves(key_columns), clean_table)
     
     print("✅ Cleanup completed!")
 
@@ -495,6 +476,7 @@ def create_messages(channels: List[Dict], users: List[Dict]) -> None:
                 lambda: supabase.table('messages').insert(message).execute()
             )
             channel_messages[channel['id']].append(message)
+            metrics.item('messages')
             
             if parent_id:
                 print(f"Created reply in thread of channel #{channel['name']}")
@@ -615,6 +597,7 @@ def create_direct_messages(users: List[Dict]) -> None:
                 safe_supabase_operation(
                     lambda: supabase.table('direct_messages').insert(message).execute()
                 )
+                metrics.item('direct_messages')
                 
                 # Add reactions sometimes
                 if random.random() < 0.2:  # 20% chance of reactions
@@ -632,27 +615,35 @@ def create_direct_messages(users: List[Dict]) -> None:
 
 def main():
     """Main function to seed the database"""
+    metrics.start_profiling()
     print("🌱 Starting database seeding...")
     
     # Clean up existing data first
-    cleanup_database()
+    with metrics.stage('cleanup'):
+        cleanup_database()
     
     print("\nCreating users...")
-    users = create_users()
+    with metrics.stage('users'):
+        users = create_users()
     
     print("\nCreating teams...")
-    teams = create_teams(users)
+    with metrics.stage('teams'):
+        teams = create_teams(users)
     
     print("\nCreating channels...")
-    channels = create_channels(teams)
+    with metrics.stage('channels'):
+        channels = create_channels(teams)
     
     print("\nCreating messages...")
-    create_messages(channels, users)
+    with metrics.stage('messages'):
+        create_messages(channels, users)
     
     print("\nCreating direct messages...")
-    create_direct_messages(users)
+    with metrics.stage('direct_messages'):
+        create_direct_messages(users)
     
     print("\n✅ Seeding completed!")
+    metrics.finish()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
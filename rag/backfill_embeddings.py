@@ -0,0 +1,212 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+from clients import get_supabase
+from embedding_worker import EMBEDDING_MODEL, MAX_EMBEDDING_TOKENS, embed_batch
+from instrumentation import metrics
+from normalization import count_tokens
+from query_cache import invalidate_team
+from reindex_embeddings import DEFAULT_RATE, Throttle, get_models
+from resilience import call_with_retries
+
+# Rows per page when scanning ids (PostgREST's default row limit)
+PAGE_SIZE = 1000
+
+# Messages embedded per request and stored per RPC call
+DEFAULT_BATCH_SIZE = 100
+
+# Batches embedded concurrently
+DEFAULT_WORKERS = 4
+
+# Source tables, where their embeddings live and how a batch is fetched and stored
+SOURCES = {
+    'messages': {
+        'embeddings': 'message_embeddings',
+        'columns': 'id, content, channels(team_id)',
+        'store': 'store_message_embeddings',
+    },
+    'direct_messages': {
+        'embeddings': 'direct_message_embeddings',
+        'columns': 'id, content, channel_id',
+        'store': 'store_direct_message_embeddings',
+    },
+}
+
+def scan_ids(table: str, column: str = 'id', extra: Optional[str] = None) -> Dict[str, Optional[str]]:
+    """Every value of a uuid column, paging in key order; maps each to the extra column if given"""
+    ids = {}
+    last = None
+    columns = f"{column}, {extra}" if extra else column
+
+    while True:
+        query = get_supabase('service').table(table).select(columns)
+        if last:
+            query = query.gt(column, last)
+        page = call_with_retries(query.order(column).limit(PAGE_SIZE).execute, 'supabase').data
+        for row in page:
+            ids[row[column]] = row.get(extra) if extra else None
+        if len(page) < PAGE_SIZE:
+            break
+        last = page[-1][column]
+
+    return ids
+
+def scan_coverage(sources: List[str]) -> Dict[str, Dict]:
+    """Source ids and embedded ids for each source, scanned concurrently"""
+    scans = {}
+    with ThreadPoolExecutor(max_workers=2 * len(sources)) as executor:
+        futures = {}
+        for source in sources:
+            # parent_id tells thread replies apart from top-level channel messages
+            extra = 'parent_id' if source == 'messages' else None
+            futures[executor.submit(scan_ids, source, 'id', extra)] = (source, 'ids')
+            futures[executor.submit(scan_ids, SOURCES[source]['embeddings'], 'message_id')] = (source, 'embedded')
+        with metrics.stage('scan'):
+            for future in as_completed(futures):
+                source, key = futures[future]
+                scans.setdefault(source, {})[key] = future.result()
+
+    coverage = {}
+    for source, scan in scans.items():
+        ids, embedded = scan['ids'], set(scan['embedded'])
+        missing = set(ids) - embedded
+        kinds = {}
+        for message_id, parent_id in ids.items():
+            kind = 'direct' if source == 'direct_messages' else ('reply' if parent_id else 'top_level')
+            counts = kinds.setdefault(kind, {'total': 0, 'embedded': 0})
+            counts['total'] += 1
+            counts['embedded'] += message_id not in missing
+        coverage[source] = {
+            'missing': sorted(missing),
+            'kinds': kinds,
+            'kind_of': {message_id: 'reply' if parent_id else 'top_level' for message_id, parent_id in ids.items()}
+                       if source == 'messages' else None,
+            # Embeddings whose message is gone; the foreign keys should keep this at zero
+            'orphaned': len(embedded - set(ids)),
+        }
+    return coverage
+
+def models_for(table: str) -> Dict:
+    try:
+        return get_models(table)
+    except Exception as e:
+        print(f"⚠️  No embedding model registry for {table} ({e}); using {EMBEDDING_MODEL}")
+        return {'model': EMBEDDING_MODEL, 'version': 1}
+
+def fetch_batch(source: str, ids: List[str]) -> List[Dict]:
+    """Current content of a batch of messages, shaped like embedding_worker changes"""
+    rows = call_with_retries(get_supabase('service').table(source).select(SOURCES[source]['columns'])
+                             .in_('id', ids).execute, 'supabase').data
+    batch = []
+    for row in rows:
+        change = {'message_id': row['id'], 'content': row['content']}
+        if source == 'messages':
+            change['team_id'] = (row.get('channels') or {}).get('team_id')
+        else:
+            change['channel_id'] = row['channel_id']
+        batch.append(change)
+    return batch
+
+def backfill_batch(source: str, ids: List[str], models: Dict, throttle: Throttle) -> Tuple[int, List[str]]:
+    """Embed and store one batch of missing messages; returns (rows stored, ids stored or attempted)"""
+    with metrics.stage('fetch'):
+        batch = fetch_batch(source, ids)
+    batch = [c for c in batch if c['content'] and count_tokens(c['content']) <= MAX_EMBEDDING_TOKENS]
+    if not batch:
+        return 0, []
+
+    throttle.wait(len(batch))
+    rows = embed_batch(batch, models=models)
+    params = {'p_rows': rows}
+    if source == 'messages':
+        # No outbox changes to acknowledge; the worker skips any it later finds already embedded
+        params['p_change_ids'] = []
+    with metrics.stage('store'):
+        stored = call_with_retries(get_supabase('service').rpc(SOURCES[source]['store'], params).execute,
+                                   'supabase').data or 0
+    metrics.item('backfill', stored)
+    if stored:
+        # Cached hybrid_search results of these teams predate the new vectors
+        for team_id in {c['team_id'] for c in batch if c.get('team_id')}:
+            invalidate_team(team_id)
+    return stored, [c['message_id'] for c in batch]
+
+def print_coverage(coverage: Dict[str, Dict], title: str) -> None:
+    print(f"📊 {title}")
+    for source, report in coverage.items():
+        for kind, counts in sorted(report['kinds'].items()):
+            percent = 100 * counts['embedded'] / counts['total'] if counts['total'] else 100.0
+            print(f"  {source:16s} {kind:10s} {counts['embedded']:8d}/{counts['total']:<8d} {percent:6.2f}%")
+        if report['orphaned']:
+            print(f"  ⚠️  {report['orphaned']} {SOURCES[source]['embeddings']} rows point at missing {source}")
+
+def run_backfill(sources: List[str], batch_size: int = DEFAULT_BATCH_SIZE, workers: int = DEFAULT_WORKERS,
+                 rate: float = DEFAULT_RATE, limit: Optional[int] = None, dry_run: bool = False) -> Dict:
+    """Embed every source row that has no embedding yet; returns the coverage after the run"""
+    start = time.perf_counter()
+    coverage = scan_coverage(sources)
+    print(f"Scanned ids in {time.perf_counter() - start:.1f}s")
+    print_coverage(coverage, "Coverage before backfill")
+
+    jobs = []
+    for source in sources:
+        missing = coverage[source]['missing'][:limit] if limit is not None else coverage[source]['missing']
+        jobs.extend((source, missing[i:i + batch_size]) for i in range(0, len(missing), batch_size))
+    total = sum(len(ids) for _, ids in jobs)
+    if dry_run or not jobs:
+        print(f"{total} messages missing embeddings" + (" (dry run)" if dry_run and jobs else ""))
+        return coverage
+
+    print(f"🧩 Embedding {total} messages in {len(jobs)} batches with {workers} workers")
+    models = {source: models_for(SOURCES[source]['embeddings']) for source in sources}
+    # One throttle for every worker, so the rate limit holds across them
+    throttle = Throttle(rate)
+    stored_total = failed = 0
+    embed_start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(backfill_batch, source, ids, models[source], throttle): (source, ids)
+                   for source, ids in jobs}
+        for done, future in enumerate(as_completed(futures), 1):
+            source, ids = futures[future]
+            try:
+                stored, attempted = future.result()
+            except Exception as e:
+                failed += len(ids)
+                print(f"❌ Batch of {len(ids)} {source} failed: {e}")
+                continue
+            stored_total += stored
+            report = coverage[source]
+            for message_id in attempted[:stored]:
+                # Stored counts may fall short of attempted when content changed mid-run; the next run catches those
+                kind = report['kind_of'][message_id] if report['kind_of'] else 'direct'
+                report['kinds'][kind]['embedded'] += 1
+            elapsed = time.perf_counter() - embed_start
+            print(f"  batch {done}/{len(jobs)}: {stored}/{len(ids)} {source} stored "
+                  f"({stored_total / elapsed:.1f} rows/s)")
+
+    elapsed = time.perf_counter() - embed_start
+    print_coverage(coverage, "Coverage after backfill")
+    print(f"✅ Stored {stored_total} embeddings in {elapsed:.1f}s ({stored_total / max(elapsed, 1e-9):.1f} rows/s)"
+          + (f", {failed} failed" if failed else ""))
+    return coverage
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed channel messages, replies and direct messages that have no embedding")
+    parser.add_argument('--source', choices=list(SOURCES), action='append',
+                        help="Source to backfill (repeatable; default: all)")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Batches embedded concurrently")
+    parser.add_argument('--rate', type=float, default=DEFAULT_RATE, help="Maximum rows per second (0 for unthrottled)")
+    parser.add_argument('--limit', type=int, help="Embed at most this many messages per source")
+    parser.add_argument('--dry-run', action='store_true', help="Only report coverage")
+    args = parser.parse_args()
+    metrics.start_profiling()
+
+    run_backfill(args.source or list(SOURCES), args.batch_size, args.workers, args.rate, args.limit, args.dry_run)
+    metrics.finish()
+
+if __name__ == "__main__":
+    main()
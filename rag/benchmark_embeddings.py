@@ -0,0 +1,118 @@
+import argparse
+import json
+import os
+import random
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from embedding_backends import get_backend
+from message_export import load_documents
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+TWEETS_FILE = os.path.join(DATA_DIR, 'processedtweets.json')
+
+DEFAULT_REFERENCE = 'text-embedding-3-small'
+DEFAULT_BACKENDS = ['local:sentence-transformers/all-MiniLM-L6-v2', 'hashing:1536']
+
+def load_texts(path: Optional[str] = None) -> List[str]:
+    """Benchmark texts: a JSON list / JSON lines file, or the exported messages and tweets"""
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            if path.endswith('.jsonl'):
+                return [json.loads(line)['content'] for line in f if line.strip()]
+            data = json.load(f)
+        if isinstance(data, dict) and 'shards' in data:
+            return [document['text'] for document in load_documents(path)]
+        return data if isinstance(data, list) else data.get('tweets') or [d['text'] for d in data['documents']]
+
+    texts = [document['text'] for document in load_documents()]
+    if os.path.exists(TWEETS_FILE):
+        with open(TWEETS_FILE, 'r', encoding='utf-8') as f:
+            texts.extend(json.load(f)['tweets'])
+    if not texts:
+        raise ValueError("No texts found; run prepare_rag_data.py / process_tweets.py or pass --file")
+    return texts
+
+def run_backend(model: str, texts: List[str], batch_size: int) -> Dict:
+    """Embed texts in batches; returns the vectors with load time and throughput"""
+    start = time.perf_counter()
+    backend = get_backend(model)
+    # Load the model (and warm up any lazy initialization) outside the timed run
+    backend.embed(texts[:1])
+    load_seconds = time.perf_counter() - start
+
+    vectors = []
+    start = time.perf_counter()
+    for i in range(0, len(texts), batch_size):
+        vectors.extend(backend.embed(texts[i:i + batch_size]))
+    seconds = time.perf_counter() - start
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    return {
+        'model': model,
+        'dim': matrix.shape[1],
+        'load_seconds': load_seconds,
+        'seconds': seconds,
+        'texts_per_second': len(texts) / seconds if seconds else float('inf'),
+        'vectors': matrix,
+    }
+
+def neighbors(vectors: np.ndarray, queries: List[int], k: int) -> List[set]:
+    """Top-k nearest texts (excluding itself) for each query index, by cosine similarity"""
+    scores = vectors[queries] @ vectors.T
+    scores[np.arange(len(queries)), queries] = -np.inf
+    top = np.argpartition(-scores, k, axis=1)[:, :k]
+    return [set(row.tolist()) for row in top]
+
+def recall_at_k(truth: List[set], found: List[set]) -> float:
+    return float(np.mean([len(t & f) / len(t) for t, f in zip(truth, found)])) if truth else 0.0
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding backends on throughput and recall against a reference model")
+    parser.add_argument('--backend', action='append', dest='backends',
+                        help=f"Model to benchmark (repeatable; default: {', '.join(DEFAULT_BACKENDS)})")
+    parser.add_argument('--reference', default=DEFAULT_REFERENCE,
+                        help="Model whose neighbours count as ground truth")
+    parser.add_argument('--file', help="JSON or JSON lines file of texts (default: the exported messages and tweets)")
+    parser.add_argument('--sample', type=int, default=1000, help="Texts to embed")
+    parser.add_argument('--queries', type=int, default=100, help="Texts used as queries for recall")
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    texts = load_texts(args.file)
+    rng = random.Random(args.seed)
+    texts = rng.sample(texts, min(args.sample, len(texts)))
+    if len(texts) <= args.k:
+        raise ValueError(f"Need more than {args.k} texts, got {len(texts)}")
+    queries = rng.sample(range(len(texts)), min(args.queries, len(texts)))
+    print(f"📏 {len(texts)} texts, {len(queries)} queries, recall@{args.k} against {args.reference}")
+
+    results = []
+    reference = run_backend(args.reference, texts, args.batch_size)
+    truth = neighbors(reference['vectors'], queries, args.k)
+    for model in [args.reference] + (args.backends or DEFAULT_BACKENDS):
+        try:
+            result = reference if model == args.reference else run_backend(model, texts, args.batch_size)
+        except Exception as e:
+            print(f"⚠️  Skipping {model}: {e}")
+            continue
+        result['recall'] = recall_at_k(truth, neighbors(result['vectors'], queries, args.k))
+        results.append({key: value for key, value in result.items() if key != 'vectors'})
+
+    print(f"{'model':50s} {'dim':>5s} {'load s':>8s} {'texts/s':>10s} {'recall@' + str(args.k):>10s}")
+    for r in results:
+        print(f"{r['model']:50s} {r['dim']:5d} {r['load_seconds']:8.2f} {r['texts_per_second']:10.1f} {r['recall']:10.3f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'texts': len(texts), 'queries': len(queries), 'k': args.k,
+                       'reference': args.reference, 'results': results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import json
+import math
+import os
+import re
+import zlib
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+# Default location of the persisted lexical index
+INDEX_DIR = os.path.join(os.path.dirname(__file__), 'data', 'bm25')
+
+# Standard BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Rebuild postings once this fraction of indexed documents has been replaced or removed
+COMPACT_RATIO = 0.25
+
+URL_PATTERN = re.compile(r'https?://\S+')
+TOKEN_PATTERN = re.compile(r'\w+')
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word tokens, ignoring URLs"""
+    return TOKEN_PATTERN.findall(URL_PATTERN.sub(' ', text.lower()))
+
+def content_hash(text: str) -> int:
+    return zlib.crc32(text.encode('utf-8'))
+
+class BM25Index:
+    """Incrementally built BM25 inverted index
+
+    Postings are typed arrays (uint32 document ids, uint16 term frequencies)
+    rather than Python objects, so an index over millions of messages stays
+    small. Documents are identified by string keys; re-adding a key with
+    different text replaces it, and unchanged texts are skipped, so rebuilding
+    from a refreshed export only touches what changed. aliases map other ids
+    (e.g. the message ids inside a thread document) to the document key.
+    """
+
+    def __init__(self):
+        self.keys: List[str] = []
+        self.hashes = array('I')
+        self.origins = array('H')
+        self.lengths = array('I')
+        self.key_to_doc: Dict[str, int] = {}
+        self.deleted: Set[int] = set()
+        self.total_length = 0
+        self.vocab: Dict[str, int] = {}
+        self.doc_postings: List[array] = []
+        self.tf_postings: List[array] = []
+        self.origin_names: List[str] = []
+        self.aliases: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self.key_to_doc)
+
+    def _origin(self, origin: str) -> int:
+        if origin not in self.origin_names:
+            self.origin_names.append(origin)
+        return self.origin_names.index(origin)
+
+    def add(self, key: str, text: str, origin: str = '', aliases: Iterable[str] = ()) -> bool:
+        """Index a document; returns False if it was already indexed with the same text"""
+        digest = content_hash(text)
+        existing = self.key_to_doc.get(key)
+        if existing is not None:
+            if self.hashes[existing] == digest:
+                return False
+            self.remove(key)
+
+        doc = len(self.keys)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                term_id = self.vocab[term] = len(self.doc_postings)
+                self.doc_postings.append(array('I'))
+                self.tf_postings.append(array('H'))
+            self.doc_postings[term_id].append(doc)
+            self.tf_postings[term_id].append(min(tf, 0xFFFF))
+
+        length = sum(counts.values())
+        self.keys.append(key)
+        self.hashes.append(digest)
+        self.origins.append(self._origin(origin))
+        self.lengths.append(length)
+        self.key_to_doc[key] = doc
+        self.total_length += length
+        for alias in aliases:
+            self.aliases[alias] = key
+        return True
+
+    def remove(self, key: str) -> bool:
+        """Drop a document; its postings are reclaimed on the next compaction"""
+        doc = self.key_to_doc.pop(key, None)
+        if doc is None:
+            return False
+        self.deleted.add(doc)
+        self.total_length -= self.lengths[doc]
+        return True
+
+    def sync(self, origin: str, documents: Dict[str, str],
+             aliases: Optional[Dict[str, Iterable[str]]] = None) -> Dict[str, int]:
+        """Make the documents from one origin (e.g. an export file) match the given set
+
+        Adds new and changed documents and removes ones that are gone, leaving
+        documents from other origins untouched.
+        """
+        aliases = aliases or {}
+        origin_id = self._origin(origin)
+        stale = [key for key, doc in self.key_to_doc.items()
+                 if self.origins[doc] == origin_id and key not in documents]
+        for key in stale:
+            self.remove(key)
+
+        added = sum(1 for key, text in documents.items() if self.add(key, text, origin, aliases.get(key, ())))
+        # Drop aliases whose document is gone
+        self.aliases = {alias: key for alias, key in self.aliases.items() if key in self.key_to_doc}
+        if len(self.deleted) > COMPACT_RATIO * max(len(self.keys), 1):
+            self.compact()
+        return {'added': added, 'removed': len(stale), 'unchanged': len(documents) - added}
+
+    def compact(self) -> None:
+        """Renumber live documents and drop deleted ones from every posting list"""
+        if not self.deleted:
+            return
+        live = np.array(sorted(self.key_to_doc.values()), dtype=np.int64)
+        remap = np.full(len(self.keys), -1, dtype=np.int64)
+        remap[live] = np.arange(len(live))
+
+        vocab, doc_postings, tf_postings = {}, [], []
+        for term, term_id in self.vocab.items():
+            docs = remap[np.frombuffer(self.doc_postings[term_id], dtype=np.uint32)]
+            keep = docs >= 0
+            if not keep.any():
+                continue
+            vocab[term] = len(doc_postings)
+            doc_postings.append(array('I', docs[keep].astype(np.uint32).tobytes()))
+            tf_postings.append(array('H', np.frombuffer(self.tf_postings[term_id], dtype=np.uint16)[keep].tobytes()))
+
+        self.keys = [self.keys[i] for i in live]
+        self.hashes = array('I', (self.hashes[i] for i in live))
+        self.origins = array('H', (self.origins[i] for i in live))
+        self.lengths = array('I', (self.lengths[i] for i in live))
+        self.key_to_doc = {key: i for i, key in enumerate(self.keys)}
+        self.vocab, self.doc_postings, self.tf_postings = vocab, doc_postings, tf_postings
+        self.deleted = set()
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """Top-k (key, score) pairs for a query"""
+        live = len(self.key_to_doc)
+        if not live:
+            return []
+        avg_length = self.total_length / live
+        lengths = np.frombuffer(self.lengths, dtype=np.uint32).astype(np.float32)
+        norms = K1 * (1 - B + B * lengths / max(avg_length, 1e-9))
+        scores = np.zeros(len(self.keys), dtype=np.float32)
+
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            docs = np.frombuffer(self.doc_postings[term_id], dtype=np.uint32)
+            tfs = np.frombuffer(self.tf_postings[term_id], dtype=np.uint16).astype(np.float32)
+            df = len(docs)
+            idf = math.log(1 + (live - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tfs * (K1 + 1) / (tfs + norms[docs])
+
+        if self.deleted:
+            scores[list(self.deleted)] = 0
+        k = min(k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.keys[i], float(scores[i])) for i in top]
+
+    def resolve(self, alias: str) -> Optional[str]:
+        """Document key for an id (a key itself or one of its aliases)"""
+        if alias in self.key_to_doc:
+            return alias
+        return self.aliases.get(alias)
+
+    def save(self, path: str = INDEX_DIR) -> None:
+        """Persist the index as flat arrays plus a JSON header, replacing any previous copy"""
+        self.compact()
+        os.makedirs(path, exist_ok=True)
+        terms = list(self.vocab)
+        counts = np.array([len(self.doc_postings[self.vocab[t]]) for t in terms], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+        arrays_file = os.path.join(path, 'postings.npz')
+        with open(arrays_file + '.tmp', 'wb') as f:
+            np.savez(
+                f,
+                offsets=offsets,
+                docs=np.frombuffer(b''.join(self.doc_postings[self.vocab[t]].tobytes() for t in terms),
+                                   dtype=np.uint32),
+                tfs=np.frombuffer(b''.join(self.tf_postings[self.vocab[t]].tobytes() for t in terms),
+                                  dtype=np.uint16),
+                hashes=np.frombuffer(self.hashes, dtype=np.uint32),
+                origins=np.frombuffer(self.origins, dtype=np.uint16),
+                lengths=np.frombuffer(self.lengths, dtype=np.uint32),
+            )
+        header_file = os.path.join(path, 'index.json')
+        with open(header_file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({
+                'terms': terms,
+                'keys': self.keys,
+                'origins': self.origin_names,
+                'aliases': self.aliases,
+                'total_length': self.total_length,
+            }, f, ensure_ascii=False)
+        os.replace(arrays_file + '.tmp', arrays_file)
+        os.replace(header_file + '.tmp', header_file)
+
+    @classmethod
+    def load(cls, path: str = INDEX_DIR) -> 'BM25Index':
+        """Load a saved index, or return an empty one if none exists"""
+        index = cls()
+        header_file = os.path.join(path, 'index.json')
+        if not os.path.exists(header_file):
+            return index
+
+        with open(header_file, 'r', encoding='utf-8') as f:
+            header = json.load(f)
+        data = np.load(os.path.join(path, 'postings.npz'))
+        offsets, docs, tfs = data['offsets'], data['docs'], data['tfs']
+
+        index.keys = header['keys']
+        index.origin_names = header['origins']
+        index.aliases = header['aliases']
+        index.total_length = header['total_length']
+        index.hashes = array('I', data['hashes'].tobytes())
+        index.origins = array('H', data['origins'].tobytes())
+        index.lengths = array('I', data['lengths'].tobytes())
+        index.key_to_doc = {key: i for i, key in enumerate(index.keys)}
+        for term_id, term in enumerate(header['terms']):
+            index.vocab[term] = term_id
+            start, end = offsets[term_id], offsets[term_id + 1]
+            index.doc_postings.append(array('I', docs[start:end].tobytes()))
+            index.tf_postings.append(array('H', tfs[start:end].tobytes()))
+        return index
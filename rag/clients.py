@@ -0,0 +1,117 @@
+import os
+import threading
+from typing import Any, Callable, Dict
+
+from instrumentation import instrument_http_client
+from transport import build_http_client
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENV_FILE = os.path.join(ROOT_DIR, '.env.local')
+
+# Environment variable holding the key for each Supabase role
+SUPABASE_KEYS = {
+    'anon': 'NEXT_PUBLIC_SUPABASE_ANON_KEY',
+    'service': 'SUPABASE_SERVICE_ROLE_KEY',
+}
+
+_lock = threading.RLock()
+_clients: Dict[str, Any] = {}
+_env_loaded = False
+
+def load_env() -> None:
+    """Load .env.local from the repository root, once per process"""
+    global _env_loaded
+    with _lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv(dotenv_path=ENV_FILE)
+            _env_loaded = True
+
+def _cached(name: str, factory: Callable[[], Any]) -> Any:
+    """Build a client on first use and hand out the same instance afterwards"""
+    client = _clients.get(name)
+    if client is None:
+        with _lock:
+            client = _clients.get(name)
+            if client is None:
+                client = _clients[name] = factory()
+    return client
+
+def get_http_client(service: str):
+    """Shared pooled HTTP client for a service, reused by every client talking to it"""
+    def factory():
+        http_client = build_http_client(service)
+        instrument_http_client(http_client, service)
+        return http_client
+    return _cached(f'http:{service}', factory)
+
+def get_supabase(role: str = 'anon'):
+    """Shared Supabase client for the 'anon' or 'service' role
+
+    REST, auth and storage calls for every role go through one pooled HTTP
+    client, so connections to the project are reused across all of them.
+    """
+    def factory():
+        from supabase import ClientOptions, create_client
+        load_env()
+        return create_client(
+            os.getenv('NEXT_PUBLIC_SUPABASE_URL', ''),
+            os.getenv(SUPABASE_KEYS[role], ''),
+            options=ClientOptions(httpx_client=get_http_client('supabase')),
+        )
+    return _cached(f'supabase:{role}', factory)
+
+def get_openai():
+    """Shared OpenAI client"""
+    def factory():
+        from openai import DefaultHttpxClient, OpenAI
+        load_env()
+        api_key = os.getenv('OPENAI_API_KEY')
+        if not api_key or api_key == 'your_openai_api_key_here':
+            raise RuntimeError("Please set your OpenAI API key in .env.local")
+        # DefaultHttpxClient keeps the SDK's own timeouts and redirect settings
+        http_client = build_http_client('openai', DefaultHttpxClient)
+        instrument_http_client(http_client, 'openai')
+        # Retries are handled by resilience.call_with_retries, not the SDK
+        return OpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+    return _cached('openai', factory)
+
+def get_twitter():
+    """Shared tweepy client for the Twitter v2 API"""
+    def factory():
+        import tweepy
+        from dotenv import load_dotenv
+        load_dotenv()
+        return tweepy.Client(
+            bearer_token=os.getenv('TWITTER_BEARER_TOKEN'),
+            consumer_key=os.getenv('TWITTER_API_KEY'),
+            consumer_secret=os.getenv('TWITTER_API_SECRET'),
+            access_token=os.getenv('TWITTER_ACCESS_TOKEN'),
+            access_token_secret=os.getenv('TWITTER_ACCESS_TOKEN_SECRET'),
+        )
+    return _cached('twitter', factory)
+
+def get_faker():
+    """Shared Faker instance"""
+    def factory():
+        from faker import Faker
+        return Faker()
+    return _cached('faker', factory)
+
+class LazyClient:
+    """Stand-in for a module-level client that is only built on first attribute access
+
+    Lets scripts keep `supabase.table(...)` style call sites without paying for
+    imports, configuration or connections at import time.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        self._factory = factory
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._factory(), name)
+
+def reset_clients() -> None:
+    """Drop every cached client so the next use builds a fresh one"""
+    with _lock:
+        _clients.clear()
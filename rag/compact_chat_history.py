@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from clients import get_openai, get_supabase
+from instrumentation import metrics
+from normalization import count_tokens
+from reindex_embeddings import embed_texts
+from resilience import call_with_retries
+
+# Model that writes the summaries, and the one that embeds them for match_chat_summaries
+SUMMARY_MODEL = os.getenv('CHAT_SUMMARY_MODEL', 'gpt-4o-mini')
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Newest turns of every conversation that are always kept verbatim
+DEFAULT_KEEP_RECENT = 20
+
+# Only turns at least this old are compacted, so an active conversation is left alone
+DEFAULT_MIN_AGE_HOURS = 24.0
+
+# A conversation is compacted once it has this many compactable turns
+DEFAULT_MIN_TURNS = 20
+
+# Turns summarized per range, and the most tokens of them one summary request takes
+DEFAULT_CHUNK_TURNS = 40
+MAX_CHUNK_TOKENS = 6000
+
+# The rolling summary is asked to stay under this many words, so the prompt it goes into stays bounded
+ROLLING_SUMMARY_WORDS = 250
+SUMMARY_MAX_TOKENS = 800
+
+# Conversations fetched per candidates call and compacted concurrently
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_WORKERS = 4
+
+# Raised by compact_chat_turns when another run compacted the conversation first
+SERIALIZATION_FAILURE = '40001'
+
+SUMMARY_PROMPT = f"""You compact the history of a conversation between a team member and an AI assistant.
+You are given the summary of the conversation so far (possibly empty) and the next turns.
+Reply with a JSON object with two fields:
+- "summary": a summary of only the new turns, in at most 120 words, keeping names, decisions, facts, open questions and requested actions
+- "rolling_summary": the summary so far updated with the new turns, in at most {ROLLING_SUMMARY_WORDS} words, dropping what is no longer relevant"""
+
+def list_candidates(keep_recent: int, before: datetime, min_turns: int, batch_size: int,
+                    after: Optional[Tuple[str, str]] = None) -> List[Dict]:
+    params = {
+        'p_keep_recent': keep_recent,
+        'p_before': before.isoformat(),
+        'p_min_turns': min_turns,
+        'p_after_user': after[0] if after else None,
+        'p_after_team': after[1] if after else None,
+        'p_limit': batch_size,
+    }
+    with metrics.stage('candidates'):
+        return call_with_retries(get_supabase('service').rpc('chat_compaction_candidates', params).execute,
+                                 'supabase').data or []
+
+def fetch_turns(user_id: str, team_id: str, count: int) -> List[Dict]:
+    """The oldest count turns of a conversation, which are the ones chat_compaction_candidates counted"""
+    turns = []
+    while len(turns) < count:
+        query = (get_supabase('service').table('ai_chat_history').select('role, content, created_at')
+                 .eq('user_id', user_id).eq('team_id', team_id).order('created_at')
+                 .range(len(turns), min(count, len(turns) + 1000) - 1))
+        with metrics.stage('fetch'):
+            page = call_with_retries(query.execute, 'supabase').data
+        turns.extend(page)
+        if not page:
+            break
+    return turns[:count]
+
+def chunk_turns(turns: List[Dict], chunk_turns: int = DEFAULT_CHUNK_TURNS,
+                max_tokens: int = MAX_CHUNK_TOKENS) -> List[List[Dict]]:
+    """Split turns into ranges to summarize, never separating a question from its answer
+
+    A trailing question whose answer is not compactable yet is left out,
+    to be compacted with its answer by a later run.
+    """
+    chunks, chunk, tokens = [], [], 0
+    for turn in turns:
+        turn_tokens = count_tokens(turn['content'])
+        if chunk and (len(chunk) >= chunk_turns or tokens + turn_tokens > max_tokens) and turn['role'] == 'user':
+            chunks.append(chunk)
+            chunk, tokens = [], 0
+        chunk.append(turn)
+        tokens += turn_tokens
+    while chunk and chunk[-1]['role'] == 'user':
+        chunk.pop()
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def summarize(rolling_summary: Optional[str], turns: List[Dict]) -> Dict[str, str]:
+    """Summary of a range of turns and the rolling summary updated with it"""
+    transcript = '\n'.join(f"{turn['role']}: {turn['content']}" for turn in turns)
+    with metrics.stage('summarize'):
+        response = call_with_retries(lambda: get_openai().chat.completions.create(
+            model=SUMMARY_MODEL,
+            messages=[
+                {'role': 'system', 'content': SUMMARY_PROMPT},
+                {'role': 'user', 'content': f"Summary so far:\n{rolling_summary or '(none)'}\n\nNew turns:\n{transcript}"},
+            ],
+            temperature=0.2,
+            max_tokens=SUMMARY_MAX_TOKENS,
+            response_format={'type': 'json_object'}
+        ), 'openai')
+    content = response.choices[0].message.content or ''
+    try:
+        result = json.loads(content)
+        summary, rolling = result['summary'].strip(), result['rolling_summary'].strip()
+    except (ValueError, KeyError, AttributeError):
+        raise ValueError(f"Unexpected summary response: {content[:200]!r}")
+    if not summary or not rolling:
+        raise ValueError("Empty summary")
+    return {'summary': summary, 'rolling_summary': rolling}
+
+def compact_conversation(candidate: Dict, chunk_size: int = DEFAULT_CHUNK_TURNS, dry_run: bool = False) -> Dict[str, int]:
+    """Summarize and delete a conversation's compactable turns, one range at a time
+
+    Each range is stored in its own transaction (compact_chat_turns), so a
+    run that stops partway leaves the conversation consistent and the next
+    run carries on from compacted_through.
+    """
+    user_id, team_id = candidate['user_id'], candidate['team_id']
+    chunks = chunk_turns(fetch_turns(user_id, team_id, candidate['compactable']), chunk_size)
+    if dry_run:
+        return {'ranges': len(chunks), 'turns': sum(len(chunk) for chunk in chunks)}
+
+    result = {'ranges': 0, 'turns': 0}
+    expected, rolling = candidate['compacted_through'], candidate['rolling_summary']
+    for chunk in chunks:
+        summaries = summarize(rolling, chunk)
+        embedding = embed_texts([summaries['summary']], EMBEDDING_MODEL)[0]
+        params = {
+            'p_user_id': user_id,
+            'p_team_id': team_id,
+            'p_expected_through': expected,
+            'p_first_turn_at': chunk[0]['created_at'],
+            'p_last_turn_at': chunk[-1]['created_at'],
+            'p_turn_count': len(chunk),
+            'p_summary': summaries['summary'],
+            'p_rolling_summary': summaries['rolling_summary'],
+            'p_summary_tokens': count_tokens(summaries['rolling_summary']),
+            'p_embedding': embedding,
+            'p_embedding_model': EMBEDDING_MODEL,
+            'p_summary_model': SUMMARY_MODEL,
+        }
+        with metrics.stage('store'):
+            call_with_retries(get_supabase('service').rpc('compact_chat_turns', params).execute, 'supabase')
+        expected, rolling = chunk[-1]['created_at'], summaries['rolling_summary']
+        result['ranges'] += 1
+        result['turns'] += len(chunk)
+        metrics.item('compacted_turns', len(chunk))
+    return result
+
+def run_compaction(keep_recent: int = DEFAULT_KEEP_RECENT, min_age_hours: float = DEFAULT_MIN_AGE_HOURS,
+                   min_turns: int = DEFAULT_MIN_TURNS, chunk_size: int = DEFAULT_CHUNK_TURNS,
+                   batch_size: int = DEFAULT_BATCH_SIZE, workers: int = DEFAULT_WORKERS,
+                   limit: Optional[int] = None, dry_run: bool = False) -> Dict[str, int]:
+    """Compact every conversation with enough old turns, a batch of conversations at a time"""
+    start = time.perf_counter()
+    # One cutoff for the whole run, so paging through candidates sees a stable set
+    before = datetime.now(timezone.utc) - timedelta(hours=min_age_hours)
+    totals = {'conversations': 0, 'ranges': 0, 'turns': 0, 'conflicts': 0, 'failed': 0}
+    after = None
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while limit is None or totals['conversations'] < limit:
+            size = batch_size if limit is None else min(batch_size, limit - totals['conversations'])
+            candidates = list_candidates(keep_recent, before, min_turns, size, after)
+            if not candidates:
+                break
+            after = (candidates[-1]['user_id'], candidates[-1]['team_id'])
+            totals['conversations'] += len(candidates)
+
+            futures = {executor.submit(compact_conversation, candidate, chunk_size, dry_run): candidate
+                       for candidate in candidates}
+            for future in as_completed(futures):
+                candidate = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if getattr(e, 'code', None) == SERIALIZATION_FAILURE:
+                        # Another run got there first; whatever is left is picked up next time
+                        totals['conflicts'] += 1
+                        continue
+                    totals['failed'] += 1
+                    print(f"❌ Compacting {candidate['user_id']} in {candidate['team_id']} failed: {e}")
+                    continue
+                totals['ranges'] += result['ranges']
+                totals['turns'] += result['turns']
+            print(f"  {totals['conversations']} conversations: {totals['turns']} turns in {totals['ranges']} ranges"
+                  + (" (dry run)" if dry_run else ""))
+            if len(candidates) < size:
+                break
+
+    elapsed = time.perf_counter() - start
+    action = "Would compact" if dry_run else "Compacted"
+    print(f"✅ {action} {totals['turns']} turns into {totals['ranges']} summaries across "
+          f"{totals['conversations']} conversations in {elapsed:.1f}s"
+          + (f", {totals['conflicts']} skipped (compacted concurrently)" if totals['conflicts'] else "")
+          + (f", {totals['failed']} failed" if totals['failed'] else ""))
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact old AI chat turns into rolling summaries with embeddings")
+    parser.add_argument('--keep-recent', type=int, default=DEFAULT_KEEP_RECENT,
+                        help="Newest turns of each conversation kept verbatim")
+    parser.add_argument('--min-age-hours', type=float, default=DEFAULT_MIN_AGE_HOURS,
+                        help="Only compact turns at least this old")
+    parser.add_argument('--min-turns', type=int, default=DEFAULT_MIN_TURNS,
+                        help="Skip conversations with fewer compactable turns")
+    parser.add_argument('--chunk-turns', type=int, default=DEFAULT_CHUNK_TURNS, help="Turns per summarized range")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help="Conversations per batch")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Conversations compacted concurrently")
+    parser.add_argument('--limit', type=int, help="Compact at most this many conversations")
+    parser.add_argument('--dry-run', action='store_true', help="Only report what would be compacted")
+    args = parser.parse_args()
+    metrics.start_profiling()
+
+    run_compaction(args.keep_recent, args.min_age_hours, args.min_turns, args.chunk_turns,
+                   args.batch_size, args.workers, args.limit, args.dry_run)
+    metrics.finish()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+import json
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on Windows; appends there must come from a single process
+    fcntl = None
+
+# Default location for locally stored embedding corpora
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), 'data', 'corpus')
+
+MANIFEST_FILE = 'manifest.json'
+LOCK_FILE = '.lock'
+VECTORS_FILE = 'vectors.bin'
+FORMAT_VERSION = 1
+
+# Supported vector encodings; float16 halves the size at a small precision cost
+DTYPES = {'float32': np.float32, 'float16': np.float16}
+
+# Metadata columns stored alongside the vectors, one file (or file pair) per column
+STRING_COLUMNS = ('id', 'source', 'team_id', 'channel_id')
+TIME_COLUMNS = ('created_at',)
+
+# Timestamps are stored as int64 milliseconds since the epoch; missing values use this
+MISSING_TIME = np.iinfo(np.int64).min
+
+def _column_files(name: str) -> List[str]:
+    if name in TIME_COLUMNS:
+        return [f'{name}.i64']
+    return [f'{name}.offsets', f'{name}.data']
+
+def _parse_time(value: Any) -> int:
+    """Epoch milliseconds for an ISO timestamp, datetime or number"""
+    if value is None or value == '':
+        return int(MISSING_TIME)
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+def _write_manifest(path: str, manifest: Dict) -> None:
+    temp_file = os.path.join(path, MANIFEST_FILE + '.tmp')
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, os.path.join(path, MANIFEST_FILE))
+
+def load_manifest(path: str) -> Dict:
+    """Read a corpus manifest"""
+    with open(os.path.join(path, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def create_corpus(path: str, dim: int, dtype: str = 'float32', model: Optional[str] = None) -> Dict:
+    """Create an empty corpus directory for vectors of the given dimension"""
+    if dtype not in DTYPES:
+        raise ValueError(f"Unsupported dtype {dtype}, expected one of {', '.join(DTYPES)}")
+    if os.path.exists(os.path.join(path, MANIFEST_FILE)):
+        raise FileExistsError(f"A corpus already exists at {path}")
+
+    os.makedirs(path, exist_ok=True)
+    files = [VECTORS_FILE]
+    for name in STRING_COLUMNS + TIME_COLUMNS:
+        files.extend(_column_files(name))
+    for name in files:
+        open(os.path.join(path, name), 'wb').close()
+    # String columns start with the single leading offset
+    for name in STRING_COLUMNS:
+        with open(os.path.join(path, f'{name}.offsets'), 'wb') as f:
+            f.write(np.zeros(1, dtype=np.int64).tobytes())
+
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'dim': dim,
+        'dtype': dtype,
+        'model': model,
+        'count': 0,
+        'vectors': VECTORS_FILE,
+        'columns': {name: ('string' if name in STRING_COLUMNS else 'timestamp_ms')
+                    for name in STRING_COLUMNS + TIME_COLUMNS},
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'updated_at': datetime.now(timezone.utc).isoformat(),
+    }
+    _write_manifest(path, manifest)
+    return manifest
+
+def open_or_create(path: str, dim: int, dtype: str = 'float32', model: Optional[str] = None) -> Dict:
+    """Manifest of the corpus at path, creating it first if needed"""
+    if os.path.exists(os.path.join(path, MANIFEST_FILE)):
+        manifest = load_manifest(path)
+        if manifest['dim'] != dim:
+            raise ValueError(f"Corpus at {path} holds {manifest['dim']}-d vectors, got {dim}-d")
+        return manifest
+    return create_corpus(path, dim, dtype, model)
+
+def _truncate(path: str, manifest: Dict) -> Dict[str, int]:
+    """Drop bytes past the committed row count, left behind by an interrupted append
+
+    The manifest's count is only advanced after every file has been written,
+    so anything beyond it is an incomplete row. Returns the committed size of
+    each string column's data file.
+    """
+    count = manifest['count']
+    itemsize = np.dtype(DTYPES[manifest['dtype']]).itemsize
+    sizes = {VECTORS_FILE: count * manifest['dim'] * itemsize}
+    data_sizes = {}
+    for name in TIME_COLUMNS:
+        sizes[f'{name}.i64'] = count * 8
+    for name in STRING_COLUMNS:
+        offsets = np.fromfile(os.path.join(path, f'{name}.offsets'), dtype=np.int64, count=count + 1)
+        data_sizes[name] = int(offsets[count])
+        sizes[f'{name}.offsets'] = (count + 1) * 8
+        sizes[f'{name}.data'] = data_sizes[name]
+
+    for name, size in sizes.items():
+        file_path = os.path.join(path, name)
+        if os.path.getsize(file_path) != size:
+            os.truncate(file_path, size)
+    return data_sizes
+
+@contextmanager
+def _locked(path: str):
+    """Exclusive lock on a corpus, so appends from several worker processes never interleave"""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(path, LOCK_FILE), 'a') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def _append_bytes(file_path: str, data: bytes) -> None:
+    with open(file_path, 'ab') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+def append(path: str, vectors, records: List[Dict[str, Any]], skip_existing: bool = False) -> int:
+    """Append vectors and their metadata records to a corpus; returns the new row count
+
+    records[i] describes vectors[i] and may carry any of the metadata columns;
+    missing values are stored as empty strings / missing timestamps. The
+    manifest is rewritten last, so an interrupted append leaves the corpus at
+    its previous row count. With skip_existing, records whose id is already
+    in the corpus are left out, which makes retried appends idempotent.
+    """
+    manifest = load_manifest(path)
+    vectors = np.asarray(vectors, dtype=DTYPES[manifest['dtype']])
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    if vectors.shape[1] != manifest['dim']:
+        raise ValueError(f"Expected {manifest['dim']}-d vectors, got {vectors.shape[1]}-d")
+    if len(vectors) != len(records):
+        raise ValueError(f"Got {len(vectors)} vectors but {len(records)} records")
+
+    with _locked(path):
+        # Another process may have appended since the manifest was first read
+        manifest = load_manifest(path)
+        if skip_existing and manifest['count']:
+            existing = set(StringColumn(path, 'id', manifest['count']).to_list())
+            keep = [i for i, record in enumerate(records) if not record.get('id') or str(record['id']) not in existing]
+            vectors, records = vectors[keep], [records[i] for i in keep]
+        if not len(records):
+            return manifest['count']
+        return _append(path, manifest, vectors, records)
+
+def _append(path: str, manifest: Dict, vectors: np.ndarray, records: List[Dict[str, Any]]) -> int:
+    data_sizes = _truncate(path, manifest)
+    _append_bytes(os.path.join(path, VECTORS_FILE), np.ascontiguousarray(vectors).tobytes())
+
+    for name in STRING_COLUMNS:
+        encoded = [str(record.get(name) or '').encode('utf-8') for record in records]
+        lengths = np.fromiter((len(e) for e in encoded), dtype=np.int64, count=len(encoded))
+        offsets = data_sizes[name] + np.cumsum(lengths)
+        _append_bytes(os.path.join(path, f'{name}.data'), b''.join(encoded))
+        _append_bytes(os.path.join(path, f'{name}.offsets'), offsets.tobytes())
+
+    for name in TIME_COLUMNS:
+        times = np.fromiter((_parse_time(record.get(name)) for record in records),
+                            dtype=np.int64, count=len(records))
+        _append_bytes(os.path.join(path, f'{name}.i64'), times.tobytes())
+
+    manifest['count'] += len(records)
+    manifest['updated_at'] = datetime.now(timezone.utc).isoformat()
+    _write_manifest(path, manifest)
+    return manifest['count']
+
+class StringColumn:
+    """Read-only view over a memory-mapped string column"""
+
+    def __init__(self, path: str, name: str, count: int):
+        self.offsets = np.memmap(os.path.join(path, f'{name}.offsets'), dtype=np.int64,
+                                 mode='r', shape=(count + 1,))
+        data_file = os.path.join(path, f'{name}.data')
+        size = int(self.offsets[count])
+        # np.memmap cannot map an empty file
+        self.data = np.memmap(data_file, dtype=np.uint8, mode='r', shape=(size,)) if size else b''
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        return bytes(self.data[start:end]).decode('utf-8')
+
+    def to_list(self) -> List[str]:
+        data = bytes(self.data)
+        offsets = self.offsets.tolist()
+        return [data[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(self))]
+
+class Corpus:
+    """Zero-copy reader for a corpus directory
+
+    vectors is an (n, dim) np.memmap, so millions of embeddings can be
+    searched without loading them into memory. Only rows committed by the
+    manifest are exposed, even if an append is in progress.
+    """
+
+    def __init__(self, path: str = CORPUS_DIR):
+        self.path = path
+        self.manifest = load_manifest(path)
+        self.count = self.manifest['count']
+        self.dim = self.manifest['dim']
+        if self.count:
+            self.vectors = np.memmap(os.path.join(path, self.manifest['vectors']),
+                                     dtype=DTYPES[self.manifest['dtype']], mode='r',
+                                     shape=(self.count, self.dim))
+        else:
+            self.vectors = np.zeros((0, self.dim), dtype=DTYPES[self.manifest['dtype']])
+        self._columns: Dict[str, Any] = {}
+
+    def __len__(self) -> int:
+        return self.count
+
+    def column(self, name: str):
+        """A metadata column: StringColumn for strings, datetime64[ms] array for timestamps"""
+        if name not in self._columns:
+            if name in STRING_COLUMNS:
+                self._columns[name] = StringColumn(self.path, name, self.count)
+            elif name in TIME_COLUMNS:
+                raw = np.memmap(os.path.join(self.path, f'{name}.i64'), dtype=np.int64,
+                                mode='r', shape=(self.count,)) if self.count else np.zeros(0, dtype=np.int64)
+                # MISSING_TIME is the int64 representation of NaT
+                self._columns[name] = raw.view('datetime64[ms]')
+            else:
+                raise KeyError(f"Unknown column {name}")
+        return self._columns[name]
+
+    def record(self, i: int) -> Dict[str, Any]:
+        """Metadata for one row"""
+        record: Dict[str, Any] = {name: self.column(name)[i] for name in STRING_COLUMNS}
+        for name in TIME_COLUMNS:
+            value = self.column(name)[i]
+            record[name] = None if np.isnat(value) else str(value) + 'Z'
+        return record
+
+    def iter_batches(self, batch_size: int = 65536) -> Iterator[np.ndarray]:
+        """Vectors in float32 batches, for jobs that need full precision"""
+        for start in range(0, self.count, batch_size):
+            yield np.asarray(self.vectors[start:start + batch_size], dtype=np.float32)
+
+def describe(path: str) -> str:
+    """Human-readable summary of a corpus"""
+    manifest = load_manifest(path)
+    itemsize = np.dtype(DTYPES[manifest['dtype']]).itemsize
+    size_mb = manifest['count'] * manifest['dim'] * itemsize / (1024 * 1024)
+    corpus = Corpus(path)
+    sources: Dict[str, int] = {}
+    if corpus.count:
+        for source in corpus.column('source').to_list():
+            sources[source] = sources.get(source, 0) + 1
+    lines = [
+        f"Corpus: {path}",
+        f"  vectors: {manifest['count']} x {manifest['dim']} {manifest['dtype']} ({size_mb:.1f} MB)",
+        f"  model: {manifest.get('model') or 'unknown'}",
+        f"  updated: {manifest['updated_at']}",
+    ]
+    lines.extend(f"  source {source}: {n}" for source, n in sorted(sources.items()))
+    return '\n'.join(lines)
+
+if __name__ == "__main__":
+    print(describe(sys.argv[1] if len(sys.argv) > 1 else CORPUS_DIR))
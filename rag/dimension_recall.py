@@ -0,0 +1,125 @@
+import argparse
+import json
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from benchmark_embeddings import neighbors, recall_at_k
+from corpus import CORPUS_DIR, MANIFEST_FILE, Corpus
+from embedding_backends import fit_projection, reduce_vectors, save_projection
+
+# Dimensions to compare against the full vectors
+DEFAULT_DIMS = [256, 512, 1024]
+
+# Rows sampled from each corpus; exact neighbours over the sample are the ground truth
+DEFAULT_SAMPLE = 20000
+
+def find_corpora(root: str = CORPUS_DIR) -> List[str]:
+    """Every corpus directory under root"""
+    return sorted(directory for directory, _, files in os.walk(root) if MANIFEST_FILE in files)
+
+def load_sample(path: str, sample: int, rng: np.random.Generator) -> np.ndarray:
+    """Up to sample normalized float32 vectors from a corpus"""
+    corpus = Corpus(path)
+    rows = np.sort(rng.choice(corpus.count, min(sample, corpus.count), replace=False))
+    vectors = np.asarray(corpus.vectors[rows], dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def query_ms(vectors: np.ndarray, queries: List[int], k: int) -> float:
+    """Milliseconds per exact top-k query over the sample"""
+    start = time.perf_counter()
+    for i in queries:
+        scores = vectors @ vectors[i]
+        np.argpartition(-scores, k)[:k]
+    return 1000 * (time.perf_counter() - start) / len(queries)
+
+def measure(path: str, dims: List[int], sample: int, queries: int, k: int, seed: int) -> List[Dict]:
+    """Recall@k, storage and query time of truncated and PCA-projected vectors against the full ones
+
+    Truncation is what the API's dimensions parameter returns for the
+    text-embedding-3 models (a prefix, renormalized), so their numbers need
+    no new API calls. Other models are not trained for it and lose far more.
+    """
+    rng = np.random.default_rng(seed)
+    manifest = Corpus(path).manifest
+    vectors = load_sample(path, sample, rng)
+    if len(vectors) <= k:
+        print(f"⚠️  Skipping {path}: only {len(vectors)} vectors")
+        return []
+    query_rows = rng.choice(len(vectors), min(queries, len(vectors)), replace=False).tolist()
+    truth = neighbors(vectors, query_rows, k)
+    # The projection is fitted without the query rows, so it has not seen them
+    training = np.delete(vectors, query_rows, axis=0)
+
+    def row(method: str, reduced: np.ndarray) -> Dict:
+        dim = reduced.shape[1]
+        return {
+            'corpus': path,
+            'model': manifest.get('model'),
+            'method': method,
+            'dim': dim,
+            # pgvector stores float4 components, as the corpus does by default
+            'storage_mb': manifest['count'] * dim * 4 / (1024 * 1024),
+            'query_ms': query_ms(reduced, query_rows, k),
+            'recall': recall_at_k(truth, neighbors(reduced, query_rows, k)),
+        }
+
+    results = [row('full', vectors)]
+    for dim in dims:
+        if dim >= vectors.shape[1]:
+            continue
+        results.append(row('truncate', reduce_vectors(vectors, dim)))
+        if dim <= len(training):
+            results.append(row('pca', reduce_vectors(vectors, dim, fit_projection(training, dim))))
+        else:
+            print(f"⚠️  {path}: {len(training)} vectors are too few to fit a {dim}-d projection")
+    return results
+
+def save_projections(path: str, dims: List[int], sample: int, seed: int) -> None:
+    """Fit projections on a corpus sample and store them for '<model>@pca<dim>'"""
+    model = Corpus(path).manifest.get('model')
+    if not model:
+        print(f"⚠️  {path} does not record its model; not saving projections")
+        return
+    vectors = load_sample(path, sample, np.random.default_rng(seed))
+    for dim in dims:
+        if dim < min(vectors.shape):
+            print(f"💾 {model}@pca{dim}: {save_projection(model, fit_projection(vectors, dim))}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure recall@k of reduced-dimension embeddings on stored corpora")
+    parser.add_argument('--corpus', action='append', help="Corpus directory (repeatable; default: every corpus)")
+    parser.add_argument('--dims', type=int, nargs='+', default=DEFAULT_DIMS)
+    parser.add_argument('--sample', type=int, default=DEFAULT_SAMPLE, help="Vectors sampled per corpus")
+    parser.add_argument('--queries', type=int, default=200, help="Sampled vectors used as queries")
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', action='store_true',
+                        help="Also fit and store PCA projections for '<model>@pca<dim>'")
+    parser.add_argument('--output', help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    corpora = args.corpus or find_corpora()
+    if not corpora:
+        print(f"No corpora found under {CORPUS_DIR}; run embed_tweets.py first")
+        return
+
+    results = []
+    for path in corpora:
+        print(f"📏 {path}")
+        rows = measure(path, args.dims, args.sample, args.queries, args.k, args.seed)
+        print(f"  {'method':10s} {'dim':>5s} {'storage MB':>11s} {'ms/query':>9s} {'recall@' + str(args.k):>10s}")
+        for r in rows:
+            print(f"  {r['method']:10s} {r['dim']:5d} {r['storage_mb']:11.1f} {r['query_ms']:9.3f} {r['recall']:10.3f}")
+        results.extend(rows)
+        if args.save:
+            save_projections(path, args.dims, args.sample, args.seed)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'k': args.k, 'sample': args.sample, 'results': results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
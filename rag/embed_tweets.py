@@ -1,38 +1,50 @@
+import argparse
 import json
 import os
 import sys
-from openai import OpenAI
-from dotenv import load_dotenv
-from supabase import create_client, Client
+from datetime import datetime, timezone
+from clients import get_openai, get_supabase
+from corpus import CORPUS_DIR, append, open_or_create
+from embedding_backends import dimension, embed, is_local
+from instrumentation import metrics
+from normalization import count_tokens
+from query_cache import invalidate_all
+from reindex_embeddings import content_md5, embedding_fields, get_models
+from resilience import call_with_retries
 
-# Load environment variables from .env.local in the root directory
-load_dotenv(dotenv_path=os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env.local'))
+# Used until migrations/006_embedding_models.sql is applied; afterwards the tweets table's registered model wins
+EMBEDDING_MODEL = "text-embedding-3-small"  # or text-embedding-ada-002, or a local:<model> (see embedding_backends.py)
 
-# Get OpenAI API key
-openai_api_key = os.getenv('OPENAI_API_KEY')
-if not openai_api_key or openai_api_key == 'your_openai_api_key_here':
-    print("Error: Please set your OpenAI API key in .env.local")
-    sys.exit(1)
+# Local memory-mappable copy of every stored embedding, appended in batches (one corpus per model)
+CORPUS_PATH = os.path.join(CORPUS_DIR, 'tweets')
+CORPUS_BATCH_SIZE = 100
 
-# Initialize OpenAI client
-client = OpenAI(api_key=openai_api_key)
+# Longest input the embedding models accept; the API rejects anything over it
+MAX_EMBEDDING_TOKENS = 8191
 
-# Initialize Supabase client
-supabase: Client = create_client(
-    os.getenv('NEXT_PUBLIC_SUPABASE_URL', ''),
-    os.getenv('NEXT_PUBLIC_SUPABASE_ANON_KEY', '')
-)
+# Hashes per request when checking which tweets are already stored
+FILTER_BATCH_SIZE = 200
 
-def get_embedding(text: str) -> list[float]:
-    """Get embedding for a text using OpenAI's API"""
-    response = client.embeddings.create(
-        model="text-embedding-3-small",  # or text-embedding-ada-002 for older version
-        input=text
-    )
-    return response.data[0].embedding
+def get_embedding(text: str, model: str = EMBEDDING_MODEL) -> list[float]:
+    """Get embedding for a text from the model's backend (OpenAI's API unless the model is local)"""
+    return embed([text], model)[0]
 
-def process_tweets():
-    """Process tweets and store embeddings in Supabase"""
+def stored_hashes(tweets: list[str]) -> set[str]:
+    """content_md5 of the tweets already in the tweets table (migrations/010_tweet_content_hash.sql)"""
+    hashes = sorted({content_md5(tweet) for tweet in tweets})
+    stored = set()
+    for i in range(0, len(hashes), FILTER_BATCH_SIZE):
+        rows = call_with_retries(get_supabase().table('tweets').select('content_md5')
+                                 .in_('content_md5', hashes[i:i + FILTER_BATCH_SIZE]).execute, 'supabase').data
+        stored.update(row['content_md5'] for row in rows)
+    return stored
+
+def process_tweets(enqueue: bool = False):
+    """Process tweets and store embeddings in Supabase
+
+    enqueue: queue the tweets in batches for embedding_jobs.py workers instead
+    of embedding them in this process
+    """
     input_file = os.path.join(os.path.dirname(__file__), 'data', 'processedtweets.json')
     if not os.path.exists(input_file):
         print(f"Error: {input_file} not found. Please run process_tweets.py first.")
@@ -41,29 +53,114 @@ def process_tweets():
     print(f"Processing {input_file}")
     
     # Read the tweets
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-        tweets = data['tweets']
+    with metrics.stage('load'):
+        with open(input_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+            tweets = data['tweets']
+    # Token counts from process_tweets.py's normalization stage, if the file has them
+    if 'features' in data:
+        tokens = [features['tokens'] for features in data['features']]
+    else:
+        tokens = [count_tokens(tweet) for tweet in tweets]
     
     print(f"Found {len(tweets)} tweets to process")
     
+    # Skip near-duplicates so each distinct text is embedded and stored once
+    from near_duplicates import deduplicate, save_deduplicated
+    with metrics.stage('dedup'):
+        kept, canonical = deduplicate(tweets)
+        mapping_file = save_deduplicated(input_file, tweets, kept, canonical)
+    print(f"Skipping {len(tweets) - len(kept)} near-duplicate tweets (mapping saved to {mapping_file})")
+    tweets = [tweets[i] for i in kept]
+    tokens = [tokens[i] for i in kept]
+    
+    too_long = sum(count > MAX_EMBEDDING_TOKENS for count in tokens)
+    if too_long:
+        print(f"Skipping {too_long} tweets over {MAX_EMBEDDING_TOKENS} tokens")
+        tweets = [tweet for tweet, count in zip(tweets, tokens) if count <= MAX_EMBEDDING_TOKENS]
+    
+    if enqueue:
+        from embedding_jobs import enqueue_tweets
+        added = enqueue_tweets(tweets, CORPUS_BATCH_SIZE)
+        print(f"📥 Queued {added} new embed_tweets jobs; run 'python embedding_jobs.py work' to process them")
+        return
+    
+    # Tag vectors with the table's registered model, and dual-write while a re-index runs
+    try:
+        models = get_models('tweets')
+    except Exception as e:
+        print(f"⚠️  No embedding model registry ({e}); storing untagged {EMBEDDING_MODEL} vectors")
+        models = None
+    model = models['model'] if models else EMBEDDING_MODEL
+    if not is_local(model):
+        try:
+            get_openai()
+        except RuntimeError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    corpus_path = os.path.join(CORPUS_PATH, model)
+    open_or_create(corpus_path, dimension(model), model=model)
+    pending_vectors, pending_records = [], []
+    
+    # A rerun embeds only the tweets not stored yet
+    with metrics.stage('existing'):
+        existing = stored_hashes(tweets)
+    if existing:
+        print(f"Skipping {len(existing)} tweets already stored")
+        tweets = [tweet for tweet in tweets if content_md5(tweet) not in existing]
+    
+    def flush_corpus():
+        if pending_vectors:
+            with metrics.stage('corpus'):
+                append(corpus_path, pending_vectors, pending_records)
+            pending_vectors.clear()
+            pending_records.clear()
+    
     # Process each tweet
     for i, tweet in enumerate(tweets, 1):
         try:
             # Get embedding
-            embedding = get_embedding(tweet)
+            with metrics.stage('embed'):
+                if models:
+                    fields = embedding_fields(models, tweet, get_embedding)
+                else:
+                    fields = {'embedding': get_embedding(tweet)}
+                embedding = fields['embedding']
             
             # Store in Supabase
-            result = supabase.table('tweets').insert({
-                'content': tweet,
-                'embedding': embedding
-            }).execute()
+            with metrics.stage('store'):
+                # Upserted on content_md5, so a retry updates the row it already wrote
+                result = call_with_retries(get_supabase().table('tweets').upsert({
+                    'content': tweet,
+                    **fields
+                }, on_conflict='content_md5').execute, 'supabase')
+            
+            pending_vectors.append(embedding)
+            pending_records.append({
+                'id': result.data[0]['id'] if result.data else '',
+                'source': 'tweets',
+                'created_at': datetime.now(timezone.utc),
+            })
+            if len(pending_vectors) >= CORPUS_BATCH_SIZE:
+                flush_corpus()
             
+            metrics.item('tweets', total=len(tweets))
             print(f"Processed tweet {i}/{len(tweets)}")
             
         except Exception as e:
             print(f"Error processing tweet {i}: {str(e)}")
             continue
+    
+    flush_corpus()
+    # Tweets belong to no team, so cached results of every team may now be stale
+    invalidate_all()
+    print(f"Saved embeddings to local corpus {corpus_path}")
+    metrics.finish()
 
 if __name__ == "__main__":
-    process_tweets() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Embed processed tweets and store them in Supabase")
+    parser.add_argument('--enqueue', action='store_true',
+                        help="Queue the tweets for embedding_jobs.py workers instead of embedding them here")
+    args = parser.parse_args()
+    metrics.start_profiling()
+    process_tweets(args.enqueue) 
\ No newline at end of file
@@ -0,0 +1,221 @@
+import os
+import re
+import threading
+import zlib
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from clients import get_openai
+from resilience import call_with_retries
+
+# Model names select a backend by prefix; anything unprefixed is an OpenAI model:
+#   text-embedding-3-small               OpenAI API
+#   local:BAAI/bge-small-en-v1.5         sentence-transformers on CPU (a name or a local directory)
+#   hashing:1536                         dependency-free feature hashing, for offline tests
+# and any of them may ask for fewer dimensions with a suffix:
+#   text-embedding-3-small@512           the API's dimensions parameter (truncated and renormalized
+#                                        locally for other backends)
+#   text-embedding-3-small@pca256        a PCA projection fitted on a stored corpus (dimension_recall.py --save)
+LOCAL_PREFIX = 'local:'
+HASHING_PREFIX = 'hashing:'
+DIMENSIONS_SEPARATOR = '@'
+PCA_PREFIX = 'pca'
+
+# Fitted PCA projections, one .npz (mean and components) per base model and dimension
+PROJECTIONS_DIR = os.path.join(os.path.dirname(__file__), 'data', 'projections')
+
+# Texts per forward pass of a local model, and the CPU threads it may use
+LOCAL_BATCH_SIZE = int(os.getenv('LOCAL_EMBEDDING_BATCH_SIZE', '64'))
+LOCAL_THREADS = int(os.getenv('LOCAL_EMBEDDING_THREADS', '0')) or os.cpu_count() or 1
+
+# 'torch' or 'onnx' (sentence-transformers >= 3.2 with onnxruntime installed)
+LOCAL_RUNTIME = os.getenv('LOCAL_EMBEDDING_RUNTIME', 'torch')
+
+WORD_PATTERN = re.compile(r'\w+')
+
+# Output dimensions of the OpenAI models (local backends report their own)
+OPENAI_DIMS = {
+    'text-embedding-ada-002': 1536,
+    'text-embedding-3-small': 1536,
+    'text-embedding-3-large': 3072,
+}
+
+# Models trained so that a prefix of the vector is itself a good embedding;
+# only these accept the API's dimensions parameter
+SHORTENABLE_MODELS = {'text-embedding-3-small', 'text-embedding-3-large'}
+
+class OpenAIBackend:
+    """Embeddings from the OpenAI API"""
+
+    local = False
+
+    def __init__(self, model: str, dimensions: Optional[int] = None):
+        if dimensions and model not in SHORTENABLE_MODELS:
+            raise ValueError(f"{model} does not support shortened embeddings; use a {PCA_PREFIX} projection")
+        self.model = model
+        self.dimensions = dimensions
+        self.dim = dimensions or OPENAI_DIMS.get(model)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        options = {'dimensions': self.dimensions} if self.dimensions else {}
+        response = call_with_retries(lambda: get_openai().embeddings.create(
+            model=self.model,
+            input=[text.replace('\n', ' ') for text in texts],
+            **options
+        ), 'openai')
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+class SentenceTransformerBackend:
+    """A sentence-transformers model run in batches on CPU threads
+
+    Needs no network once the model is in the local cache (or name is a
+    directory), so it works air-gapped and is not subject to API rate limits.
+    """
+
+    local = True
+
+    def __init__(self, name: str, batch_size: int = LOCAL_BATCH_SIZE, threads: int = LOCAL_THREADS,
+                 runtime: str = LOCAL_RUNTIME):
+        try:
+            import torch
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise RuntimeError("Local embeddings need sentence-transformers: pip install sentence-transformers")
+        torch.set_num_threads(threads)
+        options = {'backend': runtime} if runtime != 'torch' else {}
+        self.model = SentenceTransformer(name, device='cpu', **options)
+        self.batch_size = batch_size
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True,
+                                    convert_to_numpy=True, show_progress_bar=False)
+        return vectors.astype(np.float32).tolist()
+
+class HashingBackend:
+    """Signed feature hashing of words and word pairs into a fixed number of dimensions
+
+    Lexical only, so recall is far below a trained model; it exists so the
+    pipeline can run and be tested with no model files and no network.
+    """
+
+    local = True
+
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            words = WORD_PATTERN.findall(text.lower())
+            for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+                h = zlib.crc32(feature.encode('utf-8'))
+                vectors[i, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+            norm = np.linalg.norm(vectors[i])
+            if norm:
+                vectors[i] /= norm
+        return vectors.tolist()
+
+class ReducedBackend:
+    """Fewer dimensions from another backend's vectors
+
+    With a projection (mean and components from fit_projection) the vectors
+    are centred and projected onto the principal components; without one
+    they are truncated. Either way they are renormalized, so cosine and
+    inner-product search keep working.
+    """
+
+    def __init__(self, base, dim: int, projection: Optional[Dict[str, np.ndarray]] = None):
+        if projection is None and base.dim is not None and dim >= base.dim:
+            raise ValueError(f"Cannot reduce {base.dim}-d vectors to {dim} dimensions")
+        self.base = base
+        self.dim = dim
+        self.projection = projection
+        self.local = base.local
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        return reduce_vectors(np.asarray(self.base.embed(texts), dtype=np.float32), self.dim, self.projection).tolist()
+
+def reduce_vectors(vectors: np.ndarray, dim: int, projection: Optional[Dict[str, np.ndarray]] = None) -> np.ndarray:
+    """Truncate or project (n, d) vectors to (n, dim) and renormalize them"""
+    if projection is not None:
+        vectors = (vectors - projection['mean']) @ projection['components'].T
+    else:
+        vectors = vectors[:, :dim]
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+def fit_projection(vectors: np.ndarray, dim: int) -> Dict[str, np.ndarray]:
+    """PCA of (n, d) float32 vectors: the mean and the top dim principal components"""
+    if dim > min(vectors.shape):
+        raise ValueError(f"Need at least {dim} vectors of at least {dim} dimensions, got {vectors.shape}")
+    mean = vectors.mean(axis=0)
+    # Right singular vectors of the centred data are the principal components, largest first
+    _, _, components = np.linalg.svd(vectors - mean, full_matrices=False)
+    return {'mean': mean.astype(np.float32), 'components': components[:dim].astype(np.float32)}
+
+def projection_path(model: str, dim: int) -> str:
+    return os.path.join(PROJECTIONS_DIR, f"{model.replace('/', '_').replace(':', '_')}-{PCA_PREFIX}{dim}.npz")
+
+def save_projection(model: str, projection: Dict[str, np.ndarray]) -> str:
+    """Store a projection of model's vectors where '<model>@pca<dim>' finds it"""
+    path = projection_path(model, projection['components'].shape[0])
+    os.makedirs(PROJECTIONS_DIR, exist_ok=True)
+    temp_file = path + '.tmp.npz'
+    np.savez(temp_file, model=model, **projection)
+    os.replace(temp_file, path)
+    return path
+
+def load_projection(model: str, dim: int) -> Dict[str, np.ndarray]:
+    path = projection_path(model, dim)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"No {PCA_PREFIX}{dim} projection for {model}; "
+                                f"fit one with: python dimension_recall.py --save")
+    with np.load(path) as data:
+        return {'mean': data['mean'], 'components': data['components']}
+
+_backends: Dict[str, object] = {}
+_lock = threading.RLock()
+
+def _create_backend(model: str):
+    base, _, reduction = model.partition(DIMENSIONS_SEPARATOR)
+    if reduction:
+        if reduction.startswith(PCA_PREFIX):
+            dim = int(reduction[len(PCA_PREFIX):])
+            return ReducedBackend(get_backend(base), dim, load_projection(base, dim))
+        if not base.startswith((LOCAL_PREFIX, HASHING_PREFIX)):
+            # Shortened by the API itself, so less to transfer
+            return OpenAIBackend(base, int(reduction))
+        return ReducedBackend(get_backend(base), int(reduction))
+    if model.startswith(LOCAL_PREFIX):
+        return SentenceTransformerBackend(model[len(LOCAL_PREFIX):])
+    if model.startswith(HASHING_PREFIX):
+        return HashingBackend(int(model[len(HASHING_PREFIX):]))
+    return OpenAIBackend(model)
+
+def get_backend(model: str):
+    """Shared backend for a model name; local models are loaded once per process"""
+    backend = _backends.get(model)
+    if backend is None:
+        # Reentrant, since a reduced backend creates its base backend
+        with _lock:
+            backend = _backends.get(model)
+            if backend is None:
+                backend = _create_backend(model)
+                _backends[model] = backend
+    return backend
+
+def is_local(model: str) -> bool:
+    """Whether a model runs in-process (no API key, network or rate limit)"""
+    return model.startswith((LOCAL_PREFIX, HASHING_PREFIX))
+
+def dimension(model: str) -> int:
+    """Length of the vectors a model produces"""
+    dim = get_backend(model).dim
+    if dim is None:
+        raise ValueError(f"Unknown dimension for {model}; add it to OPENAI_DIMS")
+    return dim
+
+def embed(texts: List[str], model: str) -> List[List[float]]:
+    """Embed texts with whichever backend the model name selects"""
+    return get_backend(model).embed(texts)
@@ -0,0 +1,248 @@
+import argparse
+import hashlib
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from clients import get_supabase
+from instrumentation import metrics
+from job_queue import DEFAULT_VISIBILITY_TIMEOUT, JobQueue, worker_id
+from query_cache import invalidate_all
+from reindex_embeddings import DEFAULT_RATE, Throttle, embed_texts, get_models
+from resilience import call_with_retries
+
+# Seconds an idle worker waits before looking for jobs again
+IDLE_POLL = 1.0
+
+# Jobs per queue are batches of this many rows
+DEFAULT_BATCH_SIZE = 100
+
+def batch_key(prefix: str, items: List[str]) -> str:
+    """Stable key for a batch, so enqueueing the same batch twice adds one job"""
+    return f"{prefix}:{hashlib.md5(chr(0).join(items).encode('utf-8')).hexdigest()}"
+
+def embed_messages_job(payload: Dict, throttle: Throttle) -> Dict:
+    """Embed a batch of channel or direct message ids (upserts, so safe to repeat)"""
+    from backfill_embeddings import SOURCES, backfill_batch, models_for
+    source = payload['source']
+    stored, _ = backfill_batch(source, payload['ids'], models_for(SOURCES[source]['embeddings']), throttle)
+    return {'stored': stored}
+
+def embed_tweets_job(payload: Dict, throttle: Throttle) -> Dict:
+    """Embed a batch of tweet texts into the tweets table and the local corpus
+
+    Rows are upserted on content_md5 (migrations/010_tweet_content_hash.sql)
+    and corpus rows already present are skipped, so a repeated job changes
+    nothing.
+    """
+    from corpus import append, open_or_create
+    from embed_tweets import CORPUS_PATH, EMBEDDING_MODEL
+    from embedding_backends import dimension
+    texts = payload['tweets']
+    try:
+        models = get_models('tweets')
+    except Exception as e:
+        print(f"⚠️  No embedding model registry ({e}); storing untagged {EMBEDDING_MODEL} vectors")
+        models = None
+
+    throttle.wait(len(texts))
+    model = models['model'] if models else EMBEDDING_MODEL
+    vectors = embed_texts(texts, model)
+    rows = [{'content': text, 'embedding': vector} for text, vector in zip(texts, vectors)]
+    if models:
+        for row in rows:
+            row.update({'embedding_model': models['model'], 'embedding_version': models['version']})
+        if models.get('target_model'):
+            for row, vector in zip(rows, embed_texts(texts, models['target_model'])):
+                row.update({'embedding_next': vector, 'embedding_next_model': models['target_model'],
+                            'embedding_next_version': models['target_version']})
+
+    with metrics.stage('store'):
+        stored = call_with_retries(get_supabase().table('tweets').upsert(rows, on_conflict='content_md5')
+                                   .execute, 'supabase').data or []
+    ids = {row['content']: row['id'] for row in stored}
+
+    corpus_path = os.path.join(CORPUS_PATH, model)
+    open_or_create(corpus_path, dimension(model), model=model)
+    now = datetime.now(timezone.utc)
+    with metrics.stage('corpus'):
+        append(corpus_path, vectors,
+               [{'id': ids.get(text, ''), 'source': 'tweets', 'created_at': now} for text in texts],
+               skip_existing=True)
+    metrics.item('tweets', len(stored))
+    if stored:
+        invalidate_all()
+    return {'stored': len(stored)}
+
+# Queue name -> handler
+HANDLERS: Dict[str, Callable[[Dict, Throttle], Dict]] = {
+    'embed_messages': embed_messages_job,
+    'embed_tweets': embed_tweets_job,
+}
+
+def enqueue_tweets(tweets: List[str], batch_size: int = DEFAULT_BATCH_SIZE, queue: Optional[JobQueue] = None) -> int:
+    """Queue tweet texts in batches; returns the number of new jobs"""
+    queue = queue or JobQueue()
+    batches = [tweets[i:i + batch_size] for i in range(0, len(tweets), batch_size)]
+    ids = queue.enqueue_many('embed_tweets', [({'tweets': batch}, batch_key('tweets', batch)) for batch in batches])
+    return sum(1 for i in ids if i is not None)
+
+def enqueue_missing(sources: List[str], batch_size: int = DEFAULT_BATCH_SIZE, queue: Optional[JobQueue] = None) -> int:
+    """Queue every message without an embedding (see backfill_embeddings.py); returns the number of new jobs"""
+    from backfill_embeddings import print_coverage, scan_coverage
+    queue = queue or JobQueue()
+    coverage = scan_coverage(sources)
+    print_coverage(coverage, "Coverage")
+    jobs = []
+    for source in sources:
+        missing = coverage[source]['missing']
+        for i in range(0, len(missing), batch_size):
+            ids = missing[i:i + batch_size]
+            jobs.append(({'source': source, 'ids': ids}, batch_key(source, ids)))
+    ids = queue.enqueue_many('embed_messages', jobs)
+    return sum(1 for i in ids if i is not None)
+
+def heartbeat_loop(job: Dict, visibility_timeout: float, done: threading.Event, lost: threading.Event) -> None:
+    """Keep a job's lease alive while its handler runs (on its own connection)"""
+    queue = JobQueue()
+    try:
+        while not done.wait(visibility_timeout / 3):
+            if not queue.heartbeat(job, visibility_timeout):
+                lost.set()
+                return
+    finally:
+        queue.close()
+
+def work(queues: List[str], visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT, rate: float = DEFAULT_RATE,
+         drain: bool = False, stop: Optional[threading.Event] = None) -> Dict[str, int]:
+    """Lease and run jobs until stopped (or, with drain, until the queues are empty)"""
+    queue = JobQueue()
+    owner = worker_id()
+    stop = stop or threading.Event()
+    throttle = Throttle(rate)
+    counts = {'done': 0, 'failed': 0, 'lost': 0}
+
+    while not stop.is_set():
+        job = None
+        for name in queues:
+            leased = queue.lease(name, owner, visibility_timeout)
+            if leased:
+                job = leased[0]
+                break
+        if job is None:
+            if drain:
+                break
+            stop.wait(IDLE_POLL)
+            continue
+
+        done, lost = threading.Event(), threading.Event()
+        heartbeat = threading.Thread(target=heartbeat_loop, args=(job, visibility_timeout, done, lost), daemon=True)
+        heartbeat.start()
+        start = time.perf_counter()
+        try:
+            result = HANDLERS[job['queue']](job['payload'], throttle)
+        except Exception as e:
+            status = queue.fail(job, f"{type(e).__name__}: {e}")
+            counts['failed'] += 1
+            print(f"❌ [{owner}] job {job['id']} ({job['queue']}, attempt {job['attempts']}) failed: {e}"
+                  + (" -> dead letter" if status == 'dead' else ""))
+            continue
+        finally:
+            done.set()
+            heartbeat.join()
+
+        if lost.is_set() or not queue.complete(job, result):
+            # Another worker holds the job now; the handler is idempotent, so its rerun is harmless
+            counts['lost'] += 1
+            print(f"⚠️  [{owner}] lost the lease on job {job['id']}")
+        else:
+            counts['done'] += 1
+            print(f"  [{owner}] job {job['id']} ({job['queue']}) done in {time.perf_counter() - start:.1f}s: {result}")
+
+    queue.close()
+    return counts
+
+def worker_main(queues: List[str], visibility_timeout: float, rate: float, drain: bool) -> None:
+    """Entry point of one worker process; SIGTERM or Ctrl-C lets the current job finish"""
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    counts = work(queues, visibility_timeout, rate, drain, stop)
+    print(f"✅ [{worker_id()}] stopped: {counts['done']} done, {counts['failed']} failed, {counts['lost']} leases lost")
+    metrics.finish()
+
+def print_stats(queue: JobQueue) -> None:
+    stats = queue.stats()
+    if not stats:
+        print("No jobs")
+    for name, entry in sorted(stats.items()):
+        age = f", oldest ready {entry['oldest_ready_age']:.0f}s" if entry['oldest_ready_age'] is not None else ""
+        print(f"{name}: {entry['ready']} ready, {entry['leased']} leased, {entry['done']} done, "
+              f"{entry['dead']} dead{age}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Run and manage the durable embedding job queue")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    work_parser = commands.add_parser('work', help="Run worker processes")
+    work_parser.add_argument('-p', '--processes', type=int, default=os.cpu_count() or 1)
+    work_parser.add_argument('--queue', choices=list(HANDLERS), action='append',
+                             help="Queue to work on (repeatable; default: all)")
+    work_parser.add_argument('--visibility-timeout', type=float, default=DEFAULT_VISIBILITY_TIMEOUT)
+    work_parser.add_argument('--rate', type=float, default=DEFAULT_RATE,
+                             help="Maximum rows per second per process (0 for unthrottled)")
+    work_parser.add_argument('--drain', action='store_true', help="Exit once the queues are empty")
+
+    missing = commands.add_parser('enqueue-missing', help="Queue every message that has no embedding")
+    missing.add_argument('--source', choices=['messages', 'direct_messages'], action='append')
+    missing.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    commands.add_parser('stats', help="Show job counts per queue")
+    dead = commands.add_parser('dead', help="List dead-lettered jobs")
+    dead.add_argument('queue', choices=list(HANDLERS))
+    requeue = commands.add_parser('requeue', help="Retry dead-lettered jobs")
+    requeue.add_argument('queue', choices=list(HANDLERS))
+    requeue.add_argument('ids', type=int, nargs='*')
+    purge = commands.add_parser('purge', help="Delete finished jobs")
+    purge.add_argument('--days', type=float, default=7.0)
+
+    args = parser.parse_args()
+    metrics.start_profiling()
+
+    if args.command == 'work':
+        queues = args.queue or list(HANDLERS)
+        print(f"🚀 Starting {args.processes} workers on {', '.join(queues)}")
+        processes = [multiprocessing.Process(target=worker_main,
+                                             args=(queues, args.visibility_timeout, args.rate, args.drain))
+                     for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            # The workers got the signal too and stop after their current job
+            for process in processes:
+                process.join()
+        return
+
+    queue = JobQueue()
+    if args.command == 'enqueue-missing':
+        added = enqueue_missing(args.source or ['messages', 'direct_messages'], args.batch_size, queue)
+        print(f"📥 Queued {added} new embed_messages jobs")
+    elif args.command == 'stats':
+        print_stats(queue)
+    elif args.command == 'dead':
+        for job in queue.dead_letters(args.queue):
+            print(f"{job['id']}: {job['attempts']} attempts, last error: {job['last_error']}")
+    elif args.command == 'requeue':
+        print(f"Requeued {queue.requeue_dead(args.queue, args.ids)} jobs")
+    elif args.command == 'purge':
+        print(f"Purged {queue.purge_done(args.days * 24 * 3600)} finished jobs")
+
+if __name__ == "__main__":
+    main()
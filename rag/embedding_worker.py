@@ -0,0 +1,465 @@
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from clients import get_supabase, load_env
+from instrumentation import metrics
+from normalization import count_tokens
+from query_cache import invalidate_team
+from reindex_embeddings import content_md5, embed_texts, get_models
+from resilience import call_with_retries
+
+# Channel the messages triggers NOTIFY on (see migrations/008_message_embedding_feed.sql)
+CHANNEL = 'message_embedding_changes'
+
+# Used until migrations/006_embedding_models.sql is applied
+EMBEDDING_MODEL = "text-embedding-ada-002"
+
+# A batch is embedded once it holds this many messages or tokens...
+DEFAULT_BATCH_SIZE = 100
+MAX_BATCH_TOKENS = 100_000
+# ...or its oldest change has waited this many seconds
+DEFAULT_MAX_WAIT = 2.0
+
+# Columns carried from a change into its embedding row (team for channel messages, channel for DMs)
+SCOPE_KEYS = ('team_id', 'channel_id')
+
+# Longest input the embedding models accept
+MAX_EMBEDDING_TOKENS = 8191
+
+# Changes read from the outbox per request
+FETCH_LIMIT = 500
+
+# --check-client-insert signs in with this password (the one scripts/seed_database.py gives seed users)
+# and replays the outbox with this offline backend
+CHECK_PASSWORD = "Password123!"
+CHECK_BACKEND = 'hashing:1536'
+
+# How often the outbox is polled when no LISTEN connection is available
+POLL_INTERVAL = 5.0
+
+# How long the registered embedding model is trusted before it is read again
+MODELS_TTL = 60.0
+
+class OutboxFeed:
+    """Changes queued in message_embedding_changes
+
+    The outbox is the source of truth, so changes made while the worker is
+    down are picked up on start. It is read from the start on every fetch
+    rather than after a cursor: change ids are taken when a write starts but
+    become visible when it commits, so a lower id can appear after a higher
+    one was read. store_message_embeddings deletes the changes it
+    acknowledges, so what is left is exactly what still needs embedding.
+    A LISTEN connection (psycopg plus
+    DIRECT_URL or DATABASE_URL) only wakes the worker as soon as a change
+    commits; without one the outbox is polled every POLL_INTERVAL seconds.
+    """
+
+    def __init__(self, dsn: Optional[str] = None, poll_interval: float = POLL_INTERVAL):
+        load_env()
+        self.dsn = dsn or os.getenv('DIRECT_URL') or os.getenv('DATABASE_URL')
+        self.poll_interval = poll_interval
+        self.connection = None
+        self.next_connect = 0.0
+
+    def listen(self) -> bool:
+        """Open the LISTEN connection if possible; returns whether one is open"""
+        if self.connection is not None:
+            return True
+        if not self.dsn or time.monotonic() < self.next_connect:
+            return False
+        try:
+            import psycopg
+        except ImportError:
+            print(f"⚠️  psycopg is not installed; polling the outbox every {self.poll_interval:g}s")
+            self.dsn = None
+            return False
+        try:
+            self.connection = psycopg.connect(self.dsn, autocommit=True)
+            self.connection.execute(f"LISTEN {CHANNEL}")
+            print(f"👂 Listening on {CHANNEL}")
+            return True
+        except Exception as e:
+            print(f"⚠️  Could not LISTEN ({e}); polling until the next attempt")
+            self.connection = None
+            self.next_connect = time.monotonic() + 10 * self.poll_interval
+            return False
+
+    def wait(self, timeout: float) -> None:
+        """Block until a change may be waiting, or timeout seconds pass"""
+        if not self.listen():
+            time.sleep(min(timeout, self.poll_interval))
+            return
+        try:
+            for _ in self.connection.notifies(timeout=timeout, stop_after=1):
+                pass
+        except Exception as e:
+            print(f"⚠️  LISTEN connection lost ({e})")
+            self.close()
+
+    def fetch(self, limit: int = FETCH_LIMIT) -> List[Dict]:
+        """Unacknowledged changes, oldest first; changes already pending in a batch come back too"""
+        with metrics.stage('fetch'):
+            return call_with_retries(get_supabase('service').rpc('pending_message_embedding_changes', {
+                'p_limit': limit,
+            }).execute, 'supabase').data or []
+
+    def commit(self, rows: List[Dict], change_ids: List[int]) -> int:
+        """Upsert embeddings and remove the changes they cover; returns the rows stored"""
+        with metrics.stage('store'):
+            stored = call_with_retries(get_supabase('service').rpc('store_message_embeddings', {
+                'p_rows': rows,
+                'p_change_ids': change_ids,
+            }).execute, 'supabase').data or 0
+        for team_id in {row['team_id'] for row in rows if row['team_id']}:
+            invalidate_team(team_id)
+        return stored
+
+    def close(self) -> None:
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+class LocalFeed:
+    """In-process stand-in for the outbox and message_embeddings, for tests and local runs
+
+    Changes are published directly and embeddings kept in memory, with the
+    same stale-content check store_message_embeddings applies.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.changes: List[Dict] = []
+        self.messages: Dict[str, Dict] = {}
+        self.embeddings: Dict[str, Dict] = {}
+        self.next_id = 1
+        # Highest change id fetched so far; only used to tell wait() something new arrived, like NOTIFY
+        self.seen = 0
+
+    def publish(self, message_id: str, content: Optional[str], team_id: Optional[str] = None) -> None:
+        """Record a new, edited (or, with content None, deleted) message"""
+        with self.condition:
+            if content is None:
+                self.messages.pop(message_id, None)
+                self.embeddings.pop(message_id, None)
+            else:
+                self.messages[message_id] = {'content': content, 'team_id': team_id}
+            self.changes.append({'change_id': self.next_id, 'message_id': message_id,
+                                 'changed_at': datetime.now(timezone.utc).isoformat()})
+            self.next_id += 1
+            self.condition.notify_all()
+
+    def wait(self, timeout: float) -> None:
+        with self.condition:
+            self.condition.wait_for(lambda: any(c['change_id'] > self.seen for c in self.changes), timeout)
+
+    def fetch(self, limit: int = FETCH_LIMIT) -> List[Dict]:
+        with self.condition:
+            # Every unacknowledged change, as OutboxFeed reads them
+            changes = self.changes[:limit]
+            self.seen = max([self.seen] + [c['change_id'] for c in changes])
+            return [{**c, **self.messages.get(c['message_id'], {'content': None, 'team_id': None})}
+                    for c in changes]
+
+    def commit(self, rows: List[Dict], change_ids: List[int]) -> int:
+        with self.condition:
+            stored = 0
+            for row in rows:
+                message = self.messages.get(row['message_id'])
+                if message and content_md5(message['content']) == row['content_md5']:
+                    self.embeddings[row['message_id']] = {**row, 'content': message['content']}
+                    stored += 1
+            done = set(change_ids)
+            self.changes = [c for c in self.changes if c['change_id'] not in done]
+            return stored
+
+    def close(self) -> None:
+        pass
+
+class MicroBatcher:
+    """Collects changes until a batch is full or its oldest change has waited max_wait
+
+    Repeated changes to one message coalesce: only its latest content is
+    embedded, and every change id it absorbed is acknowledged with it.
+    """
+
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE, max_wait: float = DEFAULT_MAX_WAIT,
+                 max_tokens: int = MAX_BATCH_TOKENS):
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.max_tokens = max_tokens
+        # message_id -> latest change, plus the ids of every change it covers
+        self.pending: Dict[str, Dict] = {}
+        self.tokens = 0
+        self.oldest: Optional[float] = None
+
+    def add(self, changes: List[Dict]) -> None:
+        for change in changes:
+            previous = self.pending.pop(change['message_id'], None)
+            # Every fetch hands back the changes still pending
+            change_ids = sorted(set(previous['change_ids'] if previous else []) | {change['change_id']})
+            if previous:
+                self.tokens -= previous['tokens']
+            tokens = count_tokens(change['content']) if change.get('content') else 0
+            self.pending[change['message_id']] = {**change, 'change_ids': change_ids, 'tokens': tokens}
+            self.tokens += tokens
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+
+    def time_left(self) -> Optional[float]:
+        """Seconds until the pending batch is due, or None if nothing is pending"""
+        if self.oldest is None:
+            return None
+        return max(0.0, self.max_wait - (time.monotonic() - self.oldest))
+
+    def ready(self) -> bool:
+        return bool(self.pending) and (len(self.pending) >= self.batch_size
+                                       or self.tokens >= self.max_tokens
+                                       or self.time_left() == 0)
+
+    def take(self) -> List[Dict]:
+        """Remove and return the next batch, bounded by batch_size and max_tokens"""
+        batch, tokens = [], 0
+        for message_id in list(self.pending):
+            change = self.pending[message_id]
+            if batch and (len(batch) >= self.batch_size or tokens + change['tokens'] > self.max_tokens):
+                break
+            batch.append(self.pending.pop(message_id))
+            tokens += change['tokens']
+        self.tokens -= tokens
+        # Whatever is left has been waiting at least as long as this batch
+        self.oldest = (time.monotonic() - self.max_wait) if self.pending else None
+        return batch
+
+_models: Optional[Dict] = None
+_models_read = 0.0
+
+def load_models() -> Dict:
+    """Registered model for message_embeddings (plus its re-index target), cached for MODELS_TTL"""
+    global _models, _models_read
+    if _models is None or time.monotonic() - _models_read > MODELS_TTL:
+        try:
+            _models = get_models('message_embeddings')
+        except Exception as e:
+            if _models is None:
+                print(f"⚠️  No embedding model registry ({e}); using {EMBEDDING_MODEL}")
+                _models = {'model': EMBEDDING_MODEL, 'version': 1}
+        _models_read = time.monotonic()
+    return _models
+
+def embed_batch(batch: List[Dict], embed: Callable[[List[str], str], List[List[float]]] = embed_texts,
+                models: Optional[Dict] = None) -> List[Dict]:
+    """Embed a batch in one request per model and build the rows store_message_embeddings takes
+
+    While a re-index is running the target model's vector is written too
+    (dual-write), as embed_tweets.py does. models defaults to the registry
+    entry for message_embeddings.
+    """
+    models = models or load_models()
+    texts = [change['content'] for change in batch]
+    vectors = embed(texts, models['model'])
+    next_vectors = embed(texts, models['target_model']) if models.get('target_model') else None
+
+    rows = []
+    for i, change in enumerate(batch):
+        row = {
+            'message_id': change['message_id'],
+            **{key: change[key] for key in SCOPE_KEYS if key in change},
+            'content_md5': content_md5(change['content']),
+            'embedding': vectors[i],
+            'embedding_model': models['model'],
+            'embedding_version': models['version'],
+        }
+        if next_vectors is not None:
+            row.update({
+                'embedding_next': next_vectors[i],
+                'embedding_next_model': models['target_model'],
+                'embedding_next_version': models['target_version'],
+            })
+        rows.append(row)
+    return rows
+
+def lag_seconds(batch: List[Dict]) -> Optional[float]:
+    """Age of the oldest change in a batch"""
+    times = [datetime.fromisoformat(c['changed_at'].replace('Z', '+00:00')) for c in batch if c.get('changed_at')]
+    if not times:
+        return None
+    return (datetime.now(timezone.utc) - min(times)).total_seconds()
+
+def process_batch(feed, batch: List[Dict],
+                  embed: Callable[[List[str], str], List[List[float]]] = embed_texts) -> Tuple[int, int]:
+    """Embed and store one batch; returns (messages stored, changes acknowledged)"""
+    change_ids = [i for change in batch for i in change['change_ids']]
+    embeddable = [c for c in batch if c.get('content') and c['tokens'] <= MAX_EMBEDDING_TOKENS]
+    for change in batch:
+        if change.get('content') and change['tokens'] > MAX_EMBEDDING_TOKENS:
+            print(f"⚠️  Skipping message {change['message_id']}: over {MAX_EMBEDDING_TOKENS} tokens")
+
+    lag = lag_seconds(batch)
+    try:
+        # Deleted messages lose their embeddings through the foreign key; their changes are only acknowledged
+        rows = embed_batch(embeddable, embed) if embeddable else []
+        stored = feed.commit(rows, change_ids)
+    except Exception as e:
+        # Its changes stay in the outbox, so the next fetch reads them again
+        print(f"❌ Batch of {len(batch)} failed ({e}); will retry")
+        return 0, 0
+
+    metrics.item('embedded', stored)
+    print(f"  embedded {stored}/{len(batch)} messages ({len(change_ids)} changes"
+          + (f", lag {lag:.1f}s)" if lag is not None else ")"))
+    return stored, len(change_ids)
+
+def run_worker(feed, batch_size: int = DEFAULT_BATCH_SIZE, max_wait: float = DEFAULT_MAX_WAIT,
+               drain: bool = False, idle_timeout: float = 60.0,
+               embed: Callable[[List[str], str], List[List[float]]] = embed_texts,
+               stop: Optional[threading.Event] = None) -> int:
+    """Consume the feed until stopped; with drain, stop once the outbox is empty
+
+    Returns the number of messages embedded.
+    """
+    batcher = MicroBatcher(batch_size, max_wait)
+    stop = stop or threading.Event()
+    embedded = 0
+
+    while not stop.is_set():
+        changes = feed.fetch()
+        batcher.add(changes)
+        exhausted = len(changes) < FETCH_LIMIT
+
+        failed = False
+        while batcher.ready() or (drain and exhausted and batcher.pending):
+            stored, acknowledged = process_batch(feed, batcher.take(), embed)
+            embedded += stored
+            if not acknowledged:
+                failed = True
+                break
+        if failed:
+            # Back off before the failed changes are read again
+            stop.wait(max_wait)
+            continue
+
+        if drain and exhausted and not batcher.pending:
+            break
+        if exhausted:
+            time_left = batcher.time_left()
+            feed.wait(idle_timeout if time_left is None else time_left)
+
+    feed.close()
+    return embedded
+
+def check_client_writes(email: str, password: str = CHECK_PASSWORD) -> bool:
+    """Insert and edit a message as a signed-in client, and check the outbox queued both
+
+    The outbox trigger runs inside the client's own write, so if it cannot
+    write the outbox (RLS, grants) every message the app sends fails. The
+    queued message is then replayed through a LocalFeed with the offline
+    hashing backend, so the check needs no embedding API. The message is
+    deleted afterwards.
+    """
+    from supabase import create_client
+    from embedding_backends import embed as embed_with
+    load_env()
+    # A client of its own: signing in would change the session of the shared anon client
+    client = create_client(os.getenv('NEXT_PUBLIC_SUPABASE_URL', ''), os.getenv('NEXT_PUBLIC_SUPABASE_ANON_KEY', ''))
+    service = get_supabase('service')
+    message_id = None
+    try:
+        user = client.auth.sign_in_with_password({'email': email, 'password': password}).user
+        memberships = call_with_retries(client.table('channel_members').select('channel_id, channels(team_id)')
+                                        .eq('user_id', user.id).limit(1).execute, 'supabase').data
+        if not memberships:
+            print(f"❌ {email} is not a member of any channel")
+            return False
+
+        content = f"Embedding outbox check {datetime.now(timezone.utc).isoformat()}"
+        inserted = call_with_retries(client.table('messages').insert({
+            'content': content,
+            'channel_id': memberships[0]['channel_id'],
+            'user_id': user.id,
+        }).execute, 'supabase', idempotent=False).data
+        message_id = inserted[0]['id']
+        content += " (edited)"
+        call_with_retries(client.table('messages').update({'content': content}).eq('id', message_id).execute,
+                          'supabase')
+        print(f"✅ Inserted and edited message {message_id} as {email}")
+
+        queued = call_with_retries(service.table('message_embedding_changes').select('id')
+                                   .eq('message_id', message_id).execute, 'supabase').data
+        if len(queued) < 2:
+            print(f"❌ Expected 2 queued changes for {message_id}, found {len(queued)}")
+            return False
+        print(f"✅ Outbox queued {len(queued)} changes")
+
+        feed = LocalFeed()
+        feed.publish(message_id, content, (memberships[0].get('channels') or {}).get('team_id'))
+        embedded = run_worker(feed, drain=True, embed=lambda texts, _: embed_with(texts, CHECK_BACKEND))
+        print(f"{'✅' if embedded == 1 else '❌'} LocalFeed replay embedded {embedded} message(s)")
+        return embedded == 1
+    except Exception as e:
+        print(f"❌ Client write failed: {e}")
+        return False
+    finally:
+        if message_id:
+            call_with_retries(client.table('messages').delete().eq('id', message_id).execute, 'supabase')
+            # The deleted message leaves nothing for the real worker to embed
+            call_with_retries(service.table('message_embedding_changes').delete()
+                              .eq('message_id', message_id).execute, 'supabase')
+        client.auth.sign_out()
+
+def read_local_messages(path: str) -> List[Dict]:
+    """JSON lines of {"id", "content", "team_id"} for a --local run"""
+    source = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    with source:
+        return [json.loads(line) for line in source if line.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed new and edited messages as they change")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Messages embedded per request")
+    parser.add_argument('--max-wait', type=float, default=DEFAULT_MAX_WAIT,
+                        help="Seconds a change waits for its batch to fill")
+    parser.add_argument('--drain', action='store_true', help="Exit once no changes are pending")
+    parser.add_argument('--local', metavar='FILE',
+                        help="Embed messages from a JSON lines file ('-' for stdin) without a database")
+    parser.add_argument('--check-client-insert', metavar='EMAIL',
+                        help="Check that a client signed in as EMAIL can still insert and edit messages, then exit")
+    parser.add_argument('--password', default=CHECK_PASSWORD, help="Password for --check-client-insert")
+    args = parser.parse_args()
+    metrics.start_profiling()
+
+    if args.check_client_insert:
+        sys.exit(0 if check_client_writes(args.check_client_insert, args.password) else 1)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+
+    if args.local:
+        feed = LocalFeed()
+        for message in read_local_messages(args.local):
+            feed.publish(message['id'], message.get('content'), message.get('team_id'))
+        embedded = run_worker(feed, args.batch_size, args.max_wait, drain=True, stop=stop)
+        print(f"✅ Embedded {embedded} messages locally")
+        metrics.finish()
+        return
+
+    print(f"🚀 Embedding worker started (batches of {args.batch_size}, window {args.max_wait:g}s)")
+    try:
+        embedded = run_worker(OutboxFeed(), args.batch_size, args.max_wait, drain=args.drain, stop=stop)
+    except KeyboardInterrupt:
+        # Unacknowledged changes stay in the outbox for the next run
+        embedded = None
+    print("✅ Embedding worker stopped" + (f" after embedding {embedded} messages" if embedded is not None else ""))
+    metrics.finish()
+
+if __name__ == "__main__":
+    main()
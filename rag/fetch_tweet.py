@@ -1,27 +1,8 @@
-import tweepy
 import os
 import json
 from datetime import datetime
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
-
-# Authentication credentials
-api_key = os.getenv('TWITTER_API_KEY')
-api_secret = os.getenv('TWITTER_API_SECRET')
-access_token = os.getenv('TWITTER_ACCESS_TOKEN')
-access_token_secret = os.getenv('TWITTER_ACCESS_TOKEN_SECRET')
-bearer_token = os.getenv('TWITTER_BEARER_TOKEN')
-
-# Create client object for v2 API
-client = tweepy.Client(
-    bearer_token=bearer_token,
-    consumer_key=api_key,
-    consumer_secret=api_secret,
-    access_token=access_token,
-    access_token_secret=access_token_secret
-)
+from clients import get_twitter
+from instrumentation import metrics
 
 def get_user_tweets(username, num_tweets=100):
     """
@@ -30,8 +11,11 @@ def get_user_tweets(username, num_tweets=100):
     num_tweets: Number of tweets to fetch (default 100)
     """
     try:
+        client = get_twitter()
+        
         # First get user ID from username
-        user = client.get_user(username=username)
+        with metrics.stage('fetch'):
+            user = client.get_user(username=username)
         if not user.data:
             print(f"User @{username} not found")
             return
@@ -39,13 +23,14 @@ def get_user_tweets(username, num_tweets=100):
         user_id = user.data.id
 
         # Fetch tweets using v2 API
-        tweets = client.get_users_tweets(
-            id=user_id,
-            max_results=num_tweets,
-            tweet_fields=['created_at', 'public_metrics', 'entities'],
-            user_fields=['name', 'username', 'public_metrics'],
-            expansions=['author_id']
-        )
+        with metrics.stage('fetch'):
+            tweets = client.get_users_tweets(
+                id=user_id,
+                max_results=num_tweets,
+                tweet_fields=['created_at', 'public_metrics', 'entities'],
+                user_fields=['name', 'username', 'public_metrics'],
+                expansions=['author_id']
+            )
         
         if not tweets.data:
             print(f"No tweets found for @{username}")
@@ -88,8 +73,10 @@ def get_user_tweets(username, num_tweets=100):
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"data/{username}_tweets_{timestamp}.json"
         
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(tweets_data, f, indent=4, ensure_ascii=False)
+        with metrics.stage('save'):
+            with open(filename, 'w', encoding='utf-8') as f:
+                json.dump(tweets_data, f, indent=4, ensure_ascii=False)
+        metrics.item('tweets', len(tweets_data))
             
         print(f"\nTweets saved to {filename}")
             
@@ -101,4 +88,6 @@ if __name__ == "__main__":
     username = "austen"  # Replace with any Twitter username
     num_tweets = 50        # Number of tweets you want to fetch
     
+    metrics.start_profiling()
     get_user_tweets(username, num_tweets)
+    metrics.finish()
@@ -0,0 +1,161 @@
+import argparse
+import json
+import os
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from bm25 import INDEX_DIR, BM25Index
+from clients import get_supabase
+from embedding_backends import embed as embed_texts
+from instrumentation import metrics
+from message_export import MANIFEST_FILE, load_documents
+from query_cache import get_query_cache
+from reindex_embeddings import current_model
+from resilience import call_with_retries
+from team_index import has_team, load_routing, search as search_team
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+TWEETS_FILE = os.path.join(DATA_DIR, 'processedtweets.json')
+
+# Rank offset for reciprocal rank fusion; 60 is the value from the original RRF paper
+RRF_K = 60
+
+# Candidates taken from each retriever before fusing
+CANDIDATES = 50
+
+# Model of the vectors in message_embeddings until the model registry says otherwise
+EMBEDDING_MODEL = "text-embedding-ada-002"
+_query_model: Optional[str] = None
+
+def tweet_key(text: str) -> str:
+    """Stable key for a tweet, which has no id in processedtweets.json"""
+    return f"tweets:{zlib.crc32(text.encode('utf-8')):08x}"
+
+def load_corpora() -> Dict[str, Dict]:
+    """Documents (and their message-id aliases) from each exported corpus, by origin"""
+    corpora = {}
+    if os.path.exists(MANIFEST_FILE):
+        documents = load_documents()
+        corpora['processed_messages'] = {
+            'documents': {doc['id']: doc['text'] for doc in documents},
+            'aliases': {doc['id']: doc['message_ids'] for doc in documents},
+        }
+    if os.path.exists(TWEETS_FILE):
+        with open(TWEETS_FILE, 'r', encoding='utf-8') as f:
+            tweets = json.load(f)['tweets']
+        corpora['processedtweets'] = {
+            'documents': {tweet_key(text): text for text in tweets},
+            'aliases': {},
+        }
+    return corpora
+
+def update_index(path: str = INDEX_DIR) -> Tuple[BM25Index, Dict[str, str]]:
+    """Bring the saved index up to date with the exported corpora
+
+    Only new or changed documents are tokenized. Returns the index plus the
+    text of every document, for display.
+    """
+    index = BM25Index.load(path)
+    texts = {}
+    changed = False
+    with metrics.stage('index'):
+        for origin, corpus in load_corpora().items():
+            stats = index.sync(origin, corpus['documents'], corpus['aliases'])
+            texts.update(corpus['documents'])
+            print(f"📚 {origin}: {stats['added']} indexed, {stats['removed']} removed, "
+                  f"{stats['unchanged']} unchanged")
+            changed = changed or stats['added'] or stats['removed']
+        if changed:
+            index.save(path)
+    return index, texts
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = RRF_K,
+                           weights: Optional[Sequence[float]] = None) -> List[Tuple[str, float]]:
+    """Fuse ranked key lists: each key scores sum(weight / (k + rank)) over the lists it appears in"""
+    weights = weights or [1.0] * len(rankings)
+    scores: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, key in enumerate(ranking, 1):
+            scores[key] = scores.get(key, 0.0) + weight / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+def query_model() -> str:
+    """Model the message_embeddings vectors were produced with"""
+    global _query_model
+    if _query_model is None:
+        _query_model = current_model('message_embeddings', EMBEDDING_MODEL)
+    return _query_model
+
+def embed_query(query: str) -> List[float]:
+    """Embedding for a search query, served from the query cache when possible
+
+    Queries are embedded with whichever model message_embeddings currently
+    serves, so results stay correct across a re-index cutover.
+    """
+    model = query_model()
+    def embed(text: str) -> List[float]:
+        with metrics.stage('embed'):
+            return embed_texts([text], model)[0]
+    return get_query_cache().embedding(query, model, embed)
+
+def vector_search(query: str, team_id: str, k: int = CANDIDATES) -> List[str]:
+    """Message ids nearest to the query in message_embeddings, best first
+
+    Teams with a local shard (see team_index.py) are searched there, scanning
+    only that team's vectors; others fall back to find_similar_messages.
+    Results are cached per team until new embeddings are written for it.
+    """
+    def search() -> List[str]:
+        embedding = embed_query(query)
+        routing = load_routing()
+        if has_team(team_id, routing):
+            with metrics.stage('vector'):
+                return [message_id for message_id, _ in search_team(team_id, embedding, k, routing=routing)]
+        with metrics.stage('vector'):
+            rows = call_with_retries(get_supabase().rpc('find_similar_messages', {
+                'query_embedding': embedding,
+                'team_id_filter': team_id,
+                'similarity_threshold': 0.0,
+                'max_results': k,
+            }).execute, 'supabase').data
+        return [row['message_id'] for row in rows]
+    return get_query_cache().results(query, query_model(), team_id, k, search)
+
+def hybrid_search(index: BM25Index, query: str, k: int = 10,
+                  vector_ids: Optional[List[str]] = None) -> List[Tuple[str, float]]:
+    """Top-k document keys for a query, fusing BM25 with vector results when given
+
+    vector_ids may be message ids; they are mapped onto the documents that
+    contain them so both retrievers rank the same units.
+    """
+    with metrics.stage('bm25'):
+        lexical = [key for key, _ in index.search(query, CANDIDATES)]
+    if not vector_ids:
+        return [(key, 1.0 / (RRF_K + rank)) for rank, key in enumerate(lexical[:k], 1)]
+
+    semantic = []
+    for message_id in vector_ids:
+        key = index.resolve(message_id) or message_id
+        if key not in semantic:
+            semantic.append(key)
+    return reciprocal_rank_fusion([lexical, semantic])[:k]
+
+def main():
+    parser = argparse.ArgumentParser(description="Search exported messages and tweets with BM25, optionally fused with vector search")
+    parser.add_argument('query', help="Search query")
+    parser.add_argument('-k', type=int, default=10, help="Number of results")
+    parser.add_argument('--team', help="Also run vector search over this team's message_embeddings and fuse the results")
+    args = parser.parse_args()
+    metrics.start_profiling()
+
+    index, texts = update_index()
+    vector_ids = vector_search(args.query, args.team) if args.team else None
+    results = hybrid_search(index, args.query, args.k, vector_ids)
+
+    for rank, (key, score) in enumerate(results, 1):
+        text = texts.get(key, key).replace('\n', ' ')
+        print(f"{rank:2d}. [{score:.4f}] {key}\n    {text[:200]}")
+    metrics.finish()
+
+if __name__ == "__main__":
+    main()
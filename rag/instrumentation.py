@@ -0,0 +1,333 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import profiling
+
+# Write metrics here at the end of a run (.prom for Prometheus text, anything else for JSON)
+METRICS_FILE = os.getenv('PIPELINE_METRICS_FILE')
+
+# Show a live progress line on stderr
+PROGRESS = os.getenv('PIPELINE_PROGRESS', '') not in ('', '0', 'false')
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Minimum interval between progress line redraws
+PROGRESS_INTERVAL = 0.2
+
+class Histogram:
+    """Cumulative-bucket latency histogram, Prometheus style"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile by linear interpolation within its bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for i, bound in enumerate(self.buckets):
+            if seen + self.counts[i] >= rank:
+                fraction = (rank - seen) / self.counts[i] if self.counts[i] else 0
+                return min(lower + (bound - lower) * fraction, self.max)
+            seen += self.counts[i]
+            lower = bound
+        return self.max
+
+    def to_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': {str(bound): count for bound, count in zip(self.buckets + ('+Inf',), self.counts)},
+        }
+
+class Metrics:
+    """Thread-safe registry of stage timings, remote calls and counters for one run"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.stages: Dict[str, Histogram] = {}
+        self.calls: Dict[Tuple[str, str], Histogram] = {}
+        self.errors: Dict[Tuple[str, str], int] = {}
+        self.retries: Dict[str, int] = {}
+        self.items: Dict[str, int] = {}
+        self.bytes: Dict[Tuple[str, str], int] = {}
+        self.pools: Dict[str, Dict[str, int]] = {}
+        self.caches: Dict[str, Dict[str, int]] = {}
+        self._progress_drawn = 0.0
+        # Set by start_profiling() when PIPELINE_PROFILE is (see profiling.py)
+        self.profiler = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a pipeline stage"""
+        if self.profiler:
+            self.profiler.enter(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.stages.setdefault(name, Histogram()).observe(elapsed)
+            if self.profiler:
+                self.profiler.exit(name)
+
+    def record_call(self, service: str, endpoint: str, seconds: float, ok: bool = True,
+                    bytes_sent: int = 0, bytes_received: int = 0) -> None:
+        """Record one remote call's latency, outcome and payload sizes"""
+        key = (service, endpoint)
+        with self.lock:
+            self.calls.setdefault(key, Histogram()).observe(seconds)
+            if not ok:
+                self.errors[key] = self.errors.get(key, 0) + 1
+            self.bytes[(service, 'sent')] = self.bytes.get((service, 'sent'), 0) + bytes_sent
+            self.bytes[(service, 'received')] = self.bytes.get((service, 'received'), 0) + bytes_received
+
+    @contextmanager
+    def call(self, service: str, endpoint: str, bytes_sent: int = 0):
+        """Time a remote call that is not made through an instrumented HTTP client"""
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.record_call(service, endpoint, time.perf_counter() - start, ok, bytes_sent)
+
+    def record_pool(self, service: str, new_connections: int, open_connections: int) -> None:
+        """Record whether a request reused a pooled connection, and the pool's size"""
+        with self.lock:
+            pool = self.pools.setdefault(service, {'requests': 0, 'new_connections': 0, 'open_connections': 0})
+            pool['requests'] += 1
+            pool['new_connections'] += new_connections
+            pool['open_connections'] = open_connections
+
+    def record_cache(self, cache: str, hit: bool) -> None:
+        """Record a cache lookup"""
+        with self.lock:
+            counts = self.caches.setdefault(cache, {'hits': 0, 'misses': 0})
+            counts['hits' if hit else 'misses'] += 1
+
+    def retry(self, service: str) -> None:
+        """Count a retried remote call"""
+        with self.lock:
+            self.retries[service] = self.retries.get(service, 0) + 1
+
+    def item(self, stage: str, count: int = 1, total: Optional[int] = None) -> None:
+        """Count processed items for throughput, redrawing the progress line if enabled"""
+        with self.lock:
+            self.items[stage] = self.items.get(stage, 0) + count
+            done = self.items[stage]
+        if PROGRESS:
+            self._draw_progress(stage, done, total)
+
+    def _draw_progress(self, stage: str, done: int, total: Optional[int]) -> None:
+        now = time.perf_counter()
+        if now - self._progress_drawn < PROGRESS_INTERVAL and done != total:
+            return
+        self._progress_drawn = now
+        rate = done / max(now - self.started, 1e-9)
+        progress = f"{done}/{total}" if total else str(done)
+        sys.stderr.write(f"\r⏳ {stage}: {progress} ({rate:.1f}/s)\033[K")
+        if done == total:
+            sys.stderr.write('\n')
+        sys.stderr.flush()
+
+    def to_dict(self) -> Dict:
+        elapsed = time.perf_counter() - self.started
+        with self.lock:
+            return {
+                'elapsed_seconds': round(elapsed, 3),
+                'stages': {name: h.to_dict() for name, h in self.stages.items()},
+                'remote_calls': [{
+                    'service': service,
+                    'endpoint': endpoint,
+                    'errors': self.errors.get((service, endpoint), 0),
+                    **h.to_dict(),
+                } for (service, endpoint), h in self.calls.items()],
+                'retries': dict(self.retries),
+                'throughput': {
+                    stage: {'items': count, 'per_second': round(count / max(elapsed, 1e-9), 3)}
+                    for stage, count in self.items.items()
+                },
+                'bytes': {f"{service}.{direction}": count for (service, direction), count in self.bytes.items()},
+                'pools': {service: {
+                    **pool,
+                    'hit_rate': round(1 - min(pool['new_connections'], pool['requests']) / pool['requests'], 4)
+                    if pool['requests'] else None,
+                } for service, pool in self.pools.items()},
+                'caches': {cache: {
+                    **counts,
+                    'hit_rate': round(counts['hits'] / (counts['hits'] + counts['misses']), 4),
+                } for cache, counts in self.caches.items()},
+            }
+
+    def to_prometheus(self) -> str:
+        """Render the registry in the Prometheus text exposition format"""
+        lines: List[str] = []
+
+        def histogram(name: str, help_text: str, series: Dict[str, Histogram]) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, h in series.items():
+                cumulative = 0
+                for bound, count in zip(h.buckets + ('+Inf',), h.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {h.sum}")
+                lines.append(f"{name}_count{{{labels}}} {h.count}")
+
+        def counter(name: str, help_text: str, series: Dict[str, int]) -> None:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{{{labels}}} {value}")
+
+        with self.lock:
+            histogram('pipeline_stage_seconds', 'Time spent in each pipeline stage.',
+                      {f'stage="{name}"': h for name, h in self.stages.items()})
+            histogram('pipeline_remote_call_seconds', 'Latency of remote calls.',
+                      {f'service="{s}",endpoint="{e}"': h for (s, e), h in self.calls.items()})
+            counter('pipeline_remote_call_errors_total', 'Failed remote calls.',
+                    {f'service="{s}",endpoint="{e}"': n for (s, e), n in self.errors.items()})
+            counter('pipeline_retries_total', 'Retried remote calls.',
+                    {f'service="{s}"': n for s, n in self.retries.items()})
+            counter('pipeline_items_total', 'Items processed per stage.',
+                    {f'stage="{s}"': n for s, n in self.items.items()})
+            counter('pipeline_payload_bytes_total', 'Bytes sent and received per service.',
+                    {f'service="{s}",direction="{d}"': n for (s, d), n in self.bytes.items()})
+            counter('pipeline_pool_requests_total', 'Requests sent through each connection pool.',
+                    {f'service="{s}"': p['requests'] for s, p in self.pools.items()})
+            counter('pipeline_pool_connections_opened_total', 'Connections opened by each pool.',
+                    {f'service="{s}"': p['new_connections'] for s, p in self.pools.items()})
+            counter('pipeline_cache_lookups_total', 'Cache lookups by outcome.',
+                    {f'cache="{c}",result="{r}"': counts[field]
+                     for c, counts in self.caches.items() for r, field in (('hit', 'hits'), ('miss', 'misses'))})
+            lines.append("# HELP pipeline_pool_open_connections Connections currently held by each pool.")
+            lines.append("# TYPE pipeline_pool_open_connections gauge")
+            for service, pool in self.pools.items():
+                lines.append(f'pipeline_pool_open_connections{{service="{service}"}} {pool["open_connections"]}')
+
+        lines.append("# HELP pipeline_run_seconds Wall time of the run so far.")
+        lines.append("# TYPE pipeline_run_seconds gauge")
+        lines.append(f"pipeline_run_seconds {time.perf_counter() - self.started}")
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> str:
+        """Short human-readable summary of where the run spent its time"""
+        data = self.to_dict()
+        lines = [f"⏱  Run took {data['elapsed_seconds']:.1f}s"]
+        for name, h in data['stages'].items():
+            lines.append(f"  stage {name}: {h['sum']:.2f}s over {h['count']} run(s)")
+        for call in sorted(data['remote_calls'], key=lambda c: -c['sum']):
+            lines.append(f"  {call['service']} {call['endpoint']}: {call['count']} calls, "
+                         f"{call['sum']:.2f}s total, p95 {call['p95'] or 0:.3f}s, {call['errors']} errors")
+        for service, count in data['retries'].items():
+            lines.append(f"  {service}: {count} retries")
+        for service, pool in data['pools'].items():
+            lines.append(f"  {service} pool: {pool['requests']} requests over {pool['new_connections']} "
+                         f"connections opened, hit rate {pool['hit_rate'] or 0:.0%}")
+        for cache, counts in data['caches'].items():
+            lines.append(f"  {cache} cache: {counts['hits']} hits, {counts['misses']} misses "
+                         f"({counts['hit_rate']:.0%})")
+        for stage, rate in data['throughput'].items():
+            lines.append(f"  {stage}: {rate['items']} items ({rate['per_second']:.1f}/s)")
+        return '\n'.join(lines)
+
+    def export(self, path: str) -> None:
+        """Write the metrics to a .prom (Prometheus text) or JSON file"""
+        with open(path, 'w', encoding='utf-8') as f:
+            if path.endswith('.prom'):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), f, indent=2)
+
+    def start_profiling(self) -> None:
+        """Profile the rest of this run if PIPELINE_PROFILE is set; called from an entry point's main()"""
+        if self.profiler is None:
+            self.profiler = profiling.start_from_env()
+
+    def finish(self) -> None:
+        """Print the run summary and export the metrics (and profile) if enabled"""
+        print(self.summary())
+        if METRICS_FILE:
+            self.export(METRICS_FILE)
+            print(f"📈 Saved metrics to {METRICS_FILE}")
+        if self.profiler:
+            self.profiler.finish()
+
+def endpoint_name(url) -> str:
+    """Collapse a request URL to a low-cardinality endpoint label"""
+    path = urlparse(str(url)).path.rstrip('/')
+    # /rest/v1/messages -> rest/messages, /auth/v1/admin/users -> auth/admin/users
+    parts = [part for part in path.split('/') if part and part not in ('v1',)]
+    return '/'.join(parts[:3]) or '/'
+
+def instrument_http_client(http_client, service: str, registry: Optional['Metrics'] = None) -> None:
+    """Attach event hooks to an httpx.Client recording every request it sends"""
+    registry = registry or metrics
+
+    def on_request(request):
+        request.extensions['pipeline_started'] = time.perf_counter()
+
+    def on_response(response):
+        request = response.request
+        started = request.extensions.get('pipeline_started', time.perf_counter())
+        try:
+            bytes_sent = len(request.content)
+        except Exception:
+            # Streamed request bodies are not buffered, so their size is unknown
+            bytes_sent = 0
+        try:
+            bytes_received = len(response.content)
+        except Exception:
+            # The hook runs before the body is read; reading it here would buffer streamed responses
+            bytes_received = int(response.headers.get('content-length') or 0)
+        registry.record_call(
+            service,
+            f"{request.method} {endpoint_name(request.url)}",
+            time.perf_counter() - started,
+            ok=response.status_code < 400,
+            bytes_sent=bytes_sent,
+            bytes_received=bytes_received,
+        )
+
+    hooks = http_client.event_hooks
+    hooks['request'] = list(hooks.get('request', [])) + [on_request]
+    hooks['response'] = list(hooks.get('response', [])) + [on_response]
+    http_client.event_hooks = hooks
+
+# Shared registry for the current process
+metrics = Metrics()
@@ -0,0 +1,234 @@
+import json
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from resilience import backoff_delay
+
+# Default location of the queue database; every worker process must open the same file
+QUEUE_FILE = os.getenv('JOB_QUEUE_FILE', os.path.join(os.path.dirname(__file__), 'data', 'jobs.sqlite'))
+
+# WAL lets readers and the single writer proceed together, but needs shared
+# memory, so it only works when every worker is on the same host. Set
+# JOB_QUEUE_WAL=0 when workers on several hosts share the file over a
+# filesystem with working POSIX locks.
+USE_WAL = os.getenv('JOB_QUEUE_WAL', '1') != '0'
+
+# Seconds a leased job stays invisible to other workers; holders extend it while they work
+DEFAULT_VISIBILITY_TIMEOUT = 300.0
+
+# Attempts before a job is moved to the dead-letter state
+DEFAULT_MAX_ATTEMPTS = 5
+
+# Backoff between attempts of a failed job
+RETRY_BASE_DELAY = 5.0
+RETRY_MAX_DELAY = 600.0
+
+# Job states: ready -> leased -> done, or back to ready on failure, or dead once out of attempts
+READY, LEASED, DONE, DEAD = 'ready', 'leased', 'done', 'dead'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    queue TEXT NOT NULL,
+    key TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'ready',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_token TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    result TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (queue, key)
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs(queue, status, available_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_leases ON jobs(status, lease_expires);
+"""
+
+def worker_id() -> str:
+    """Identifies a worker process in lease records"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class JobQueue:
+    """Durable work queue in a SQLite file, shared by any number of worker processes
+
+    A worker leases jobs for a visibility timeout. If it finishes, it marks
+    them done; if it fails, they return to the queue after a backoff; if it
+    crashes, the lease expires and another worker picks them up. Each lease
+    carries a token, so a worker whose lease has lapsed can no longer
+    complete or fail a job someone else now holds. Jobs that use up their
+    attempts (including by repeatedly crashing workers) are dead-lettered
+    rather than retried forever.
+
+    Delivery is at-least-once: a job can run again after a crash, so
+    handlers must be idempotent.
+    """
+
+    def __init__(self, path: str = QUEUE_FILE):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit; transactions are opened explicitly with BEGIN IMMEDIATE
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute(f"PRAGMA journal_mode={'WAL' if USE_WAL else 'DELETE'}")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.executescript(SCHEMA)
+
+    def _transaction(self):
+        return _Transaction(self.db)
+
+    def enqueue(self, queue: str, payload: Any, key: Optional[str] = None,
+                max_attempts: int = DEFAULT_MAX_ATTEMPTS, delay: float = 0.0) -> Optional[int]:
+        """Add a job; returns its id, or None if a job with the same key is already queued"""
+        return self.enqueue_many(queue, [(payload, key)], max_attempts, delay)[0]
+
+    def enqueue_many(self, queue: str, jobs: List[tuple], max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                     delay: float = 0.0) -> List[Optional[int]]:
+        """Add (payload, key) jobs in one transaction; keys make enqueueing idempotent"""
+        now = time.time()
+        ids = []
+        with self._transaction():
+            for payload, key in jobs:
+                cursor = self.db.execute(
+                    "INSERT OR IGNORE INTO jobs (queue, key, payload, max_attempts, available_at, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (queue, key, json.dumps(payload), max_attempts, now + delay, now, now))
+                ids.append(cursor.lastrowid if cursor.rowcount else None)
+        return ids
+
+    def lease(self, queue: str, owner: Optional[str] = None, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT,
+              limit: int = 1) -> List[Dict]:
+        """Lease up to limit ready jobs, oldest first, reclaiming any whose lease expired"""
+        now = time.time()
+        owner = owner or worker_id()
+        with self._transaction():
+            self._reclaim_expired(now)
+            rows = self.db.execute(
+                "SELECT id FROM jobs WHERE queue = ? AND status = ? AND available_at <= ? "
+                "ORDER BY available_at, id LIMIT ?", (queue, READY, now, limit)).fetchall()
+            jobs = []
+            for row in rows:
+                token = uuid.uuid4().hex
+                self.db.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_owner = ?, lease_token = ?, "
+                    "lease_expires = ?, updated_at = ? WHERE id = ?",
+                    (LEASED, owner, token, now + visibility_timeout, now, row['id']))
+                jobs.append(self._job(self.db.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone()))
+        return jobs
+
+    def _reclaim_expired(self, now: float) -> None:
+        """Return jobs from crashed or stalled workers to the queue (or the dead letters)"""
+        self.db.execute(
+            "UPDATE jobs SET status = ?, last_error = 'lease expired', updated_at = ? "
+            "WHERE status = ? AND lease_expires <= ? AND attempts >= max_attempts",
+            (DEAD, now, LEASED, now))
+        self.db.execute(
+            "UPDATE jobs SET status = ?, lease_token = NULL, last_error = 'lease expired', updated_at = ? "
+            "WHERE status = ? AND lease_expires <= ?",
+            (READY, now, LEASED, now))
+
+    def heartbeat(self, job: Dict, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT) -> bool:
+        """Extend a lease; False means it was lost and the job must be abandoned"""
+        now = time.time()
+        with self._transaction():
+            cursor = self.db.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND status = ? AND lease_token = ?",
+                (now + visibility_timeout, now, job['id'], LEASED, job['lease_token']))
+        return cursor.rowcount == 1
+
+    def complete(self, job: Dict, result: Any = None) -> bool:
+        """Mark a leased job done; False if the lease was lost to another worker"""
+        now = time.time()
+        with self._transaction():
+            cursor = self.db.execute(
+                "UPDATE jobs SET status = ?, result = ?, lease_token = NULL, updated_at = ? "
+                "WHERE id = ? AND status = ? AND lease_token = ?",
+                (DONE, json.dumps(result), now, job['id'], LEASED, job['lease_token']))
+        return cursor.rowcount == 1
+
+    def fail(self, job: Dict, error: str, retry: bool = True) -> Optional[str]:
+        """Return a job for another attempt after a backoff, or dead-letter it
+
+        Returns the job's new status, or None if the lease was lost.
+        """
+        now = time.time()
+        with self._transaction():
+            row = self.db.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ? AND status = ? "
+                                  "AND lease_token = ?", (job['id'], LEASED, job['lease_token'])).fetchone()
+            if row is None:
+                return None
+            status = READY if retry and row['attempts'] < row['max_attempts'] else DEAD
+            delay = backoff_delay(row['attempts'], RETRY_BASE_DELAY, RETRY_MAX_DELAY) if status == READY else 0
+            self.db.execute(
+                "UPDATE jobs SET status = ?, available_at = ?, lease_token = NULL, last_error = ?, updated_at = ? "
+                "WHERE id = ?", (status, now + delay, error[:2000], now, job['id']))
+        return status
+
+    def stats(self, queue: Optional[str] = None) -> Dict[str, Dict]:
+        """Job counts by status per queue, plus the age of the oldest ready job"""
+        now = time.time()
+        query = "SELECT queue, status, count(*) AS n, min(available_at) AS oldest FROM jobs"
+        params: tuple = ()
+        if queue:
+            query += " WHERE queue = ?"
+            params = (queue,)
+        stats: Dict[str, Dict] = {}
+        for row in self.db.execute(query + " GROUP BY queue, status", params):
+            entry = stats.setdefault(row['queue'], {READY: 0, LEASED: 0, DONE: 0, DEAD: 0, 'oldest_ready_age': None})
+            entry[row['status']] = row['n']
+            if row['status'] == READY:
+                entry['oldest_ready_age'] = max(0.0, now - row['oldest'])
+        return stats
+
+    def dead_letters(self, queue: str, limit: int = 50) -> List[Dict]:
+        rows = self.db.execute("SELECT * FROM jobs WHERE queue = ? AND status = ? ORDER BY updated_at DESC LIMIT ?",
+                               (queue, DEAD, limit)).fetchall()
+        return [self._job(row) for row in rows]
+
+    def requeue_dead(self, queue: str, ids: Optional[List[int]] = None) -> int:
+        """Give dead-lettered jobs a fresh set of attempts"""
+        now = time.time()
+        query = "UPDATE jobs SET status = ?, attempts = 0, available_at = ?, updated_at = ? WHERE queue = ? AND status = ?"
+        params: list = [READY, now, now, queue, DEAD]
+        if ids:
+            query += f" AND id IN ({','.join('?' * len(ids))})"
+            params.extend(ids)
+        with self._transaction():
+            return self.db.execute(query, params).rowcount
+
+    def purge_done(self, older_than: float = 7 * 24 * 3600) -> int:
+        """Delete finished jobs (freeing their keys for re-use)"""
+        with self._transaction():
+            return self.db.execute("DELETE FROM jobs WHERE status = ? AND updated_at < ?",
+                                   (DONE, time.time() - older_than)).rowcount
+
+    @staticmethod
+    def _job(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'])
+        return job
+
+    def close(self) -> None:
+        self.db.close()
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, so the whole lease/complete step holds the write lock"""
+
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
@@ -0,0 +1,61 @@
+import json
+import os
+from typing import Dict, List, Optional
+
+# Where oldstuff/prepare_rag_data.py exports messages: one shard per team, listed in the manifest
+SHARD_DIR = os.path.join(os.path.dirname(__file__), 'data', 'processed_messages')
+MANIFEST_FILE = os.path.join(SHARD_DIR, 'manifest.json')
+
+def channel_key(item: Dict) -> tuple:
+    """Documents are built per channel, so a channel is the unit a delta re-renders"""
+    return (item['source'], item['channel_id'])
+
+def load_manifest(path: str = MANIFEST_FILE) -> Dict:
+    """The export's manifest, or an empty one if nothing has been exported yet"""
+    if not os.path.exists(path):
+        return {'shards': []}
+
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def read_delta(path: str) -> List[Dict]:
+    """Entries of a shard's delta log, oldest first"""
+    if not os.path.exists(path):
+        return []
+
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = f.read().splitlines()
+
+    deltas = []
+    for number, line in enumerate(lines, 1):
+        try:
+            deltas.append(json.loads(line))
+        except ValueError:
+            # A run that died mid-append saved no watermark, so the next run fetches those changes again
+            if number == len(lines):
+                break
+            raise
+    return deltas
+
+def apply_delta_documents(documents: List[Dict], delta: Dict) -> List[Dict]:
+    """Documents with one delta log entry's re-rendered channels swapped in"""
+    channels = {tuple(channel) for channel in delta['channels']}
+    return [d for d in documents if channel_key(d) not in channels] + delta['documents']
+
+def load_shard_documents(shard: Dict, directory: str = SHARD_DIR) -> List[Dict]:
+    """Current documents of one manifest shard: its base file plus its delta log"""
+    with open(os.path.join(directory, shard['file']), 'r', encoding='utf-8') as f:
+        documents = json.load(f)['documents']
+
+    for delta in read_delta(os.path.join(directory, shard['delta'])):
+        documents = apply_delta_documents(documents, delta)
+    return documents
+
+def load_documents(manifest_file: Optional[str] = None) -> List[Dict]:
+    """Every exported message document, across all shards"""
+    manifest_file = manifest_file or MANIFEST_FILE
+    directory = os.path.dirname(manifest_file)
+    documents = []
+    for shard in load_manifest(manifest_file)['shards']:
+        documents.extend(load_shard_documents(shard, directory))
+    return documents
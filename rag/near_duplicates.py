@@ -0,0 +1,184 @@
+import json
+import os
+import re
+import sys
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from message_export import load_documents
+
+# MinHash signature length; BANDS * ROWS_PER_BAND must equal NUM_PERM
+NUM_PERM = 128
+BANDS = 32
+ROWS_PER_BAND = 4
+
+# Character shingle size used to compare texts
+SHINGLE_SIZE = 5
+
+# Estimated Jaccard similarity at or above which two texts are duplicates
+DEFAULT_THRESHOLD = 0.8
+
+# Fixed seed so signatures (and therefore mappings) are reproducible across runs
+SEED = 1
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+_rng = np.random.RandomState(SEED)
+_PERM_A = _rng.randint(1, (1 << 32) - 1, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, (1 << 32) - 1, size=NUM_PERM, dtype=np.uint64)
+
+URL_PATTERN = re.compile(r'https?://\S+')
+
+def normalize_text(text: str) -> str:
+    """Lowercase, drop URLs and collapse whitespace before comparing texts"""
+    text = URL_PATTERN.sub(' ', text.lower())
+    return ' '.join(text.split())
+
+def shingle_hashes(text: str) -> np.ndarray:
+    """32-bit hashes of the character shingles of a normalized text"""
+    if len(text) <= SHINGLE_SIZE:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    return np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles),
+                       dtype=np.uint64, count=len(shingles))
+
+def minhash_signature(text: str) -> np.ndarray:
+    """MinHash signature of a normalized text"""
+    hashes = shingle_hashes(text)
+    # Universal hashing (a * x + b) mod p, one row per permutation
+    permuted = (np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _MERSENNE_PRIME & _MAX_HASH
+    return permuted.min(axis=1)
+
+def estimated_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimate the Jaccard similarity of two texts from their signatures"""
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+class NearDuplicateIndex:
+    """Streaming MinHash/LSH index mapping each text to its first near-duplicate
+
+    Only canonical (first-seen) texts are stored in the LSH buckets, so each
+    new text is compared against a handful of candidates instead of every
+    earlier text, and the work grows roughly linearly with corpus size.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self.signatures: List[np.ndarray] = []
+        self.exact: Dict[str, int] = {}
+        self.buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(BANDS)]
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[i * ROWS_PER_BAND:(i + 1) * ROWS_PER_BAND].tobytes() for i in range(BANDS)]
+
+    def add(self, text: str) -> Tuple[int, bool]:
+        """Add a text; returns (canonical id, whether it is a duplicate)"""
+        normalized = normalize_text(text)
+        if normalized in self.exact:
+            return self.exact[normalized], True
+
+        signature = minhash_signature(normalized)
+        keys = self._band_keys(signature)
+
+        best_id, best_similarity = None, 0.0
+        checked = set()
+        for band, key in enumerate(keys):
+            for candidate in self.buckets[band].get(key, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                similarity = estimated_similarity(signature, self.signatures[candidate])
+                if similarity > best_similarity:
+                    best_id, best_similarity = candidate, similarity
+
+        if best_id is not None and best_similarity >= self.threshold:
+            self.exact[normalized] = best_id
+            return best_id, True
+
+        canonical_id = len(self.signatures)
+        self.signatures.append(signature)
+        self.exact[normalized] = canonical_id
+        for band, key in enumerate(keys):
+            self.buckets[band].setdefault(key, []).append(canonical_id)
+        return canonical_id, False
+
+def deduplicate(texts: List[str], threshold: float = DEFAULT_THRESHOLD) -> Tuple[List[int], List[int]]:
+    """Collapse near-duplicate texts
+
+    Returns (kept, canonical): kept lists the indices of the texts to keep, and
+    canonical maps every input index to the position in kept of its original.
+    """
+    index = NearDuplicateIndex(threshold)
+    kept = []
+    canonical = []
+
+    for i, text in enumerate(texts):
+        canonical_id, _ = index.add(text)
+        if canonical_id == len(kept):
+            kept.append(i)
+        canonical.append(canonical_id)
+
+    return kept, canonical
+
+def load_texts(input_file: str) -> List[str]:
+    """Load texts from any of the corpora this project produces"""
+    with open(input_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    # rag/data/processedtweets.json
+    if 'tweets' in data:
+        return data['tweets']
+
+    # rag/data/processed_messages/manifest.json, or one of its shards
+    if 'shards' in data:
+        return [doc['text'] for doc in load_documents(input_file)]
+    if 'documents' in data:
+        return [doc['text'] for doc in data['documents']]
+    if 'messages' in data:
+        return data['messages']
+
+    # scripts/seed_data/messages.json and direct_messages.json
+    texts = []
+    for thread in data.get('message_threads', []) + data.get('direct_message_threads', []):
+        for message in thread['messages']:
+            texts.append(message['content'])
+            texts.extend(reply['content'] for reply in message.get('replies', []))
+    return texts
+
+def save_deduplicated(input_file: str, texts: List[str], kept: List[int], canonical: List[int],
+                      output_file: Optional[str] = None) -> str:
+    """Write the kept texts plus the mapping from every original back to them"""
+    if output_file is None:
+        root, ext = os.path.splitext(input_file)
+        output_file = f"{root}.dedup{ext}"
+
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            'texts': [texts[i] for i in kept],
+            'canonical': canonical,
+            'metadata': {
+                'source': os.path.basename(input_file),
+                'count': len(texts),
+                'kept': len(kept),
+                'duplicates': len(texts) - len(kept),
+            }
+        }, f, indent=2, ensure_ascii=False)
+
+    return output_file
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python near_duplicates.py <corpus.json> [output.json]")
+        sys.exit(1)
+
+    input_file = sys.argv[1]
+    texts = load_texts(input_file)
+    print(f"Deduplicating {len(texts)} texts from {input_file}")
+
+    kept, canonical = deduplicate(texts)
+    output_file = save_deduplicated(input_file, texts, kept, canonical,
+                                    sys.argv[2] if len(sys.argv) > 2 else None)
+    print(f"Kept {len(kept)} of {len(texts)} texts ({len(texts) - len(kept)} near-duplicates), saved to {output_file}")
@@ -0,0 +1,209 @@
+import multiprocessing
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Worker processes for the normalization stage; defaults to one per core
+DEFAULT_WORKERS = int(os.getenv('NORMALIZE_WORKERS', '0')) or os.cpu_count() or 1
+
+# Texts sent to a worker at a time; inputs smaller than two chunks are handled in-process
+CHUNK_SIZE = 256
+
+# Tokenizer shared by text-embedding-ada-002 and text-embedding-3-*
+TOKEN_ENCODING = 'cl100k_base'
+
+URL_PATTERN = re.compile(r'https?://[^\s<>"\'\)\]]+', re.IGNORECASE)
+MENTION_PATTERN = re.compile(r'(?<![\w@])@(\w{1,50})')
+HASHTAG_PATTERN = re.compile(r'(?<![\w#])#(\w+)')
+WORD_PATTERN = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+# Zero-width and bidi control characters that survive NFKC
+INVISIBLE_PATTERN = re.compile('[\u200b-\u200f\u202a-\u202e\u2060-\u2064\ufeff]')
+
+# Query parameters that only track the click, never change the page (besides utm_*). Short generic
+# names such as s or t are left alone: they are often search terms or timestamps (YouTube's t)
+TRACKING_PARAMS = {'fbclid', 'gclid', 'dclid', 'gbraid', 'wbraid', 'msclkid', 'twclid', 'yclid', 'mc_cid', 'mc_eid',
+                   'igshid', '_hsenc', '_hsmi', 'mkt_tok', 'ref_src', 'ref_url'}
+
+# Common words per language, for the built-in detector
+STOPWORDS = {
+    'en': {'the', 'and', 'is', 'are', 'to', 'of', 'in', 'that', 'it', 'for', 'you', 'with', 'this', 'on', 'was', 'have', 'be', 'not'},
+    'es': {'el', 'la', 'de', 'que', 'y', 'en', 'los', 'se', 'del', 'las', 'por', 'un', 'para', 'con', 'una', 'es', 'no', 'muy'},
+    'fr': {'le', 'la', 'les', 'de', 'et', 'est', 'des', 'un', 'une', 'du', 'que', 'pour', 'dans', 'pas', 'je', 'vous', 'avec', 'sur'},
+    'de': {'der', 'die', 'und', 'das', 'ist', 'nicht', 'ich', 'zu', 'den', 'mit', 'sie', 'es', 'ein', 'eine', 'auf', 'auch', 'für', 'von'},
+    'pt': {'o', 'a', 'de', 'que', 'e', 'do', 'da', 'em', 'um', 'para', 'com', 'não', 'uma', 'os', 'no', 'se', 'na', 'por'},
+    'it': {'il', 'di', 'che', 'e', 'la', 'per', 'un', 'non', 'in', 'sono', 'mi', 'ho', 'lo', 'ma', 'una', 'con', 'del', 'anche'},
+    'nl': {'de', 'het', 'een', 'en', 'van', 'ik', 'te', 'dat', 'die', 'in', 'is', 'niet', 'op', 'zijn', 'met', 'voor', 'je', 'ook'},
+}
+
+# Scripts that identify a language on their own
+SCRIPT_LANGUAGES = [
+    ('\u3040', '\u30ff', 'ja'),
+    ('\uac00', '\ud7af', 'ko'),
+    ('\u4e00', '\u9fff', 'zh'),
+    ('\u0400', '\u04ff', 'ru'),
+    ('\u0600', '\u06ff', 'ar'),
+    ('\u0590', '\u05ff', 'he'),
+    ('\u0900', '\u097f', 'hi'),
+    ('\u0e00', '\u0e7f', 'th'),
+    ('\u0370', '\u03ff', 'el'),
+]
+
+_encoder = None
+_encoder_loaded = False
+
+def get_encoder():
+    """tiktoken encoder if tiktoken is installed, else None (token counts are then estimated)"""
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        try:
+            import tiktoken
+            _encoder = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception:
+            _encoder = None
+        _encoder_loaded = True
+    return _encoder
+
+def count_tokens(text: str) -> int:
+    """Tokens the embedding models will see for a text"""
+    encoder = get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    # cl100k averages about 4 characters per token on English; words bound it from below
+    return max(len(text.split()), (len(text) + 3) // 4) if text else 0
+
+def canonical_url(url: str) -> str:
+    """Lowercase scheme and host, drop default ports, fragments, tracking parameters and trailing slashes"""
+    url = url.rstrip('.,;:!?')
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    host = (parts.hostname or '').lower()
+    if host.startswith('www.'):
+        host = host[4:]
+    if parts.port and not ((parts.scheme == 'http' and parts.port == 80) or (parts.scheme == 'https' and parts.port == 443)):
+        host = f"{host}:{parts.port}"
+    query = urlencode([(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                       if not k.lower().startswith('utm_') and k.lower() not in TRACKING_PARAMS])
+    path = parts.path.rstrip('/') if parts.path not in ('', '/') else ''
+    return urlunsplit((parts.scheme.lower(), host, path, query, ''))
+
+def detect_language(text: str) -> Optional[str]:
+    """ISO 639-1 code of a text's language, or None if there is too little to tell
+
+    Uses langdetect when installed; otherwise a script check plus stopword
+    overlap, which covers the languages this project sees.
+    """
+    letters = [c for c in text if c.isalpha()]
+    if len(letters) < 3:
+        return None
+
+    try:
+        from langdetect import DetectorFactory, detect
+        DetectorFactory.seed = 0
+        return detect(text)
+    except ImportError:
+        pass
+    except Exception:
+        return None
+
+    scripts = Counter()
+    for c in letters:
+        for low, high, language in SCRIPT_LANGUAGES:
+            if low <= c <= high:
+                scripts[language] += 1
+                break
+    if scripts:
+        language, count = scripts.most_common(1)[0]
+        if count >= len(letters) / 2:
+            return language
+
+    words = [w.lower() for w in WORD_PATTERN.findall(text)]
+    if not words:
+        return None
+    scores = {language: sum(w in stopwords for w in words) for language, stopwords in STOPWORDS.items()}
+    language, score = max(scores.items(), key=lambda item: item[1])
+    return language if score else None
+
+def normalize_text(text: str) -> Dict:
+    """Normalized text plus the metadata the chunker and embedder use
+
+    text: NFKC-normalized, invisible characters removed, whitespace collapsed,
+    URLs canonicalized and mentions/hashtags lowercased.
+    """
+    text = INVISIBLE_PATTERN.sub('', unicodedata.normalize('NFKC', text or ''))
+    text = ''.join(c if c in '\n\t' or unicodedata.category(c)[0] != 'C' else ' ' for c in text)
+
+    urls = []
+    def replace_url(match):
+        url = canonical_url(match.group(0))
+        trailing = match.group(0)[len(match.group(0).rstrip('.,;:!?')):]
+        urls.append(url)
+        return url + trailing
+    text = URL_PATTERN.sub(replace_url, text)
+
+    mentions = [m.lower() for m in MENTION_PATTERN.findall(text)]
+    hashtags = [h.lower() for h in HASHTAG_PATTERN.findall(text)]
+    text = MENTION_PATTERN.sub(lambda m: '@' + m.group(1).lower(), text)
+    text = HASHTAG_PATTERN.sub(lambda m: '#' + m.group(1).lower(), text)
+
+    text = '\n'.join(' '.join(line.split()) for line in text.splitlines()).strip()
+    # Language is judged on the prose, not links and handles
+    prose = HASHTAG_PATTERN.sub(' ', MENTION_PATTERN.sub(' ', URL_PATTERN.sub(' ', text)))
+
+    return {
+        'text': text,
+        'urls': list(dict.fromkeys(urls)),
+        'mentions': list(dict.fromkeys(mentions)),
+        'hashtags': list(dict.fromkeys(hashtags)),
+        'language': detect_language(prose),
+        'tokens': count_tokens(text),
+        'chars': len(text),
+    }
+
+def normalize_chunk(texts: List[str]) -> List[Dict]:
+    return [normalize_text(text) for text in texts]
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+def get_pool(workers: int) -> ProcessPoolExecutor:
+    """Shared worker pool, so concurrent callers (e.g. export partitions) don't each start their own
+
+    Workers are spawned rather than forked: callers are often threads, and
+    forking a multithreaded process can copy locks in a held state.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown()
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _pool_workers = workers
+        return _pool
+
+def normalize_many(texts: List[str], workers: Optional[int] = None, chunk_size: int = CHUNK_SIZE) -> List[Dict]:
+    """normalize_text over many texts, in chunks across a process pool; results keep input order"""
+    workers = workers or DEFAULT_WORKERS
+    if workers <= 1 or len(texts) < 2 * chunk_size:
+        return normalize_chunk(texts)
+
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    results = []
+    for chunk_result in get_pool(workers).map(normalize_chunk, chunks):
+        results.extend(chunk_result)
+    return results
+
+def shutdown() -> None:
+    """Stop the worker pool"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
@@ -2,29 +2,42 @@ import json
 import os
 from datetime import datetime
 
-# Create data directory if it doesn't exist
+from instrumentation import metrics
+from normalization import normalize_many
+
 data_dir = os.path.join(os.path.dirname(__file__), 'data')
-if not os.path.exists(data_dir):
-    os.makedirs(data_dir)
-    print(f"Created directory: {data_dir}")
 
-def extract_tweet_texts(input_file):
+def ensure_data_dir():
+    """Create the data directory if it doesn't exist"""
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+        print(f"Created directory: {data_dir}")
+
+def extract_tweet_texts(input_file, workers=None):
     """
-    Extract just the text content from tweets JSON file and save as a JSON array
+    Extract the normalized text of each tweet from the tweets JSON file and save as a JSON array,
+    alongside per-tweet features (urls, mentions, hashtags, language, token count)
+    workers: Processes to normalize with (default NORMALIZE_WORKERS or one per core)
     """
     # Read the JSON file
-    with open(input_file, 'r', encoding='utf-8') as f:
-        tweets = json.load(f)
+    with metrics.stage('load'):
+        with open(input_file, 'r', encoding='utf-8') as f:
+            tweets = json.load(f)
     
-    # Extract just the text from each tweet
-    tweet_texts = [tweet['text'] for tweet in tweets]
+    # Normalize the text of each tweet, dropping any left empty
+    with metrics.stage('normalize'):
+        normalized = [n for n in normalize_many([tweet['text'] for tweet in tweets], workers) if n['text']]
+    metrics.item('tweets', len(normalized))
+    tweet_texts = [n.pop('text') for n in normalized]
     
     # Create output with fixed filename
+    ensure_data_dir()
     output_file = os.path.join(data_dir, "processedtweets.json")
     
     # Save to file as JSON
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump({"tweets": tweet_texts}, f, indent=2, ensure_ascii=False)
+    with metrics.stage('save'):
+        with open(output_file, 'w', encoding='utf-8') as f:
+            json.dump({"tweets": tweet_texts, "features": normalized}, f, indent=2, ensure_ascii=False)
     
     print(f"Extracted {len(tweet_texts)} tweets to {output_file}")
     return output_file
@@ -35,5 +48,7 @@ if __name__ == "__main__":
         print(f"Error: {input_file} not found. Please run fetch_tweets.py first.")
         exit(1)
     
+    metrics.start_profiling()
     print(f"Processing {input_file}")
-    extract_tweet_texts(input_file) 
\ No newline at end of file
+    extract_tweet_texts(input_file)
+    metrics.finish() 
\ No newline at end of file
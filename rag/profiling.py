@@ -0,0 +1,231 @@
+import atexit
+import cProfile
+import json
+import linecache
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from multiprocessing import parent_process
+from typing import Dict, List, Optional
+
+# Directory to write profiles to; setting it profiles entry points that call metrics.start_profiling()
+PROFILE_DIR = os.getenv('PIPELINE_PROFILE')
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = float(os.getenv('PIPELINE_PROFILE_INTERVAL', '0.005'))
+
+# Allocation sites kept for each stage's memory snapshot
+TOP_ALLOCATIONS = 10
+
+# A thread whose innermost Python frame is in one of these modules is waiting on the network...
+NETWORK_MODULES = ('socket', 'ssl', 'selectors', 'select', 'http.client', 'httpcore', 'h11', 'h2', 'httpx',
+                   'urllib3', 'requests', 'psycopg', 'anyio')
+# ...and in one of these, on another thread or process
+WAIT_MODULES = ('threading', 'queue', 'concurrent.futures', 'multiprocessing')
+
+CATEGORIES = ('compute', 'network', 'sleep', 'wait')
+
+NO_STAGE = '(no stage)'
+PROFILER_STAGE = '(profiler)'
+
+def _in_modules(module: str, modules: tuple) -> bool:
+    return any(module == name or module.startswith(name + '.') for name in modules)
+
+class Profiler:
+    """CPU, memory and wall-time profile of one run
+
+    - cProfile of the main thread, saved as .pstats (snakeviz, flameprof,
+      gprof2dot)
+    - a sampler that records every thread's stack each SAMPLE_INTERVAL and
+      saves them as collapsed stacks (.folded) for flamegraph.pl, speedscope
+      or inferno; each stack is rooted at its thread and stage
+    - tracemalloc peaks per metrics.stage, with the top allocation sites
+      whenever a stage sets a new peak
+    - the wall time of each stage split into compute, network, sleep and
+      waiting on other threads, from the sampled stacks
+
+    Peaks are process-wide, so stages running concurrently share them.
+    """
+
+    def __init__(self, directory: str, interval: float = SAMPLE_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.cpu = cProfile.Profile()
+        self.stacks: Counter = Counter()
+        self.split: Dict[str, Counter] = {}
+        self.samples = 0
+        # Thread id -> stack of entered stages
+        self.stages: Dict[int, List[str]] = {}
+        # (code, line) -> whether that line calls sleep
+        self.sleep_lines: Dict[tuple, bool] = {}
+        # Stages being timed, with the highest peak seen while each was open
+        self.open_peaks: List[list] = []
+        self.memory: Dict[str, Dict] = {}
+        self.overall_peak = 0
+        self.started = None
+        self.finished = False
+        self.main_thread = threading.main_thread().ident
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample_loop, name='profiler', daemon=True)
+
+    def start(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self.started = time.perf_counter()
+        tracemalloc.start()
+        self._sampler.start()
+        self.cpu.enable()
+        atexit.register(self.finish)
+
+    def enter(self, stage: str) -> None:
+        ident = threading.get_ident()
+        with self.lock:
+            self.stages.setdefault(ident, []).append(stage)
+            self._carry_peak()
+            self.open_peaks.append([stage, 0])
+
+    def exit(self, stage: str) -> None:
+        ident = threading.get_ident()
+        with self.lock:
+            stack = self.stages.get(ident)
+            if stack and stack[-1] == stage:
+                stack.pop()
+            self._carry_peak()
+            for i in range(len(self.open_peaks) - 1, -1, -1):
+                if self.open_peaks[i][0] == stage:
+                    _, peak = self.open_peaks.pop(i)
+                    break
+            else:
+                return
+            entry = self.memory.setdefault(stage, {'peak_bytes': 0, 'top': []})
+            if peak <= entry['peak_bytes']:
+                return
+            entry['peak_bytes'] = peak
+            # A snapshot is slow, so only stages that set a new peak take one, and its time is shown apart
+            self.stages.setdefault(ident, []).append(PROFILER_STAGE)
+        try:
+            top = tracemalloc.take_snapshot().statistics('lineno')[:TOP_ALLOCATIONS]
+            entry['top'] = [{'site': str(stat.traceback), 'bytes': stat.size, 'blocks': stat.count} for stat in top]
+        finally:
+            with self.lock:
+                self.stages[ident].pop()
+
+    def _carry_peak(self) -> None:
+        """Credit the peak so far to every open stage, then start measuring afresh"""
+        peak = tracemalloc.get_traced_memory()[1]
+        for entry in self.open_peaks:
+            entry[1] = max(entry[1], peak)
+        self.overall_peak = max(self.overall_peak, peak)
+        tracemalloc.reset_peak()
+
+    def _sample_loop(self) -> None:
+        me = threading.get_ident()
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            # Each sample stands for the time since the previous one, which is longer than the interval under load
+            now = time.perf_counter()
+            seconds, last = now - last, now
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            with self.lock:
+                main_stage = (self.stages.get(self.main_thread) or [NO_STAGE])[-1]
+                for ident, frame in frames.items():
+                    if ident == me:
+                        continue
+                    # Pool threads without a stage of their own are working for the main thread's
+                    stage = (self.stages.get(ident) or [main_stage])[-1]
+                    self._record(names.get(ident, str(ident)), stage, frame, seconds)
+                self.samples += 1
+
+    def _in_sleep(self, frame) -> bool:
+        """Whether a thread's innermost Python frame is blocked in time.sleep
+
+        time.sleep is C code, so it has no frame of its own: the thread shows up
+        at its caller, on the line that called it.
+        """
+        key = (frame.f_code, frame.f_lineno)
+        if key not in self.sleep_lines:
+            self.sleep_lines[key] = 'sleep(' in linecache.getline(frame.f_code.co_filename, frame.f_lineno or 0)
+        return self.sleep_lines[key]
+
+    def _record(self, thread: str, stage: str, frame, seconds: float) -> None:
+        sleeping = self._in_sleep(frame)
+        labels = []
+        leaf_module = None
+        while frame is not None:
+            module = frame.f_globals.get('__name__', '?')
+            leaf_module = leaf_module or module
+            labels.append(f"{module}.{getattr(frame.f_code, 'co_qualname', frame.f_code.co_name)}")
+            frame = frame.f_back
+        # Pool workers are numbered; dropping the number merges their stacks
+        thread = thread.rsplit('_', 1)[0] if thread.startswith('ThreadPoolExecutor') else thread
+        self.stacks[';'.join([thread, f"stage:{stage}"] + labels[::-1])] += 1
+
+        if sleeping:
+            category = 'sleep'
+        elif _in_modules(leaf_module or '', NETWORK_MODULES):
+            category = 'network'
+        elif _in_modules(leaf_module or '', WAIT_MODULES):
+            category = 'wait'
+        else:
+            category = 'compute'
+        self.split.setdefault(stage, Counter())[category] += seconds
+
+    def report(self) -> Dict:
+        elapsed = time.perf_counter() - self.started
+        with self.lock:
+            split = {stage: {category: round(counts[category], 3) for category in CATEGORIES}
+                     for stage, counts in sorted(self.split.items())}
+            self._carry_peak()
+            memory = {stage: dict(entry) for stage, entry in self.memory.items()}
+        return {
+            'script': os.path.basename(sys.argv[0]),
+            'argv': sys.argv[1:],
+            'elapsed_seconds': round(elapsed, 3),
+            'sample_interval': self.interval,
+            'samples': self.samples,
+            # Thread-seconds, so a stage running on several threads can exceed its wall time
+            'time_split_seconds': split,
+            'peak_memory_bytes': self.overall_peak,
+            'stages_memory': memory,
+        }
+
+    def finish(self) -> Optional[str]:
+        """Stop profiling and write the profile files; returns their common path prefix"""
+        if self.finished or self.started is None:
+            return None
+        self.finished = True
+        self.cpu.disable()
+        self._stop.set()
+        self._sampler.join()
+
+        script = os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'python'
+        prefix = os.path.join(self.directory, f"{script}-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}")
+        self.cpu.dump_stats(prefix + '.pstats')
+        with open(prefix + '.folded', 'w', encoding='utf-8') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f"{stack} {count}\n")
+        report = self.report()
+        tracemalloc.stop()
+        with open(prefix + '.json', 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+        print(f"🔬 Profile: {report['samples']} samples, peak memory {report['peak_memory_bytes'] / 2**20:.1f} MB")
+        for stage, split in report['time_split_seconds'].items():
+            parts = ', '.join(f"{category} {seconds:.2f}s" for category, seconds in split.items() if seconds)
+            peak = report['stages_memory'].get(stage, {}).get('peak_bytes')
+            print(f"  {stage}: {parts}" + (f", peak {peak / 2**20:.1f} MB" if peak else ""))
+        print(f"  Wrote {prefix}.pstats, .folded (flamegraph) and .json")
+        return prefix
+
+def start_from_env() -> Optional[Profiler]:
+    """Profiler for this run if PIPELINE_PROFILE is set (worker processes are not profiled)"""
+    if not PROFILE_DIR or parent_process() is not None:
+        return None
+    profiler = Profiler(PROFILE_DIR)
+    profiler.start()
+    return profiler
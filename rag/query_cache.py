@@ -0,0 +1,232 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from instrumentation import metrics
+
+# On-disk cache shared by every process on this machine; set QUERY_CACHE_DISK=0 to keep it in memory only
+CACHE_FILE = os.getenv('QUERY_CACHE_FILE', os.path.join(os.path.dirname(__file__), 'data', 'query_cache.sqlite'))
+DISK_ENABLED = os.getenv('QUERY_CACHE_DISK', '1') not in ('0', 'false')
+
+# In-memory entries kept per cache before the least recently used is evicted
+MAX_ENTRIES = 1024
+
+# Embeddings of a given text never change for a model; results go stale as teams add messages
+EMBEDDING_TTL = 30 * 24 * 3600  # seconds
+RESULTS_TTL = 10 * 60  # seconds
+
+# Generation bumped by invalidate_all and added to every team's own
+ALL_TEAMS = '*'
+
+def normalize_query(text: str) -> str:
+    """Case- and whitespace-insensitive form of a question, used as the cache key"""
+    return ' '.join(text.casefold().split())
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache whose entries expire after a TTL"""
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries: 'OrderedDict[Tuple, Tuple[float, Any]]' = OrderedDict()
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: Tuple, value: Any, ttl: float) -> None:
+        with self.lock:
+            self.entries[key] = (time.time() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def discard(self, predicate: Callable[[Tuple], bool]) -> None:
+        with self.lock:
+            for key in [k for k in self.entries if predicate(k)]:
+                del self.entries[key]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+class DiskCache:
+    """SQLite-backed second tier, so repeated questions survive restarts
+
+    Team generations live here too, so an invalidation written by one process
+    is seen by every other process on its next lookup.
+    """
+
+    def __init__(self, path: str = CACHE_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS embeddings (
+            model TEXT, text TEXT, vector BLOB, expires_at REAL, PRIMARY KEY (model, text))''')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS results (
+            model TEXT, team TEXT, text TEXT, k INTEGER, generation INTEGER, value TEXT, expires_at REAL,
+            PRIMARY KEY (model, team, text, k))''')
+        self.db.execute('CREATE TABLE IF NOT EXISTS generations (team TEXT PRIMARY KEY, generation INTEGER)')
+        self.db.commit()
+
+    def get_embedding(self, model: str, text: str) -> Optional[List[float]]:
+        with self.lock:
+            row = self.db.execute('SELECT vector, expires_at FROM embeddings WHERE model = ? AND text = ?',
+                                  (model, text)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return np.frombuffer(row[0], dtype=np.float32).tolist()
+
+    def put_embedding(self, model: str, text: str, vector: List[float], ttl: float) -> None:
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)',
+                            (model, text, np.asarray(vector, dtype=np.float32).tobytes(), time.time() + ttl))
+            self.db.commit()
+
+    def get_results(self, model: str, team: str, text: str, k: int, generation: int) -> Optional[Any]:
+        with self.lock:
+            row = self.db.execute(
+                'SELECT value, expires_at, generation FROM results WHERE model = ? AND team = ? AND text = ? AND k = ?',
+                (model, team, text, k)).fetchone()
+        if row is None or row[1] <= time.time() or row[2] != generation:
+            return None
+        return json.loads(row[0])
+
+    def put_results(self, model: str, team: str, text: str, k: int, generation: int, value: Any, ttl: float) -> None:
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (model, team, text, k, generation, json.dumps(value), time.time() + ttl))
+            self.db.commit()
+
+    def generation(self, team: str) -> int:
+        with self.lock:
+            row = self.db.execute('SELECT generation FROM generations WHERE team = ?', (team,)).fetchone()
+        return row[0] if row else 0
+
+    def bump_generation(self, team: str) -> int:
+        with self.lock:
+            self.db.execute('''INSERT INTO generations VALUES (?, 1)
+                ON CONFLICT(team) DO UPDATE SET generation = generation + 1''', (team,))
+            if team == ALL_TEAMS:
+                self.db.execute('DELETE FROM results')
+            else:
+                self.db.execute('DELETE FROM results WHERE team = ?', (team,))
+            self.db.commit()
+            return self.db.execute('SELECT generation FROM generations WHERE team = ?', (team,)).fetchone()[0]
+
+    def purge_expired(self) -> None:
+        with self.lock:
+            now = time.time()
+            self.db.execute('DELETE FROM embeddings WHERE expires_at <= ?', (now,))
+            self.db.execute('DELETE FROM results WHERE expires_at <= ?', (now,))
+            self.db.commit()
+
+class QueryCache:
+    """Two-tier cache for query embeddings and top-k results
+
+    Embeddings are keyed by (model, normalized text). Results are keyed by
+    (model, team, normalized text, k) plus the team's generation, which
+    invalidate_team bumps whenever new embeddings are written for that team,
+    so stale results are never served even from another process's disk tier.
+    """
+
+    def __init__(self, disk: bool = DISK_ENABLED, path: str = CACHE_FILE, max_entries: int = MAX_ENTRIES):
+        self.embedding_cache = LRUCache(max_entries)
+        self.result_cache = LRUCache(max_entries)
+        self.disk = DiskCache(path) if disk else None
+        if self.disk is not None:
+            self.disk.purge_expired()
+        self.generations: Dict[str, int] = {}
+
+    def _generation(self, team: str) -> int:
+        if self.disk is not None:
+            return self.disk.generation(team) + self.disk.generation(ALL_TEAMS)
+        return self.generations.get(team, 0) + self.generations.get(ALL_TEAMS, 0)
+
+    def embedding(self, text: str, model: str, embed: Callable[[str], List[float]]) -> List[float]:
+        """Embedding for a query, calling embed(text) only on a miss"""
+        normalized = normalize_query(text)
+        key = (model, normalized)
+        vector = self.embedding_cache.get(key)
+        if vector is None and self.disk is not None:
+            vector = self.disk.get_embedding(model, normalized)
+            if vector is not None:
+                self.embedding_cache.put(key, vector, EMBEDDING_TTL)
+        if vector is not None:
+            metrics.record_cache('query_embeddings', hit=True)
+            return vector
+
+        metrics.record_cache('query_embeddings', hit=False)
+        vector = embed(text)
+        self.embedding_cache.put(key, vector, EMBEDDING_TTL)
+        if self.disk is not None:
+            self.disk.put_embedding(model, normalized, vector, EMBEDDING_TTL)
+        return vector
+
+    def results(self, text: str, model: str, team: str, k: int, search: Callable[[], Any]) -> Any:
+        """Top-k results for a query within a team, calling search() only on a miss"""
+        normalized = normalize_query(text)
+        generation = self._generation(team)
+        key = (model, team, normalized, k, generation)
+        value = self.result_cache.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get_results(model, team, normalized, k, generation)
+            if value is not None:
+                self.result_cache.put(key, value, RESULTS_TTL)
+        if value is not None:
+            metrics.record_cache('query_results', hit=True)
+            return value
+
+        metrics.record_cache('query_results', hit=False)
+        value = search()
+        self.result_cache.put(key, value, RESULTS_TTL)
+        if self.disk is not None:
+            self.disk.put_results(model, team, normalized, k, generation, value, RESULTS_TTL)
+        return value
+
+    def invalidate_team(self, team: str) -> None:
+        """Forget cached results for a team after its embeddings change"""
+        if self.disk is not None:
+            self.disk.bump_generation(team)
+        else:
+            self.generations[team] = self.generations.get(team, 0) + 1
+        self.result_cache.discard(lambda key: key[1] == team)
+
+    def invalidate_all(self) -> None:
+        """Forget cached results for every team, after writes that are not scoped to one"""
+        self.invalidate_team(ALL_TEAMS)
+        self.result_cache.clear()
+
+_cache: Optional[QueryCache] = None
+_cache_lock = threading.Lock()
+
+def get_query_cache() -> QueryCache:
+    """Process-wide query cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = QueryCache()
+        return _cache
+
+def invalidate_team(team_id: str) -> None:
+    """Invalidate cached results for a team; call after writing its embeddings"""
+    get_query_cache().invalidate_team(str(team_id))
+
+def invalidate_all() -> None:
+    """Invalidate cached results for every team; call after a model cutover or a corpus-wide write"""
+    get_query_cache().invalidate_all()
@@ -0,0 +1,253 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from clients import get_supabase
+from embedding_backends import embed, is_local
+from instrumentation import metrics
+from query_cache import invalidate_all
+from resilience import call_with_retries
+
+STATE_FILE = os.path.join(os.path.dirname(__file__), 'data', 'reindex_state.json')
+
+# Tables whose vectors are tagged and re-indexed (see migrations/006_embedding_models.sql)
+TABLES = ('message_embeddings', 'direct_message_embeddings', 'tweets')
+
+# Texts embedded per OpenAI request and written per RPC call
+DEFAULT_BATCH_SIZE = 100
+
+# Rows re-embedded per second, to stay clear of API rate limits and database load
+DEFAULT_RATE = 50.0
+
+class Throttle:
+    """Spaces out work so it never runs faster than a given rate"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def wait(self, count: int = 1) -> None:
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(self.next_time, now) + count / self.rate
+        if delay > 0:
+            time.sleep(delay)
+
+def content_md5(text: str) -> str:
+    """md5 of a row's content, matching Postgres md5(content)"""
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+def get_models(table: str) -> Dict:
+    """Active model of a table, plus the target model while a re-index is running"""
+    rows = call_with_retries(get_supabase().table('embedding_models').select('*')
+                             .eq('table_name', table).execute, 'supabase').data
+    if not rows:
+        raise ValueError(f"{table} has no embedding model; apply migrations/006_embedding_models.sql")
+    return rows[0]
+
+def current_model(table: str, default: str) -> str:
+    """Model that produced the vectors currently served from a table
+
+    Falls back to default when the model registry is not available, e.g.
+    before the migration has been applied.
+    """
+    try:
+        return get_models(table)['model']
+    except Exception as e:
+        print(f"⚠️  Could not read the embedding model for {table} ({e}); assuming {default}")
+        return default
+
+def embed_texts(texts: List[str], model: str) -> List[List[float]]:
+    """Embed several texts in one request (or one local batch; see embedding_backends.py)"""
+    with metrics.stage('embed'):
+        return embed(texts, model)
+
+def embedding_fields(models: Dict, text: str,
+                     embed: Callable[[str, str], List[float]]) -> Dict:
+    """Columns for a newly written row: its tagged vector, plus the shadow vector during a re-index
+
+    Writing both (dual-write) means rows created mid-migration never have to
+    be picked up again by the re-index.
+    """
+    fields = {
+        'embedding': embed(text, models['model']),
+        'embedding_model': models['model'],
+        'embedding_version': models['version'],
+    }
+    if models.get('target_model'):
+        fields.update({
+            'embedding_next': embed(text, models['target_model']),
+            'embedding_next_model': models['target_model'],
+            'embedding_next_version': models['target_version'],
+        })
+    return fields
+
+def load_state() -> Dict:
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_state(state: Dict) -> None:
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    tmp_file = f"{STATE_FILE}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_file, STATE_FILE)
+
+def pending_query(table: str, models: Dict, columns: str = 'id, content', count: Optional[str] = None):
+    """Rows whose shadow vector is missing or from another model or version"""
+    return get_supabase('service').table(table).select(columns, count=count).or_(
+        'embedding_next.is.null,'
+        f'embedding_next_model.neq."{models["target_model"]}",'
+        f'embedding_next_version.neq.{models["target_version"]}'
+    )
+
+def count_pending(table: str, models: Dict) -> int:
+    return call_with_retries(pending_query(table, models, 'id', count='exact').limit(1).execute, 'supabase').count
+
+def run_reindex(table: str, batch_size: int = DEFAULT_BATCH_SIZE, rate: float = DEFAULT_RATE,
+                max_batches: Optional[int] = None) -> bool:
+    """Re-embed pending rows into the shadow column; returns True once none are left
+
+    Progress is checkpointed after every batch, so an interrupted run resumes
+    where it stopped. Rows that change behind the cursor are caught by a
+    further pass, which repeats until a full pass finds nothing to do.
+    """
+    models = get_models(table)
+    target = models.get('target_model')
+    if not target:
+        print(f"No re-index in progress for {table}; run 'start' first")
+        return False
+
+    state = load_state()
+    progress = state.get(table)
+    if not progress or (progress['target_model'], progress['target_version']) != (target, models['target_version']):
+        progress = {'target_model': target, 'target_version': models['target_version'],
+                    'cursor': None, 'pass': 1, 'pass_rows': 0, 'embedded': 0}
+    state[table] = progress
+
+    print(f"🔁 Re-indexing {table} into {target} v{models['target_version']} "
+          f"(pass {progress['pass']}, {count_pending(table, models)} rows pending)")
+    # Local models have no rate limit to respect
+    throttle = Throttle(0 if is_local(target) else rate)
+    batches = 0
+
+    while max_batches is None or batches < max_batches:
+        query = pending_query(table, models)
+        if progress['cursor'] is not None:
+            query = query.gt('id', progress['cursor'])
+        with metrics.stage('fetch'):
+            rows = call_with_retries(query.order('id').limit(batch_size).execute, 'supabase').data
+
+        if not rows:
+            if progress['pass_rows'] == 0:
+                save_state(state)
+                print(f"✅ {table} fully re-indexed ({progress['embedded']} rows embedded)")
+                return True
+            # Sweep again for rows that changed behind the cursor
+            progress.update({'cursor': None, 'pass': progress['pass'] + 1, 'pass_rows': 0})
+            save_state(state)
+            continue
+
+        throttle.wait(len(rows))
+        vectors = embed_texts([row['content'] for row in rows], target)
+        with metrics.stage('write'):
+            written = call_with_retries(get_supabase('service').rpc('write_shadow_embeddings', {
+                'p_table': table,
+                'p_rows': [{'id': str(row['id']), 'content_md5': content_md5(row['content']), 'embedding': vector}
+                           for row, vector in zip(rows, vectors)],
+            }).execute, 'supabase').data
+
+        progress['cursor'] = rows[-1]['id']
+        progress['pass_rows'] += len(rows)
+        progress['embedded'] += written or 0
+        save_state(state)
+        metrics.item('reindex', len(rows))
+        batches += 1
+        print(f"  batch {batches}: {written}/{len(rows)} rows written (cursor {progress['cursor']})")
+
+    return False
+
+def status(table: str) -> None:
+    models = get_models(table)
+    print(f"{table}: serving {models['model']} v{models['version']}")
+    if models.get('target_model'):
+        print(f"  re-indexing into {models['target_model']} v{models['target_version']} "
+              f"since {models['started_at']}, {count_pending(table, models)} rows pending")
+    progress = load_state().get(table)
+    if progress:
+        print(f"  local checkpoint: pass {progress['pass']}, cursor {progress['cursor']}, "
+              f"{progress['embedded']} rows embedded")
+
+def rpc(name: str, params: Dict):
+    return call_with_retries(get_supabase('service').rpc(name, params).execute, 'supabase', idempotent=False).data
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-embed a table with a new model and cut over without downtime")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    start = commands.add_parser('start', help="Begin re-indexing a table with a new model")
+    start.add_argument('table', choices=TABLES)
+    start.add_argument('model', help="Target embedding model, e.g. text-embedding-3-small or local:BAAI/bge-small-en-v1.5")
+    start.add_argument('--version', type=int, default=1, help="Version tag for the target vectors")
+
+    run = commands.add_parser('run', help="Re-embed pending rows into the shadow column (resumable)")
+    run.add_argument('table', choices=TABLES)
+    run.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    run.add_argument('--rate', type=float, default=DEFAULT_RATE, help="Maximum rows per second (0 for unthrottled)")
+    run.add_argument('--max-batches', type=int, help="Stop after this many batches")
+
+    index = commands.add_parser('index', help="Build the vector index on the shadow column")
+    index.add_argument('table', choices=TABLES)
+    index.add_argument('--lists', type=int, default=100, help="ivfflat lists for the new index")
+
+    for name, help_text in (('status', "Show the active model and re-index progress"),
+                            ('cutover', "Atomically switch the table to the re-indexed vectors"),
+                            ('abort', "Abandon the re-index and clear the shadow column")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument('table', choices=TABLES)
+
+    args = parser.parse_args()
+    metrics.start_profiling()
+
+    if args.command == 'start':
+        models = rpc('start_embedding_reindex', {'p_table': args.table, 'p_model': args.model,
+                                                 'p_version': args.version})
+        print(f"🚀 {args.table} will be re-indexed from {models['model']} into {args.model} v{args.version}")
+    elif args.command == 'run':
+        if not run_reindex(args.table, args.batch_size, args.rate, args.max_batches):
+            metrics.finish()
+            sys.exit(1)
+    elif args.command == 'index':
+        with metrics.stage('index'):
+            rpc('build_shadow_embedding_index', {'p_table': args.table, 'p_lists': args.lists})
+        print(f"📇 Built shadow index for {args.table}")
+    elif args.command == 'status':
+        status(args.table)
+    elif args.command == 'cutover':
+        models = rpc('cutover_embedding_model', {'p_table': args.table})
+        # Results cached under the old model's vectors must not be served after the switch
+        invalidate_all()
+        state = load_state()
+        state.pop(args.table, None)
+        save_state(state)
+        print(f"✅ {args.table} now serves {models['model']} v{models['version']}; "
+              f"query embeddings must use the same model")
+    elif args.command == 'abort':
+        rpc('abort_embedding_reindex', {'p_table': args.table})
+        print(f"🛑 Re-index of {args.table} aborted")
+
+    metrics.finish()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import email.utils
+import random
+import threading
+import time
+from functools import wraps
+from typing import Any, Callable, Dict, Optional
+
+from instrumentation import metrics
+from transport import last_response
+
+# Retry schedule: exponential backoff with full jitter, capped per attempt
+MAX_ATTEMPTS = 5
+BASE_DELAY = 0.5  # seconds
+MAX_DELAY = 30.0  # seconds
+
+# Circuit breaker: open after this many consecutive failures, probe again after the cooldown
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30.0  # seconds
+
+# Statuses that mean the request was rejected without being processed
+REJECTED_STATUSES = {429, 503}
+# Statuses worth retrying when repeating the request is harmless
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# Transport errors raised before the request reached the server
+CONNECT_ERRORS = {'ConnectError', 'ConnectTimeout', 'PoolTimeout'}
+# Transport errors where the server may or may not have processed the request
+AMBIGUOUS_ERRORS = {
+    'ReadError', 'ReadTimeout', 'WriteError', 'WriteTimeout', 'RemoteProtocolError',
+    'NetworkError', 'TimeoutException', 'APIConnectionError', 'APITimeoutError',
+}
+
+# Postgres unique_violation: an earlier attempt of an idempotent insert already landed
+UNIQUE_VIOLATION = '23505'
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose circuit breaker is open"""
+
+class CircuitBreaker:
+    """Stops calling a failing backend until a cooldown has passed
+
+    closed: calls go through. open: calls fail fast with CircuitOpenError.
+    half-open: after RESET_TIMEOUT one probe call is let through; success
+    closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, service: str, failure_threshold: int = FAILURE_THRESHOLD,
+                 reset_timeout: float = RESET_TIMEOUT):
+        self.service = service
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self) -> None:
+        with self.lock:
+            state = self.state
+            if state == 'open' or (state == 'half-open' and self.probing):
+                raise CircuitOpenError(f"{self.service} circuit is open after {self.failures} failures")
+            if state == 'half-open':
+                self.probing = True
+
+    def record_success(self) -> None:
+        with self.lock:
+            if self.opened_at is not None:
+                print(f"🟢 {self.service} circuit closed")
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print(f"🔴 {self.service} circuit opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(service: str) -> CircuitBreaker:
+    """Shared circuit breaker for a service"""
+    with _breakers_lock:
+        if service not in _breakers:
+            _breakers[service] = CircuitBreaker(service)
+        return _breakers[service]
+
+def error_status(exc: Exception) -> Optional[int]:
+    """HTTP status behind an exception from httpx, the OpenAI SDK or postgrest"""
+    for candidate in (getattr(exc, 'status_code', None),
+                      getattr(getattr(exc, 'response', None), 'status_code', None),
+                      getattr(exc, 'code', None)):
+        if isinstance(candidate, int):
+            return candidate
+    # postgrest drops the status from JSON error bodies; use the response this thread just saw
+    if type(exc).__name__ == 'APIError':
+        response = last_response()
+        if response is not None and response[0] >= 400:
+            return response[0]
+    return None
+
+def retry_after(exc: Exception) -> Optional[float]:
+    """Seconds the server asked us to wait, from a Retry-After header"""
+    headers = getattr(getattr(exc, 'response', None), 'headers', None)
+    if headers is None:
+        response = last_response()
+        headers = response[1] if response is not None else None
+    value = headers.get('retry-after') if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(value)
+        return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+def is_retryable(exc: Exception, idempotent: bool) -> bool:
+    """Whether a failed call may be repeated
+
+    Non-idempotent calls are only retried when the request provably never
+    reached the server (connect errors) or was explicitly rejected (429/503).
+    """
+    if isinstance(exc, CircuitOpenError):
+        return False
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    if names & CONNECT_ERRORS:
+        return True
+    if names & AMBIGUOUS_ERRORS:
+        return idempotent
+    status = error_status(exc)
+    if status in REJECTED_STATUSES:
+        return True
+    return idempotent and status in RETRYABLE_STATUSES
+
+def is_backend_failure(exc: Exception) -> bool:
+    """Whether an error says the backend itself is unhealthy (as opposed to a bad request)"""
+    names = {cls.__name__ for cls in type(exc).__mro__}
+    if names & (CONNECT_ERRORS | AMBIGUOUS_ERRORS):
+        return True
+    status = error_status(exc)
+    return status is not None and (status >= 500 or status == 429)
+
+def backoff_delay(attempt: int, base_delay: float = BASE_DELAY, max_delay: float = MAX_DELAY) -> float:
+    """Exponential backoff with full jitter for the given (1-based) attempt"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
+
+def call_with_retries(operation: Callable[[], Any], service: str, idempotent: bool = True,
+                      max_attempts: int = MAX_ATTEMPTS) -> Any:
+    """Run a remote call under the service's circuit breaker, retrying transient failures
+
+    For idempotent inserts (rows with client-generated keys), a unique
+    violation on a retry means an earlier attempt succeeded, so it is treated
+    as success and None is returned.
+    """
+    breaker = get_breaker(service)
+
+    for attempt in range(1, max_attempts + 1):
+        breaker.before_call()
+        try:
+            result = operation()
+        except Exception as e:
+            if attempt > 1 and idempotent and getattr(e, 'code', None) == UNIQUE_VIOLATION:
+                breaker.record_success()
+                return None
+
+            if is_backend_failure(e):
+                breaker.record_failure()
+            else:
+                # The backend answered; the request itself was at fault
+                breaker.record_success()
+            if not is_retryable(e, idempotent) or attempt == max_attempts:
+                raise
+
+            delay = retry_after(e)
+            delay = min(delay, MAX_DELAY) if delay is not None else backoff_delay(attempt)
+            print(f"{service} call failed ({type(e).__name__}), retrying in {delay:.1f}s... "
+                  f"({attempt}/{max_attempts - 1})")
+            metrics.retry(service)
+            time.sleep(delay)
+        else:
+            breaker.record_success()
+            return result
+
+def with_retries(service: str, idempotent: bool = True, max_attempts: int = MAX_ATTEMPTS):
+    """Decorator form of call_with_retries"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return call_with_retries(lambda: func(*args, **kwargs), service, idempotent, max_attempts)
+        return wrapper
+    return decorator
@@ -0,0 +1,108 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+SCHEMA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'schema')
+FOREIGN_KEYS_FILE = os.path.join(SCHEMA_DIR, 'foreignkeys.json')
+SCHEMA_FILE = os.path.join(SCHEMA_DIR, 'schema.json')
+
+# Tables run concurrently within a wave
+DEFAULT_WORKERS = 4
+
+@lru_cache(maxsize=None)
+def load_foreign_keys() -> tuple:
+    """Foreign keys from schema/foreignkeys.json as (table, column, foreign table, foreign column)"""
+    with open(FOREIGN_KEYS_FILE, 'r', encoding='utf-8') as f:
+        return tuple((fk['table_name'], fk['column_name'], fk['foreign_table_name'], fk['foreign_column_name'])
+                     for fk in json.load(f))
+
+@lru_cache(maxsize=None)
+def schema_tables() -> frozenset:
+    """Public tables described by schema/schema.json; anything else (auth.users) is outside the plan"""
+    with open(SCHEMA_FILE, 'r', encoding='utf-8') as f:
+        return frozenset(table['table_name'] for table in json.load(f))
+
+def foreign_keys(table: str, extra: Iterable[tuple] = ()) -> Dict[str, str]:
+    """Column -> referenced table for one table, including references to auth 'users'"""
+    return {column: foreign for name, column, foreign, _ in list(load_foreign_keys()) + list(extra) if name == table}
+
+def self_references(table: str, extra: Iterable[tuple] = ()) -> List[str]:
+    """Columns of a table that point at its own rows (e.g. messages.parent_id)"""
+    return [column for column, foreign in foreign_keys(table, extra).items() if foreign == table]
+
+def dependencies(tables: Iterable[str], extra: Iterable[tuple] = ()) -> Dict[str, Set[str]]:
+    """Table -> the tables among the given ones it references
+
+    extra adds (table, column, foreign table, foreign column) keys for tables
+    the schema files do not describe, such as the embedding tables.
+    """
+    tables = set(tables)
+    unknown = tables - schema_tables() - {name for name, _, _, _ in extra}
+    if unknown:
+        raise ValueError(f"Tables not in {SCHEMA_FILE}: {', '.join(sorted(unknown))}")
+    graph: Dict[str, Set[str]] = {table: set() for table in tables}
+    for name, _, foreign, _ in list(load_foreign_keys()) + list(extra):
+        # Self-references are ordered within the table, not between tables
+        if name in tables and foreign in tables and foreign != name:
+            graph[name].add(foreign)
+    return graph
+
+def _waves(graph: Dict[str, Set[str]]) -> List[List[str]]:
+    """Kahn's algorithm in rounds: each wave holds every table whose prerequisites are all in earlier waves"""
+    remaining = {table: set(prerequisites) for table, prerequisites in graph.items()}
+    waves = []
+    while remaining:
+        wave = sorted(table for table, prerequisites in remaining.items() if not prerequisites)
+        if not wave:
+            raise ValueError(f"Foreign key cycle among {', '.join(sorted(remaining))}")
+        for table in wave:
+            del remaining[table]
+        for prerequisites in remaining.values():
+            prerequisites.difference_update(wave)
+        waves.append(wave)
+    return waves
+
+def insert_waves(tables: Iterable[str], extra: Iterable[tuple] = ()) -> List[List[str]]:
+    """Tables grouped so each wave only references tables loaded in earlier waves"""
+    return _waves(dependencies(tables, extra))
+
+def delete_waves(tables: Iterable[str], extra: Iterable[tuple] = ()) -> List[List[str]]:
+    """Tables grouped so each wave is only referenced by tables emptied in earlier waves"""
+    graph = dependencies(tables, extra)
+    referenced_by: Dict[str, Set[str]] = {table: set() for table in graph}
+    for table, prerequisites in graph.items():
+        for foreign in prerequisites:
+            referenced_by[foreign].add(table)
+    return _waves(referenced_by)
+
+def run_waves(waves: List[List[str]], action: Callable[[str], object],
+              workers: int = DEFAULT_WORKERS) -> Dict[str, object]:
+    """Run action on every table, one wave after another, tables of a wave in parallel
+
+    A wave always finishes before the next starts; if any table in it failed,
+    the first error is raised and later waves do not run.
+    """
+    results: Dict[str, object] = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for wave in waves:
+            futures = {table: executor.submit(action, table) for table in wave}
+            error: Optional[BaseException] = None
+            for table, future in futures.items():
+                try:
+                    results[table] = future.result()
+                except Exception as e:
+                    error = error or e
+            if error:
+                raise error
+    return results
+
+if __name__ == "__main__":
+    tables = sorted(schema_tables())
+    print("Insert waves:")
+    for i, wave in enumerate(insert_waves(tables), 1):
+        print(f"  {i}: {', '.join(wave)}")
+    print("Delete waves:")
+    for i, wave in enumerate(delete_waves(tables), 1):
+        print(f"  {i}: {', '.join(wave)}")
@@ -0,0 +1,311 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from clients import get_supabase
+from corpus import Corpus, append, create_corpus
+from instrumentation import metrics
+from query_cache import invalidate_team
+from resilience import call_with_retries
+
+INDEX_DIR = os.path.join(os.path.dirname(__file__), 'data', 'team_index')
+ROUTING_FILE = os.path.join(INDEX_DIR, 'routing.json')
+
+SOURCE_TABLE = 'message_embeddings'
+EMBEDDING_DIM = 1536
+PAGE_SIZE = 1000
+
+# Teams with fewer vectors than this share pooled shards instead of getting their own
+POOL_LIMIT = 2000
+# Vectors per pooled shard
+POOL_SHARD_SIZE = 50000
+# Dedicated shards with at least this many vectors get an IVF index instead of an exact scan
+IVF_LIMIT = 20000
+# IVF lists scanned per query
+DEFAULT_PROBES = 8
+
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 50000
+SEED = 1
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def ivf_lists(count: int) -> int:
+    """Number of IVF lists for a shard: about sqrt(n), as pgvector recommends for ivfflat"""
+    return int(min(1024, max(16, round(count ** 0.5))))
+
+def train_centroids(vectors: np.ndarray, lists: int) -> np.ndarray:
+    """Spherical k-means centroids for a shard's (normalized) vectors"""
+    rng = np.random.RandomState(SEED)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), KMEANS_SAMPLE), replace=False)]
+    centroids = sample[rng.choice(len(sample), lists, replace=False)]
+    for _ in range(KMEANS_ITERATIONS):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for i in range(lists):
+            members = sample[assignment == i]
+            if len(members):
+                centroids[i] = members.mean(axis=0)
+        centroids = normalize(centroids)
+    return centroids.astype(np.float32)
+
+def load_routing() -> Dict:
+    if not os.path.exists(ROUTING_FILE):
+        return {'teams': {}, 'shards': {}}
+    with open(ROUTING_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_routing(routing: Dict) -> None:
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    tmp_file = f"{ROUTING_FILE}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(routing, f, indent=2)
+    os.replace(tmp_file, ROUTING_FILE)
+
+def scan_team_digests() -> Dict[str, Dict]:
+    """Row count and a change digest per team, from ids and update times only"""
+    digests: Dict[str, 'hashlib._Hash'] = {}
+    counts: Dict[str, int] = {}
+    last = None
+
+    while True:
+        query = get_supabase('service').table(SOURCE_TABLE).select('id, team_id, updated_at')
+        if last:
+            query = query.gt('id', last)
+        page = call_with_retries(query.order('id').limit(PAGE_SIZE).execute, 'supabase').data
+        for row in page:
+            team = row['team_id']
+            digests.setdefault(team, hashlib.sha1()).update(f"{row['id']}|{row['updated_at']};".encode())
+            counts[team] = counts.get(team, 0) + 1
+        if len(page) < PAGE_SIZE:
+            break
+        last = page[-1]['id']
+
+    return {team: {'count': counts[team], 'digest': digest.hexdigest()} for team, digest in digests.items()}
+
+def fetch_team_vectors(team_id: str) -> Tuple[List[str], np.ndarray]:
+    """(message ids, vectors) for one team"""
+    ids, vectors = [], []
+    last = None
+
+    while True:
+        query = get_supabase('service').table(SOURCE_TABLE).select('id, message_id, embedding').eq('team_id', team_id)
+        if last:
+            query = query.gt('id', last)
+        page = call_with_retries(query.order('id').limit(PAGE_SIZE).execute, 'supabase').data
+        for row in page:
+            if row['embedding'] is None:
+                continue
+            embedding = row['embedding']
+            # PostgREST returns pgvector values as their text form
+            vectors.append(json.loads(embedding) if isinstance(embedding, str) else embedding)
+            ids.append(row['message_id'])
+        if len(page) < PAGE_SIZE:
+            break
+        last = page[-1]['id']
+
+    return ids, np.asarray(vectors, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+
+def plan_shards(teams: Dict[str, Dict], previous: Dict[str, Dict]) -> Dict[str, str]:
+    """Assign every team to a shard: its own at POOL_LIMIT or above, otherwise a pooled one
+
+    Pooled teams stay in their previous pool while it has room, so a sync
+    only moves teams that crossed the limit or whose pool overflowed; the
+    rest are packed largest-first into the fullest pool they fit.
+    """
+    assignment = {}
+    pools: Dict[str, int] = {}
+    unplaced = []
+    for team, info in sorted(teams.items(), key=lambda item: -item[1]['count']):
+        if info['count'] >= POOL_LIMIT:
+            assignment[team] = f"team-{team}"
+            continue
+        old = previous.get(team, {}).get('shard', '')
+        if old.startswith('pool-') and pools.get(old, 0) + info['count'] <= POOL_SHARD_SIZE:
+            pools[old] = pools.get(old, 0) + info['count']
+            assignment[team] = old
+        else:
+            unplaced.append(team)
+
+    for team in unplaced:
+        count = teams[team]['count']
+        fits = [name for name, size in pools.items() if size + count <= POOL_SHARD_SIZE]
+        if fits:
+            name = max(fits, key=lambda n: pools[n])
+        else:
+            name = next(f"pool-{i}" for i in range(len(pools) + 1) if f"pool-{i}" not in pools)
+        pools[name] = pools.get(name, 0) + count
+        assignment[team] = name
+    return assignment
+
+def build_shard(name: str, members: Dict[str, Tuple[List[str], np.ndarray]]) -> Dict:
+    """Write a shard beside the live one, each member team's rows contiguous; returns its routing entry"""
+    path = os.path.join(INDEX_DIR, name)
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    create_corpus(tmp_path, EMBEDDING_DIM, model=None)
+
+    entry = {'teams': {}, 'kind': 'flat', 'count': 0}
+    for team, (ids, vectors) in sorted(members.items()):
+        vectors = normalize(vectors) if len(vectors) else vectors
+        order = np.arange(len(ids))
+
+        if len(members) == 1 and len(ids) >= IVF_LIMIT:
+            # Dedicated large shard: cluster, then store rows grouped by list
+            centroids = train_centroids(vectors, ivf_lists(len(ids)))
+            assignment = np.argmax(vectors @ centroids.T, axis=1)
+            order = np.argsort(assignment, kind='stable')
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=len(centroids)))])
+            np.savez(os.path.join(tmp_path, 'ivf.npz'), centroids=centroids, offsets=offsets)
+            entry['kind'] = 'ivf'
+
+        start = entry['count']
+        if len(ids):
+            append(tmp_path, vectors[order], [{'id': ids[i], 'source': SOURCE_TABLE, 'team_id': team} for i in order])
+        entry['count'] += len(ids)
+        entry['teams'][team] = [start, entry['count']]
+
+    return entry
+
+def swap_shard(name: str) -> None:
+    """Replace a live shard with its freshly built copy (or delete it if none was built)"""
+    path = os.path.join(INDEX_DIR, name)
+    old_path = f"{path}.old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    if os.path.exists(f"{path}.tmp"):
+        os.replace(f"{path}.tmp", path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+def sync(force: bool = False) -> Dict:
+    """Bring the per-team shards in line with message_embeddings
+
+    Only shards whose member teams changed (or whose membership changed
+    because a team grew past POOL_LIMIT) are rebuilt. Every rebuilt shard is
+    written aside first and all are swapped in together with the new routing,
+    so queries never see a half-built shard or stale row ranges.
+    """
+    routing = load_routing()
+    with metrics.stage('scan'):
+        teams = scan_team_digests()
+    previous = routing['teams']
+    assignment = plan_shards(teams, previous)
+
+    dirty = set()
+    for team, shard in assignment.items():
+        old = previous.get(team)
+        if force or old is None or old['shard'] != shard or old['digest'] != teams[team]['digest']:
+            dirty.add(shard)
+            if old is not None and old['shard'] != shard:
+                dirty.add(old['shard'])
+    removed = set(previous) - set(teams)
+    dirty.update(previous[team]['shard'] for team in removed)
+
+    shards = dict(routing['shards'])
+    for shard in sorted(dirty):
+        members = [team for team, name in assignment.items() if name == shard]
+        if not members:
+            shards.pop(shard, None)
+            print(f"🗑️  Removing empty shard {shard}")
+            continue
+        with metrics.stage('fetch'):
+            vectors = {team: fetch_team_vectors(team) for team in members}
+        with metrics.stage('build'):
+            shards[shard] = build_shard(shard, vectors)
+        metrics.item('shards')
+        print(f"📦 Built {shard}: {shards[shard]['count']} vectors, {len(members)} team(s), {shards[shard]['kind']}")
+
+    routing = {
+        'teams': {team: {'shard': assignment[team], **teams[team]} for team in teams},
+        'shards': shards,
+    }
+    with _cache_lock:
+        for shard in dirty:
+            swap_shard(shard)
+        save_routing(routing)
+        _shard_cache.clear()
+
+    # Cached search results for changed teams are now stale
+    for team in set(teams) | set(previous):
+        if force or team not in teams or team not in previous or previous[team]['digest'] != teams[team]['digest']:
+            invalidate_team(team)
+    print(f"✅ {len(teams)} teams across {len(shards)} shards ({len(dirty)} rebuilt)")
+    return routing
+
+_shard_cache: Dict[str, Tuple[Corpus, Optional[Dict]]] = {}
+_cache_lock = threading.Lock()
+
+def open_shard(name: str) -> Tuple[Corpus, Optional[Dict]]:
+    """Memory-mapped shard plus its IVF data, if it has any"""
+    with _cache_lock:
+        if name not in _shard_cache:
+            path = os.path.join(INDEX_DIR, name)
+            ivf_file = os.path.join(path, 'ivf.npz')
+            ivf = dict(np.load(ivf_file)) if os.path.exists(ivf_file) else None
+            _shard_cache[name] = (Corpus(path), ivf)
+        return _shard_cache[name]
+
+def has_team(team_id: str, routing: Optional[Dict] = None) -> bool:
+    routing = routing or load_routing()
+    return team_id in routing['teams']
+
+def search(team_id: str, query_vector, k: int = 10, probes: int = DEFAULT_PROBES,
+           routing: Optional[Dict] = None) -> List[Tuple[str, float]]:
+    """Top-k (message id, cosine similarity) for a team, scanning only that team's rows"""
+    routing = routing or load_routing()
+    route = routing['teams'].get(team_id)
+    if route is None:
+        return []
+
+    corpus, ivf = open_shard(route['shard'])
+    start, end = routing['shards'][route['shard']]['teams'][team_id]
+    query = normalize(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+
+    if ivf is not None:
+        # Scan only the probed lists, each a contiguous block of rows
+        nearest = np.argsort(-(ivf['centroids'] @ query))[:probes]
+        rows = np.concatenate([np.arange(start + ivf['offsets'][i], start + ivf['offsets'][i + 1]) for i in nearest])
+        scores = np.asarray(corpus.vectors[rows], dtype=np.float32) @ query
+    else:
+        rows = np.arange(start, end)
+        scores = np.asarray(corpus.vectors[start:end], dtype=np.float32) @ query
+
+    k = min(k, len(rows))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    ids = corpus.column('id')
+    return [(ids[int(rows[i])], float(scores[i])) for i in top]
+
+def describe(routing: Dict) -> str:
+    lines = [f"{len(routing['teams'])} teams, {len(routing['shards'])} shards"]
+    for name, shard in sorted(routing['shards'].items()):
+        lines.append(f"  {name}: {shard['count']} vectors, {len(shard['teams'])} team(s), {shard['kind']}")
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query per-team vector shards from message_embeddings")
+    commands = parser.add_subparsers(dest='command', required=True)
+    sync_command = commands.add_parser('sync', help="Rebuild shards whose teams changed and rebalance pooled teams")
+    sync_command.add_argument('--force', action='store_true', help="Rebuild every shard")
+    commands.add_parser('status', help="Show shard layout")
+    args = parser.parse_args()
+    metrics.start_profiling()
+
+    if args.command == 'sync':
+        sync(args.force)
+    else:
+        print(describe(load_routing()))
+    metrics.finish()
+
+if __name__ == "__main__":
+    main()
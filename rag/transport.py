@@ -0,0 +1,113 @@
+import importlib
+import os
+import threading
+import weakref
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from instrumentation import metrics
+
+# Connection pool limits for each service's shared HTTP client
+MAX_CONNECTIONS = int(os.getenv('HTTP_MAX_CONNECTIONS', '32'))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', '16'))
+KEEPALIVE_EXPIRY = float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '60'))
+
+# Multiplex requests over one connection per host when the h2 package is installed
+HTTP2 = os.getenv('HTTP2', '1') not in ('0', 'false')
+
+# Request timeouts, in seconds
+CONNECT_TIMEOUT = 10.0
+REQUEST_TIMEOUT = 120.0
+
+# Status and headers of the last response received on each thread
+_last = threading.local()
+
+def last_response() -> Optional[Tuple[int, Any]]:
+    """(status, headers) of this thread's most recent request, or None if it got no response
+
+    Some SDKs (postgrest) drop the HTTP status and headers when raising, so the
+    retry policy looks them up here.
+    """
+    return getattr(_last, 'response', None)
+
+def _on_request(request) -> None:
+    _last.response = None
+
+def _on_response(response) -> None:
+    _last.response = (response.status_code, response.headers)
+
+def http2_available() -> bool:
+    """Whether HTTP/2 is both enabled and supported by the installed packages"""
+    if not HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+class PoolTracker:
+    """Counts requests served by new versus already-open pooled connections
+
+    httpx does not report connection reuse, so after every response the pool's
+    connections are compared against the ones seen before; any unseen
+    connection was opened (handshake included) for that request.
+    """
+
+    def __init__(self, service: str):
+        self.service = service
+        self.lock = threading.Lock()
+        self.known = weakref.WeakSet()
+
+    def observe(self, http_client) -> None:
+        pool = getattr(getattr(http_client, '_transport', None), '_pool', None)
+        if pool is None:
+            return
+
+        connections = list(pool.connections)
+        with self.lock:
+            opened = [c for c in connections if c not in self.known]
+            self.known.update(opened)
+        metrics.record_pool(self.service, new_connections=len(opened),
+                            open_connections=len(connections))
+
+def http_module(client_class):
+    """The httpx-compatible package a client class is built on (httpx or a fork)"""
+    for base in client_class.__mro__:
+        package = base.__module__.split('.')[0]
+        if base.__name__ == 'Client' and package.startswith('httpx'):
+            return importlib.import_module(package)
+    return importlib.import_module('httpx')
+
+def build_http_client(service: str, client_class: Optional[Callable[..., Any]] = None, **kwargs):
+    """Create the pooled, keep-alive (and HTTP/2 where possible) client for one service
+
+    client_class lets libraries that ship their own httpx subclass, such as
+    openai.DefaultHttpxClient, keep their defaults while sharing these limits.
+    """
+    if client_class is None:
+        import httpx
+        client_class = httpx.Client
+        kwargs.setdefault('timeout', httpx.Timeout(REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT))
+        kwargs.setdefault('follow_redirects', True)
+    httpx = http_module(client_class)
+
+    http_client = client_class(
+        http2=http2_available(),
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        **kwargs,
+    )
+
+    tracker = PoolTracker(service)
+    hooks = http_client.event_hooks
+    hooks['request'] = list(hooks.get('request', [])) + [_on_request]
+    hooks['response'] = list(hooks.get('response', [])) + [_on_response, lambda response: tracker.observe(http_client)]
+    http_client.event_hooks = hooks
+    return http_client
+
+def pool_summary() -> Dict[str, Dict]:
+    """Pool hit rates and connection counts recorded so far, per service"""
+    return metrics.to_dict()['pools']
@@ -0,0 +1,230 @@
+import argparse
+import json
+import math
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from clients import get_supabase
+from instrumentation import metrics
+from resilience import call_with_retries
+
+STATE_FILE = os.path.join(os.path.dirname(__file__), 'data', 'vector_maintenance.json')
+
+INDEX_NAME = 'idx_message_embeddings_embedding'
+
+# Recall@k the tuned probes must reach on the sample query set
+DEFAULT_TARGET_RECALL = 0.95
+RECALL_K = 10
+SAMPLE_SIZE = 100
+
+# Rebuild when the configured lists are this far off the recommendation,
+# or the table has grown by this factor since the centroids were trained
+LISTS_TOLERANCE = 2.0
+GROWTH_FACTOR = 2.0
+
+# Below this many rows an index is not worth having; use a single list
+MIN_INDEXED_ROWS = 1000
+
+# Recall drop (versus the last run, at the same probes) reported as drift
+DRIFT_TOLERANCE = 0.02
+
+def recommended_lists(rows: int) -> int:
+    """pgvector's guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond"""
+    if rows <= MIN_INDEXED_ROWS:
+        return 1
+    if rows <= 1_000_000:
+        return rows // 1000
+    return int(math.sqrt(rows))
+
+def rpc(name: str, params: Optional[Dict] = None, idempotent: bool = True):
+    return call_with_retries(get_supabase('service').rpc(name, params or {}).execute, 'supabase', idempotent).data
+
+def load_state() -> Dict:
+    if not os.path.exists(STATE_FILE):
+        return {'queries': [], 'runs': []}
+    with open(STATE_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_state(state: Dict) -> None:
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    tmp_file = f"{STATE_FILE}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, STATE_FILE)
+
+def get_settings() -> Dict:
+    rows = call_with_retries(get_supabase('service').table('vector_index_settings').select('*')
+                             .eq('index_name', INDEX_NAME).execute, 'supabase').data
+    if not rows:
+        raise ValueError("vector_index_settings is empty; apply migrations/007_ivfflat_maintenance.sql")
+    return rows[0]
+
+def get_stats() -> Dict:
+    rows = rpc('vector_index_stats')
+    if not rows:
+        raise ValueError(f"{INDEX_NAME} does not exist")
+    return rows[0]
+
+def sample_queries(state: Dict, resample: bool = False) -> List[Dict]:
+    """Fixed query set, so recall is comparable from one run to the next"""
+    if resample or not state['queries']:
+        with metrics.stage('sample'):
+            rows = rpc('sample_message_embeddings', {'p_count': SAMPLE_SIZE})
+        state['queries'] = [{'team_id': row['team_id'], 'embedding': row['embedding']} for row in rows]
+    return state['queries']
+
+def search(query: Dict, probes: int) -> Tuple[List[str], float]:
+    """Top RECALL_K message ids with the given probes (0 = exact), plus the latency in seconds"""
+    start = time.perf_counter()
+    rows = rpc('probe_similar_messages', {
+        'query_embedding': query['embedding'],
+        'team_id_filter': query['team_id'],
+        'max_results': RECALL_K,
+        'p_probes': probes,
+    })
+    return [row['message_id'] for row in rows], time.perf_counter() - start
+
+def measure(queries: List[Dict], exact: List[List[str]], probes: int) -> Dict:
+    """Mean recall@k and latency of the sample queries at a number of probes"""
+    recalls, latencies = [], []
+    with metrics.stage(f'probes_{probes}'):
+        for query, truth in zip(queries, exact):
+            found, seconds = search(query, probes)
+            if truth:
+                recalls.append(len(set(found) & set(truth)) / len(truth))
+            latencies.append(seconds)
+    return {
+        'probes': probes,
+        'recall': sum(recalls) / len(recalls) if recalls else 1.0,
+        'latency_ms': 1000 * sum(latencies) / max(len(latencies), 1),
+    }
+
+def exact_results(queries: List[Dict]) -> List[List[str]]:
+    """Ground truth for the sample queries from an exact scan"""
+    with metrics.stage('exact'):
+        return [search(query, 0)[0] for query in queries]
+
+def tune(queries: List[Dict], exact: List[List[str]], lists: int, target: float) -> Tuple[Dict, List[Dict]]:
+    """Smallest probes reaching the target recall (latency grows with probes)
+
+    Doubles probes until the target is met, then bisects back down.
+    """
+    results = {}
+    def at(probes: int) -> Dict:
+        if probes not in results:
+            results[probes] = measure(queries, exact, probes)
+            r = results[probes]
+            print(f"  probes={probes:4d}  recall@{RECALL_K}={r['recall']:.3f}  {r['latency_ms']:.1f} ms")
+        return results[probes]
+
+    low, high = 0, 1
+    while at(high)['recall'] < target and high < lists:
+        low, high = high, min(high * 2, lists)
+    if at(high)['recall'] >= target:
+        while high - low > 1:
+            middle = (low + high) // 2
+            if at(middle)['recall'] >= target:
+                high = middle
+            else:
+                low = middle
+    return at(high), sorted(results.values(), key=lambda r: r['probes'])
+
+def check() -> Dict:
+    """Compare the index against the data it serves and decide what needs doing"""
+    stats = get_stats()
+    settings = get_settings()
+    rows, lists = stats['row_count'], stats['lists'] or settings['lists']
+    recommended = recommended_lists(rows)
+    trained_rows = settings['row_count']
+
+    reasons = []
+    if max(lists, recommended) / max(min(lists, recommended), 1) > LISTS_TOLERANCE:
+        reasons.append(f"lists={lists} but {rows} rows call for about {recommended}")
+    if rows >= MIN_INDEXED_ROWS and rows > GROWTH_FACTOR * max(trained_rows, 1):
+        reasons.append(f"centroids were trained on {trained_rows} rows, table now has {rows}")
+
+    print(f"📊 {INDEX_NAME}: {rows} rows, lists={lists}, probes={settings['probes']}, "
+          f"{stats['index_bytes'] / (1024 * 1024):.1f} MB")
+    for reason in reasons:
+        print(f"  ⚠️  {reason}")
+    return {'rows': rows, 'lists': lists, 'recommended_lists': recommended, 'probes': settings['probes'],
+            'rebuild': bool(reasons), 'reasons': reasons}
+
+def detect_drift(state: Dict, result: Dict) -> Optional[float]:
+    """Recall lost since the last run at the same probes, if it exceeds DRIFT_TOLERANCE"""
+    previous = [run for run in state['runs'] if run['probes'] == result['probes']]
+    if not previous:
+        return None
+    drop = previous[-1]['recall'] - result['recall']
+    return drop if drop > DRIFT_TOLERANCE else None
+
+def run(target: float, apply: bool, resample: bool = False, force_rebuild: bool = False,
+        lists: Optional[int] = None) -> None:
+    state = load_state()
+    status = check()
+
+    if status['rows'] == 0:
+        print("No embeddings yet; nothing to tune")
+        return
+
+    if status['rebuild'] or force_rebuild:
+        new_lists = lists or status['recommended_lists']
+        if apply:
+            print(f"🔨 Rebuilding {INDEX_NAME} with lists={new_lists}...")
+            with metrics.stage('rebuild'):
+                rpc('rebuild_message_embeddings_index', {'p_lists': new_lists}, idempotent=False)
+            status['lists'] = new_lists
+            # Old measurements describe the old centroids
+            state['runs'] = []
+        else:
+            print(f"💡 Recommend rebuilding with lists={new_lists} (rerun with --apply)")
+
+    queries = sample_queries(state, resample)
+    print(f"🎯 Tuning probes for recall@{RECALL_K} >= {target} over {len(queries)} sample queries")
+    exact = exact_results(queries)
+    current = measure(queries, exact, status['probes'])
+    drift = detect_drift(state, current)
+    if drift is not None:
+        print(f"  ⚠️  Recall at probes={status['probes']} drifted down by {drift:.3f} since the last run")
+
+    best, results = tune(queries, exact, status['lists'], target)
+    if best['recall'] < target:
+        print(f"❌ Even probes={best['probes']} only reaches recall {best['recall']:.3f}")
+    else:
+        print(f"✅ probes={best['probes']} reaches recall {best['recall']:.3f} at {best['latency_ms']:.1f} ms "
+              f"(currently probes={status['probes']}, recall {current['recall']:.3f})")
+
+    if apply and best['probes'] != status['probes']:
+        rpc('set_ivfflat_probes', {'p_probes': best['probes'], 'p_target_recall': target,
+                                   'p_measured_recall': best['recall']}, idempotent=False)
+        print(f"  Set ivfflat.probes={best['probes']} on the message search functions")
+    elif not apply and best['probes'] != status['probes']:
+        print(f"💡 Recommend ivfflat.probes={best['probes']} (rerun with --apply)")
+
+    state['runs'].append({
+        'at': datetime.now(timezone.utc).isoformat(),
+        'rows': status['rows'],
+        'lists': status['lists'],
+        'probes': best['probes'] if apply else status['probes'],
+        'recall': best['recall'] if apply else current['recall'],
+        'results': results,
+    })
+    save_state(state)
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrain and tune the message_embeddings ivfflat index")
+    parser.add_argument('--target', type=float, default=DEFAULT_TARGET_RECALL, help="Target recall@10")
+    parser.add_argument('--apply', action='store_true', help="Rebuild and set probes instead of only recommending")
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild the index even if it looks healthy")
+    parser.add_argument('--lists', type=int, help="lists to rebuild with (default: sized to the data)")
+    parser.add_argument('--resample', action='store_true', help="Draw a new sample query set")
+    args = parser.parse_args()
+    metrics.start_profiling()
+
+    run(args.target, args.apply, args.resample, args.rebuild, args.lists)
+    metrics.finish()
+
+if __name__ == "__main__":
+    main()
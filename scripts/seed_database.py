@@ -1,20 +1,39 @@
 #!/usr/bin/env python3
 
+from __future__ import annotations
+
+import argparse
 import json
 import os
 import sys
 from datetime import datetime, timezone
 import uuid
-from supabase import create_client, Client
-from dotenv import load_dotenv
+from typing import TYPE_CHECKING
+
+# Shared pipeline helpers live in rag/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rag'))
+from clients import ENV_FILE, get_supabase, load_env as load_env_file
+from instrumentation import metrics
+from resilience import call_with_retries
+from table_planner import delete_waves, run_waves
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+# Tables emptied before messages and direct messages are re-created
+MESSAGE_TABLES = ['reactions', 'messages', 'direct_message_reactions', 'direct_messages',
+                  'direct_message_participants', 'direct_message_channels']
 
 def load_env():
     # Load environment variables from .env.local
-    env_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env.local')
-    if not os.path.exists(env_path):
+    if not os.path.exists(ENV_FILE):
         print("Error: .env.local file not found")
         sys.exit(1)
-    load_dotenv(env_path)
+    load_env_file()
+
+def execute(query, idempotent=True):
+    # Every row we insert carries its own key, so retried inserts cannot duplicate
+    return call_with_retries(query.execute, 'supabase', idempotent)
 
 def load_json_file(filename):
     with open(os.path.join('scripts/seed_data', filename)) as f:
@@ -23,21 +42,21 @@ def load_json_file(filename):
 def get_or_create_user(supabase: Client, user_data):
     # First check if user already exists by email in user_profiles
     try:
-        result = supabase.from_('user_profiles').select('user_id').eq('name', user_data['name']).execute()
+        result = execute(supabase.from_('user_profiles').select('user_id').eq('name', user_data['name']))
         if result.data and len(result.data) > 0:
             print(f"User {user_data['name']} already exists, using existing ID")
             return result.data[0]['user_id']
         
         print(f"Creating new user {user_data['email']}")
         # If user doesn't exist, create new one
-        auth_response = supabase.auth.admin.create_user({
+        auth_response = call_with_retries(lambda: supabase.auth.admin.create_user({
             "email": user_data['email'],
             "password": "Password123!",
             "email_confirm": True,
             "user_metadata": {
                 "name": user_data['name']
             }
-        })
+        }), 'supabase', idempotent=False)
         user_id = auth_response.user.id
         
         # Create user profile
@@ -48,7 +67,7 @@ def get_or_create_user(supabase: Client, user_data):
             "avatar_url": user_data['avatar_url'],
             "status": 'online'
         }
-        supabase.table('user_profiles').insert(profile_data).execute()
+        execute(supabase.table('user_profiles').insert(profile_data))
         return user_id
     except Exception as e:
         print(f"Error with user {user_data['email']}: {e}")
@@ -57,7 +76,7 @@ def get_or_create_user(supabase: Client, user_data):
 def get_or_create_team(supabase: Client, team_data, owner_id):
     # Check if team already exists
     try:
-        result = supabase.from_('teams').select('id').eq('name', team_data['name']).execute()
+        result = execute(supabase.from_('teams').select('id').eq('name', team_data['name']))
         if result.data and len(result.data) > 0:
             print(f"Team {team_data['name']} already exists, using existing ID")
             return result.data[0]['id']
@@ -70,7 +89,7 @@ def get_or_create_team(supabase: Client, team_data, owner_id):
             "description": team_data['description'],
             "created_by": owner_id
         }
-        supabase.table('teams').insert(team_data).execute()
+        execute(supabase.table('teams').insert(team_data))
         return team_id
     except Exception as e:
         print(f"Error with team {team_data['name']}: {e}")
@@ -79,7 +98,7 @@ def get_or_create_team(supabase: Client, team_data, owner_id):
 def get_or_create_channel(supabase: Client, channel_data, team_id, created_by):
     # Check if channel already exists in this team
     try:
-        result = supabase.from_('channels').select('id').eq('name', channel_data['name']).eq('team_id', team_id).execute()
+        result = execute(supabase.from_('channels').select('id').eq('name', channel_data['name']).eq('team_id', team_id))
         if result.data and len(result.data) > 0:
             print(f"Channel {channel_data['name']} already exists in team, using existing ID")
             return result.data[0]['id']
@@ -94,7 +113,7 @@ def get_or_create_channel(supabase: Client, channel_data, team_id, created_by):
             "team_id": team_id,
             "created_by": created_by
         }
-        supabase.table('channels').insert(channel_data).execute()
+        execute(supabase.table('channels').insert(channel_data))
         return channel_id
     except Exception as e:
         print(f"Error with channel {channel_data['name']}: {e}")
@@ -103,7 +122,7 @@ def get_or_create_channel(supabase: Client, channel_data, team_id, created_by):
 def create_reaction(supabase: Client, message_id, user_id, emoji="👍"):
     try:
         # Check if reaction already exists
-        result = supabase.from_('reactions').select('id').eq('message_id', message_id).eq('user_id', user_id).eq('emoji', emoji).execute()
+        result = execute(supabase.from_('reactions').select('id').eq('message_id', message_id).eq('user_id', user_id).eq('emoji', emoji))
         if result.data and len(result.data) > 0:
             print(f"Reaction already exists, skipping: {emoji}")
             return
@@ -117,19 +136,19 @@ def create_reaction(supabase: Client, message_id, user_id, emoji="👍"):
             "created_by": user_id,
             "message_type": "message"  # or "direct_message" if needed
         }
-        supabase.table('reactions').insert(reaction_data).execute()
+        execute(supabase.table('reactions').insert(reaction_data))
     except Exception as e:
         print(f"Error creating reaction: {e}")
         raise e
 
 def clean_messages(supabase: Client):
     try:
-        print("Cleaning existing messages and reactions...")
-        # Delete all reactions first (due to foreign key constraints)
-        supabase.table('reactions').delete().gte('created_at', '2000-01-01').execute()
-        # Delete all messages
-        supabase.table('messages').delete().gte('created_at', '2000-01-01').execute()
-        print("Cleaned existing messages and reactions")
+        print("Cleaning existing messages, direct messages and reactions...")
+        # Foreign keys decide the order; tables in the same wave are emptied concurrently
+        def delete_all(table):
+            execute(supabase.table(table).delete().gte('created_at', '2000-01-01'))
+        run_waves(delete_waves(MESSAGE_TABLES), delete_all)
+        print("Cleaned existing messages, direct messages and reactions")
     except Exception as e:
         print(f"Error cleaning messages: {e}")
         raise e
@@ -161,7 +180,7 @@ def create_message(supabase: Client, message_data, channel_id, user_id, parent_i
             file_name = file_data.get('name', '')
             message_data['extension'] = file_name.split('.')[-1] if '.' in file_name else 'txt'
         
-        supabase.table('messages').insert(message_data).execute()
+        execute(supabase.table('messages').insert(message_data))
         
         # Add some random reactions to make the chat more lively
         if not parent_id:  # Only add reactions to main messages, not replies
@@ -181,7 +200,7 @@ def create_message(supabase: Client, message_data, channel_id, user_id, parent_i
 def add_team_member(supabase: Client, team_id, user_id, role):
     try:
         # Check if member already exists
-        result = supabase.from_('team_members').select('*').eq('team_id', team_id).eq('user_id', user_id).execute()
+        result = execute(supabase.from_('team_members').select('*').eq('team_id', team_id).eq('user_id', user_id))
         if result.data and len(result.data) > 0:
             print(f"Team member already exists, skipping")
             return
@@ -191,7 +210,7 @@ def add_team_member(supabase: Client, team_id, user_id, role):
             "user_id": user_id,
             "role": role
         }
-        supabase.table('team_members').insert(team_member_data).execute()
+        execute(supabase.table('team_members').insert(team_member_data))
     except Exception as e:
         print(f"Error adding team member: {e}")
         raise e
@@ -199,7 +218,7 @@ def add_team_member(supabase: Client, team_id, user_id, role):
 def add_channel_member(supabase: Client, channel_id, user_id):
     try:
         # Check if member already exists
-        result = supabase.from_('channel_members').select('*').eq('channel_id', channel_id).eq('user_id', user_id).execute()
+        result = execute(supabase.from_('channel_members').select('*').eq('channel_id', channel_id).eq('user_id', user_id))
         if result.data and len(result.data) > 0:
             print(f"Channel member already exists, skipping")
             return
@@ -208,7 +227,7 @@ def add_channel_member(supabase: Client, channel_id, user_id):
             "channel_id": channel_id,
             "user_id": user_id
         }
-        supabase.table('channel_members').insert(channel_member_data).execute()
+        execute(supabase.table('channel_members').insert(channel_member_data))
     except Exception as e:
         print(f"Error adding channel member: {e}")
         raise e
@@ -219,10 +238,10 @@ def create_direct_message_channel(supabase: Client, participants):
         participant_ids = sorted([user_mapping[email] for email in participants])
         
         # Check if channel exists by looking up participants
-        channels = supabase.from_('direct_message_channels').select('id').execute()
+        channels = execute(supabase.from_('direct_message_channels').select('id'))
         if channels.data:
             for channel in channels.data:
-                participants_result = supabase.from_('direct_message_participants').select('user_id').eq('channel_id', channel['id']).execute()
+                participants_result = execute(supabase.from_('direct_message_participants').select('user_id').eq('channel_id', channel['id']))
                 if participants_result.data:
                     channel_participants = sorted([p['user_id'] for p in participants_result.data])
                     if channel_participants == participant_ids:
@@ -232,14 +251,14 @@ def create_direct_message_channel(supabase: Client, participants):
         # Create new channel
         print("Creating new direct message channel")
         channel_id = str(uuid.uuid4())
-        supabase.table('direct_message_channels').insert({"id": channel_id}).execute()
+        execute(supabase.table('direct_message_channels').insert({"id": channel_id}))
         
         # Add participants
         for user_id in participant_ids:
-            supabase.table('direct_message_participants').insert({
+            execute(supabase.table('direct_message_participants').insert({
                 "channel_id": channel_id,
                 "user_id": user_id
-            }).execute()
+            }))
         
         return channel_id
     except Exception as e:
@@ -259,7 +278,7 @@ def create_direct_message(supabase: Client, message_data, channel_id, user_id, p
             "file": None
         }
         
-        supabase.table('direct_messages').insert(message_data).execute()
+        execute(supabase.table('direct_messages').insert(message_data))
         
         # Add some random reactions
         if not parent_id:  # Only add reactions to main messages
@@ -277,7 +296,7 @@ def create_direct_message(supabase: Client, message_data, channel_id, user_id, p
 def create_direct_message_reaction(supabase: Client, message_id, user_id, emoji="👍"):
     try:
         # Check if reaction already exists
-        result = supabase.from_('direct_message_reactions').select('id').eq('message_id', message_id).eq('user_id', user_id).eq('emoji', emoji).execute()
+        result = execute(supabase.from_('direct_message_reactions').select('id').eq('message_id', message_id).eq('user_id', user_id).eq('emoji', emoji))
         if result.data and len(result.data) > 0:
             print(f"Direct message reaction already exists, skipping: {emoji}")
             return
@@ -289,25 +308,12 @@ def create_direct_message_reaction(supabase: Client, message_id, user_id, emoji=
             "user_id": user_id,
             "emoji": emoji
         }
-        supabase.table('direct_message_reactions').insert(reaction_data).execute()
+        execute(supabase.table('direct_message_reactions').insert(reaction_data))
     except Exception as e:
         print(f"Error creating direct message reaction: {e}")
         raise e
 
-def clean_direct_messages(supabase: Client):
-    try:
-        print("Cleaning existing direct messages...")
-        # Delete in correct order due to foreign key constraints
-        supabase.table('direct_message_reactions').delete().gte('created_at', '2000-01-01').execute()
-        supabase.table('direct_messages').delete().gte('created_at', '2000-01-01').execute()
-        supabase.table('direct_message_participants').delete().gte('created_at', '2000-01-01').execute()
-        supabase.table('direct_message_channels').delete().gte('created_at', '2000-01-01').execute()
-        print("Cleaned existing direct messages")
-    except Exception as e:
-        print(f"Error cleaning direct messages: {e}")
-        raise e
-
-def main():
+def main(sync=False, dry_run=False):
     # Load environment variables from .env.local
     load_env()
     
@@ -319,22 +325,24 @@ def main():
         print("Error: NEXT_PUBLIC_SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY must be set in .env.local")
         sys.exit(1)
     
-    supabase: Client = create_client(supabase_url, supabase_service_key)
+    supabase: Client = get_supabase('service')
     
     # Load data
-    users_data = load_json_file('users.json')
-    teams_data = load_json_file('teams.json')
-    messages_data = load_json_file('messages.json')
-    textbooks_data = load_json_file('textbooks.json')
+    with metrics.stage('load'):
+        users_data = load_json_file('users.json')
+        teams_data = load_json_file('teams.json')
+        messages_data = load_json_file('messages.json')
+        textbooks_data = load_json_file('textbooks.json')
     
     try:
         # Get or create users and store mapping of email to user_id
         print("\nProcessing users...")
         global user_mapping  # Make it global so create_message can access it for reactions
         user_mapping = {}
-        for user in users_data['users']:
-            user_id = get_or_create_user(supabase, user)
-            user_mapping[user['email']] = user_id
+        with metrics.stage('users'):
+            for user in users_data['users']:
+                user_id = get_or_create_user(supabase, user)
+                user_mapping[user['email']] = user_id
         
         # Find owner (first user with role 'owner')
         owner_email = next(user['email'] for user in users_data['users'] if user['role'] == 'owner')
@@ -343,63 +351,89 @@ def main():
         # Process teams and channels
         print("\nProcessing teams and channels...")
         channel_mapping = {}  # store channel_name -> channel_id mapping
-        for team in teams_data['teams']:
-            team_id = get_or_create_team(supabase, team, owner_id)
-            
-            # Add team members
-            for user in users_data['users']:
-                add_team_member(supabase, team_id, user_mapping[user['email']], user['role'])
-            
-            # Create channels
-            for channel in team['channels']:
-                channel_id = get_or_create_channel(supabase, channel, team_id, owner_id)
-                channel_mapping[channel['name']] = channel_id
+        with metrics.stage('teams_and_channels'):
+            for team in teams_data['teams']:
+                team_id = get_or_create_team(supabase, team, owner_id)
                 
-                # Add all team members to non-private channels
-                if not channel['is_private']:
-                    for user in users_data['users']:
-                        add_channel_member(supabase, channel_id, user_mapping[user['email']])
+                # Add team members
+                for user in users_data['users']:
+                    add_team_member(supabase, team_id, user_mapping[user['email']], user['role'])
+                
+                # Create channels
+                for channel in team['channels']:
+                    channel_id = get_or_create_channel(supabase, channel, team_id, owner_id)
+                    channel_mapping[channel['name']] = channel_id
+                    
+                    # Add all team members to non-private channels
+                    if not channel['is_private']:
+                        for user in users_data['users']:
+                            add_channel_member(supabase, channel_id, user_mapping[user['email']])
+        
+        if sync:
+            # Write only what differs from the seed files instead of wiping and reloading
+            from seed_sync import sync_messages
+            print("\nSyncing messages and direct messages" + (" (dry run)..." if dry_run else "..."))
+            with metrics.stage('sync'):
+                sync_messages(supabase, messages_data, load_json_file('direct_messages.json'),
+                              user_mapping, channel_mapping, dry_run)
+            print("\nDatabase sync completed!")
+            metrics.finish()
+            return
         
         # Clean existing messages and direct messages
-        clean_messages(supabase)
-        clean_direct_messages(supabase)
+        with metrics.stage('clean'):
+            clean_messages(supabase)
         
         # Create regular messages
         print("\nProcessing channel messages...")
-        for thread in messages_data['message_threads']:
-            channel_id = channel_mapping[thread['channel']]
-            
-            for message in thread['messages']:
-                author_id = user_mapping[message['author']]
-                message_id = create_message(supabase, message, channel_id, author_id)
+        with metrics.stage('messages'):
+            for thread in messages_data['message_threads']:
+                channel_id = channel_mapping[thread['channel']]
                 
-                # Create replies
-                if 'replies' in message:
-                    for reply in message['replies']:
-                        reply_author_id = user_mapping[reply['author']]
-                        create_message(supabase, reply, channel_id, reply_author_id, message_id)
+                for message in thread['messages']:
+                    author_id = user_mapping[message['author']]
+                    message_id = create_message(supabase, message, channel_id, author_id)
+                    metrics.item('messages')
+                    
+                    # Create replies
+                    if 'replies' in message:
+                        for reply in message['replies']:
+                            reply_author_id = user_mapping[reply['author']]
+                            create_message(supabase, reply, channel_id, reply_author_id, message_id)
+                            metrics.item('messages')
         
         # Create direct messages
         print("\nProcessing direct messages...")
-        direct_messages_data = load_json_file('direct_messages.json')
-        for thread in direct_messages_data['direct_message_threads']:
-            channel_id = create_direct_message_channel(supabase, thread['participants'])
-            
-            for message in thread['messages']:
-                author_id = user_mapping[message['author']]
-                message_id = create_direct_message(supabase, message, channel_id, author_id)
+        with metrics.stage('direct_messages'):
+            direct_messages_data = load_json_file('direct_messages.json')
+            for thread in direct_messages_data['direct_message_threads']:
+                channel_id = create_direct_message_channel(supabase, thread['participants'])
                 
-                # Create replies
-                if 'replies' in message:
-                    for reply in message['replies']:
-                        reply_author_id = user_mapping[reply['author']]
-                        create_direct_message(supabase, reply, channel_id, reply_author_id, message_id)
+                for message in thread['messages']:
+                    author_id = user_mapping[message['author']]
+                    message_id = create_direct_message(supabase, message, channel_id, author_id)
+                    metrics.item('direct_messages')
+                    
+                    # Create replies
+                    if 'replies' in message:
+                        for reply in message['replies']:
+                            reply_author_id = user_mapping[reply['author']]
+                            create_direct_message(supabase, reply, channel_id, reply_author_id, message_id)
+                            metrics.item('direct_messages')
         
         print("\nDatabase seeding completed!")
+        metrics.finish()
         
     except Exception as e:
         print(f"\nError seeding database: {e}")
         sys.exit(1)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Seed the database from scripts/seed_data")
+    parser.add_argument('--sync', action='store_true',
+                        help="Apply only the inserts, updates and deletes that differ from the seed files "
+                             "(deterministic ids) instead of recreating every message")
+    parser.add_argument('--dry-run', action='store_true', help="With --sync, only report the changes")
+    args = parser.parse_args()
+    metrics.start_profiling()
+    main(args.sync, args.dry_run) 
\ No newline at end of file
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+import uuid
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+# Shared pipeline helpers live in rag/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rag'))
+from clients import get_supabase
+from instrumentation import metrics
+from resilience import call_with_retries
+from seed_database import execute, load_env
+from table_planner import DEFAULT_WORKERS, foreign_keys, insert_waves, run_waves
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+SNAPSHOT_FILE = os.path.join(os.path.dirname(__file__), 'seed_data', 'workspace.snapshot.json.gz')
+FORMAT_VERSION = 1
+
+# Rows per page when dumping and per request when restoring
+PAGE_SIZE = 1000
+INSERT_BATCH_SIZE = 500
+
+# Password given to users the restore has to create (the same one seed_database.py uses)
+DEFAULT_PASSWORD = "Password123!"
+
+# Namespace for the ids of a restored copy, so copy N of a snapshot always gets the same ids
+COPY_NAMESPACE = uuid.UUID('5b0f5d4e-8f3c-4c4e-9a57-3f1c2b7e6d10')
+
+# Tables in the seed scope (load order comes from schema/foreignkeys.json). For each one:
+#   key    columns that identify a row (the upsert conflict target and dump order)
+#   scope  for tables without a key: the parent column whose rows are replaced wholesale
+SEED_TABLES = {
+    'user_profiles': {'key': ['user_id']},
+    'teams': {'key': ['id']},
+    'team_members': {'scope': 'team_id'},
+    'channels': {'key': ['id']},
+    'channel_members': {'scope': 'channel_id'},
+    'messages': {'key': ['id']},
+    'reactions': {'key': ['id']},
+    'direct_message_channels': {'key': ['id']},
+    'direct_message_participants': {'scope': 'channel_id'},
+    'direct_messages': {'key': ['id']},
+    'direct_message_reactions': {'key': ['id']},
+}
+
+# Derived tables, included with --embeddings so a restored workspace needs no embedding calls.
+# metadata_refs: keys of the metadata JSONB that hold ids of other tables
+# (scripts/backfill-embeddings.ts records the message's channel_id there)
+EMBEDDING_TABLES = {
+    'message_embeddings': {'key': ['message_id'], 'metadata_refs': ['channel_id']},
+    'direct_message_embeddings': {'key': ['message_id'], 'metadata_refs': ['channel_id']},
+}
+
+# The embedding tables are newer than schema/foreignkeys.json, so their keys are listed here
+EMBEDDING_FOREIGN_KEYS = [
+    ('message_embeddings', 'message_id', 'messages', 'id'),
+    ('message_embeddings', 'team_id', 'teams', 'id'),
+    ('direct_message_embeddings', 'message_id', 'direct_messages', 'id'),
+    ('direct_message_embeddings', 'channel_id', 'direct_message_channels', 'id'),
+]
+
+def table_spec(table: str) -> Dict:
+    """Key or scope of a table, with refs: its columns that hold ids of other tables ('users' is auth.users)"""
+    spec = dict(SEED_TABLES.get(table) or EMBEDDING_TABLES[table])
+    spec['table'] = table
+    spec['refs'] = foreign_keys(table, EMBEDDING_FOREIGN_KEYS)
+    return spec
+
+def order_columns(spec: Dict) -> List[str]:
+    return spec.get('key') or [spec['scope']] + sorted(c for c in spec['refs'] if c != spec['scope'])
+
+def dump_table(supabase: Client, spec: Dict) -> List[Dict]:
+    """Every row of a table, in a stable order"""
+    rows = []
+    while True:
+        query = supabase.table(spec['table']).select('*')
+        for column in order_columns(spec):
+            query = query.order(column)
+        page = execute(query.range(len(rows), len(rows) + PAGE_SIZE - 1)).data
+        rows.extend(page)
+        if len(page) < PAGE_SIZE:
+            break
+    return rows
+
+def list_users(supabase: Client) -> List:
+    users = []
+    page = 1
+    while True:
+        batch = call_with_retries(lambda: supabase.auth.admin.list_users(page=page, per_page=PAGE_SIZE), 'supabase')
+        users.extend(batch)
+        if len(batch) < PAGE_SIZE:
+            return users
+        page += 1
+
+def take_snapshot(path: str = SNAPSHOT_FILE, embeddings: bool = False) -> Dict[str, int]:
+    """Dump the seed tables and the users they reference to a gzipped JSON archive
+
+    The archive holds no timestamps of its own and its rows are sorted, so
+    snapshotting the same data twice gives identical bytes.
+    """
+    supabase = get_supabase('service')
+    tables = {}
+    for table in list(SEED_TABLES) + (list(EMBEDDING_TABLES) if embeddings else []):
+        with metrics.stage(f"dump_{table}"):
+            tables[table] = dump_table(supabase, table_spec(table))
+        print(f"  {table}: {len(tables[table])} rows")
+
+    referenced = {row[column] for table in SEED_TABLES for row in tables[table]
+                  for column, target in table_spec(table)['refs'].items() if target == 'users' and row.get(column)}
+    with metrics.stage('dump_users'):
+        users = sorted(({'id': user.id, 'email': user.email, 'user_metadata': user.user_metadata or {}}
+                        for user in list_users(supabase) if user.id in referenced), key=lambda user: user['email'])
+    missing = referenced - {user['id'] for user in users}
+    if missing:
+        raise ValueError(f"{len(missing)} referenced users are not in auth.users, e.g. {sorted(missing)[0]}")
+
+    snapshot = {'format_version': FORMAT_VERSION, 'users': users, 'tables': tables}
+    data = json.dumps(snapshot, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    temp_file = path + '.tmp'
+    with open(temp_file, 'wb') as f:
+        # mtime=0 and no file name in the header keep the archive reproducible
+        with gzip.GzipFile(filename='', mode='wb', fileobj=f, mtime=0) as archive:
+            archive.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, path)
+    print(f"📦 Saved {len(users)} users and {sum(len(rows) for rows in tables.values())} rows to {path} "
+          f"({os.path.getsize(path) / 1024:.0f} KB)")
+    return {table: len(rows) for table, rows in tables.items()}
+
+def load_snapshot(path: str = SNAPSHOT_FILE) -> Dict:
+    with gzip.open(path, 'rb') as f:
+        snapshot = json.loads(f.read().decode('utf-8'))
+    if snapshot.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported snapshot format {snapshot.get('format_version')} in {path}")
+    return snapshot
+
+def map_users(supabase: Client, users: List[Dict], password: str = DEFAULT_PASSWORD) -> Dict[str, str]:
+    """Snapshot user id -> id of the user with the same email here, creating the missing ones"""
+    existing = {user.email: user.id for user in list_users(supabase)}
+    mapping = {}
+    for user in users:
+        if user['email'] not in existing:
+            print(f"Creating new user {user['email']}")
+            response = call_with_retries(lambda: supabase.auth.admin.create_user({
+                "email": user['email'],
+                "password": password,
+                "email_confirm": True,
+                "user_metadata": user['user_metadata'],
+            }), 'supabase', idempotent=False)
+            existing[user['email']] = response.user.id
+        mapping[user['id']] = existing[user['email']]
+    return mapping
+
+def copy_id(copy: Optional[str], value: str) -> str:
+    """Id of a row in a restored copy; the snapshot's own id unless restoring a named copy"""
+    return str(uuid.uuid5(COPY_NAMESPACE, f"{copy}:{value}")) if copy else value
+
+def remap(rows: List[Dict], spec: Dict, users: Dict[str, str], copy: Optional[str]) -> List[Dict]:
+    """Rows with user ids mapped to this project's users and, for a copy, every row id replaced"""
+    remapped = []
+    for row in rows:
+        row = dict(row)
+        for column, target in spec['refs'].items():
+            if row.get(column) is None:
+                continue
+            row[column] = users[row[column]] if target == 'users' else copy_id(copy, row[column])
+        if row.get('id') is not None:
+            row['id'] = copy_id(copy, row['id'])
+        metadata = row.get('metadata')
+        if copy and isinstance(metadata, dict) and any(metadata.get(key) for key in spec.get('metadata_refs', [])):
+            row['metadata'] = {**metadata, **{key: copy_id(copy, metadata[key])
+                                              for key in spec['metadata_refs'] if metadata.get(key)}}
+        remapped.append(row)
+    return remapped
+
+def layers(rows: List[Dict], column: str) -> List[List[Dict]]:
+    """Split self-referencing rows (replies) so each row comes after the one it points at"""
+    ids = {row['id'] for row in rows}
+    placed = set()
+    result = []
+    pending = rows
+    while pending:
+        layer = [row for row in pending if row.get(column) not in ids or row[column] in placed]
+        if not layer:
+            raise ValueError(f"Cycle in {column}")
+        placed.update(row['id'] for row in layer)
+        pending = [row for row in pending if row['id'] not in placed]
+        result.append(layer)
+    return result
+
+def restore_table(supabase: Client, spec: Dict, rows: List[Dict]) -> None:
+    table = spec['table']
+    if 'scope' in spec:
+        # No key to upsert on: replace the rows of every parent in the snapshot
+        scopes = sorted({row[spec['scope']] for row in rows})
+        for i in range(0, len(scopes), INSERT_BATCH_SIZE):
+            execute(supabase.table(table).delete().in_(spec['scope'], scopes[i:i + INSERT_BATCH_SIZE]))
+
+    self_refs = [column for column, target in spec['refs'].items() if target == table]
+    for layer in layers(rows, self_refs[0]) if self_refs else [rows]:
+        for i in range(0, len(layer), INSERT_BATCH_SIZE):
+            batch = layer[i:i + INSERT_BATCH_SIZE]
+            if 'key' in spec:
+                execute(supabase.table(table).upsert(batch, on_conflict=','.join(spec['key'])))
+            else:
+                execute(supabase.table(table).insert(batch))
+
+def restore_snapshot(path: str = SNAPSHOT_FILE, copy: Optional[str] = None, password: str = DEFAULT_PASSWORD,
+                     workers: int = DEFAULT_WORKERS) -> None:
+    """Bulk-load a snapshot, mapping its users to this project's users by email
+
+    Rows keep the snapshot's ids (and timestamps), so restoring twice gives
+    the same workspace. With copy, every row id is replaced by one derived
+    from the copy name, including ids other columns and embedding metadata
+    point at, so several copies can live side by side and search only their
+    own vectors.
+    """
+    start = time.perf_counter()
+    snapshot = load_snapshot(path)
+    supabase = get_supabase('service')
+    with metrics.stage('users'):
+        users = map_users(supabase, snapshot['users'], password)
+
+    def restore(table: str) -> None:
+        rows = snapshot['tables'][table]
+        spec = table_spec(table)
+        with metrics.stage(f"restore_{table}"):
+            restore_table(supabase, spec, remap(rows, spec, users, copy))
+        metrics.item('rows', len(rows))
+        print(f"  {table}: {len(rows)} rows")
+
+    # Tables whose parents are all loaded go in together
+    tables = [table for table, rows in snapshot['tables'].items() if rows]
+    run_waves(insert_waves(tables, EMBEDDING_FOREIGN_KEYS), restore, workers)
+    print(f"✅ Restored {path} in {time.perf_counter() - start:.1f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot a seeded workspace and restore it quickly")
+    commands = parser.add_subparsers(dest='command', required=True)
+    snapshot = commands.add_parser('snapshot', help="Dump the seed tables and their users to an archive")
+    snapshot.add_argument('--file', default=SNAPSHOT_FILE)
+    snapshot.add_argument('--embeddings', action='store_true', help="Include message and direct message embeddings")
+    restore = commands.add_parser('restore', help="Load an archive into this project")
+    restore.add_argument('--file', default=SNAPSHOT_FILE)
+    restore.add_argument('--copy', help="Restore under new ids derived from this name, alongside other copies")
+    restore.add_argument('--password', default=DEFAULT_PASSWORD, help="Password for users that have to be created")
+    restore.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Tables loaded concurrently")
+    args = parser.parse_args()
+    metrics.start_profiling()
+
+    load_env()
+    if args.command == 'snapshot':
+        take_snapshot(args.file, args.embeddings)
+    else:
+        restore_snapshot(args.file, args.copy, args.password, args.workers)
+    metrics.finish()
+
+if __name__ == "__main__":
+    main()
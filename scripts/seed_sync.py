@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import random
+import sys
+import uuid
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
+# Shared pipeline helpers live in rag/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'rag'))
+from instrumentation import metrics
+from seed_database import execute
+from seed_snapshot import layers
+from table_planner import delete_waves, insert_waves, run_waves
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+# Seed rows get ids derived from their channel (or parent), author and how many
+# earlier messages that author has there, so a record keeps its id across runs,
+# when its text is edited, and when other authors' messages are added or
+# removed around it. A seed entry can pin its id with an "id" field.
+SEED_NAMESPACE = uuid.UUID('0c8a6f7e-2b55-4a8e-9d3f-6a41e2d7b9c3')
+
+# Rows per page when reading current state and per request when writing
+PAGE_SIZE = 1000
+WRITE_BATCH_SIZE = 500
+
+# Ids per .in_() filter, keeping request URLs short
+FILTER_BATCH_SIZE = 200
+
+REACTION_EMOJIS = ["👍", "❤️", "🚀", "💡", "👏"]
+
+# Chance that a given user reacts to a given message
+REACTION_PROBABILITY = 0.25
+
+# Columns the seed owns in each table: the ones fingerprinted, compared and written
+SYNCED_COLUMNS = {
+    'messages': ['id', 'channel_id', 'content', 'user_id', 'parent_id', 'topic', 'file', 'extension',
+                 'event', 'payload', 'private'],
+    'reactions': ['id', 'message_id', 'user_id', 'emoji', 'created_by', 'message_type'],
+    'direct_message_channels': ['id'],
+    'direct_message_participants': ['channel_id', 'user_id'],
+    'direct_messages': ['id', 'channel_id', 'content', 'sender_id', 'file'],
+    'direct_message_reactions': ['id', 'message_id', 'user_id', 'emoji'],
+}
+
+def seed_id(*parts: str) -> str:
+    return str(uuid.uuid5(SEED_NAMESPACE, '/'.join(parts)))
+
+def record_id(message_data, seen: Dict[tuple, int], *scope: str) -> str:
+    """Id of a seed message: pinned by its "id", else from scope, author and occurrence
+
+    seen counts each author's messages per scope. The text is not part of
+    the id, so editing a message is an update of the same row (its replies
+    and reactions keep their ids too).
+    """
+    if message_data.get('id'):
+        return seed_id(*scope, 'id', str(message_data['id']))
+    key = scope + (message_data['author'],)
+    occurrence = seen.get(key, 0)
+    seen[key] = occurrence + 1
+    return seed_id(*key, str(occurrence))
+
+def row_key(table: str, row: Dict):
+    # direct_message_participants has no id; a participant is its (channel, user) pair
+    return (row['channel_id'], row['user_id']) if table == 'direct_message_participants' else row['id']
+
+def fingerprint(table: str, row: Dict) -> str:
+    """Stable hash of the seed-owned columns of a row"""
+    values = [row.get(column) for column in SYNCED_COLUMNS[table]]
+    return hashlib.sha1(json.dumps(values, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def message_row(message_data, message_id, channel_id, user_id, parent_id=None) -> Dict:
+    """The messages row create_message would insert"""
+    file_data = message_data.get('file')
+    extension = "txt"
+    if file_data:
+        file_name = file_data.get('name', '')
+        extension = file_name.split('.')[-1] if '.' in file_name else 'txt'
+    return {
+        "id": message_id,
+        "channel_id": channel_id,
+        "content": message_data['content'],
+        "user_id": user_id,
+        "parent_id": parent_id,
+        "topic": 'general',
+        "file": file_data,
+        "extension": extension,
+        "event": None,
+        "payload": None,
+        "private": False,
+    }
+
+def seeded_reactions(message_id: str, user_mapping: Dict[str, str], max_emojis: int,
+                     probability: float = REACTION_PROBABILITY) -> List[Tuple[str, str]]:
+    """(user id, emoji) reactions for a message: random-looking but the same on every run
+
+    Each (message, user) pair is decided on its own, so adding or removing a
+    user leaves everyone else's reactions unchanged.
+    """
+    reactions = []
+    for email in sorted(user_mapping):
+        rng = random.Random(f"{message_id}/{email}")
+        if rng.random() < probability:
+            for emoji in rng.sample(REACTION_EMOJIS, rng.randint(1, max_emojis)):
+                reactions.append((user_mapping[email], emoji))
+    return reactions
+
+def desired_state(messages_data, direct_messages_data, user_mapping: Dict[str, str],
+                  channel_mapping: Dict[str, str]) -> Dict[str, Dict]:
+    """Every row the seed files describe, by table and key"""
+    state: Dict[str, Dict] = {table: {} for table in SYNCED_COLUMNS}
+
+    def add(table, row):
+        state[table][row_key(table, row)] = row
+
+    seen: Dict[tuple, int] = {}
+    for thread in messages_data['message_threads']:
+        channel_id = channel_mapping[thread['channel']]
+        for message in thread['messages']:
+            message_id = record_id(message, seen, 'message', thread['channel'])
+            add('messages', message_row(message, message_id, channel_id, user_mapping[message['author']]))
+            for user_id, emoji in seeded_reactions(message_id, user_mapping, 2):
+                add('reactions', {"id": seed_id(message_id, user_id, emoji), "message_id": message_id,
+                                  "user_id": user_id, "emoji": emoji, "created_by": user_id,
+                                  "message_type": "message"})
+            for reply in message.get('replies', []):
+                add('messages', message_row(reply, record_id(reply, seen, message_id, 'reply'), channel_id,
+                                            user_mapping[reply['author']], message_id))
+
+    for thread in direct_messages_data['direct_message_threads']:
+        participants = sorted(thread['participants'])
+        channel_id = seed_id('direct_message_channel', *participants)
+        add('direct_message_channels', {"id": channel_id})
+        for email in participants:
+            add('direct_message_participants', {"channel_id": channel_id, "user_id": user_mapping[email]})
+        for message in thread['messages']:
+            message_id = record_id(message, seen, channel_id)
+            add('direct_messages', {"id": message_id, "channel_id": channel_id, "content": message['content'],
+                                    "sender_id": user_mapping[message['author']], "file": None})
+            for user_id, emoji in seeded_reactions(message_id, user_mapping, 1):
+                add('direct_message_reactions', {"id": seed_id(message_id, user_id, emoji), "message_id": message_id,
+                                                 "user_id": user_id, "emoji": emoji})
+            for reply in message.get('replies', []):
+                reply_id = record_id(reply, seen, message_id, 'reply')
+                add('direct_messages', {"id": reply_id, "channel_id": channel_id, "content": reply['content'],
+                                        "sender_id": user_mapping[reply['author']], "file": None})
+    return state
+
+def fetch_in(supabase: Client, table: str, column: str, values) -> List[Dict]:
+    """Seed-owned columns of every row whose column is in values, paged and in filter batches"""
+    values = sorted(set(values))
+    rows = []
+    for i in range(0, len(values), FILTER_BATCH_SIZE):
+        chunk = values[i:i + FILTER_BATCH_SIZE]
+        offset = 0
+        while True:
+            query = supabase.table(table).select(','.join(SYNCED_COLUMNS[table])).in_(column, chunk)
+            for order in SYNCED_COLUMNS[table][:2]:
+                query = query.order(order)
+            page = execute(query.range(offset, offset + PAGE_SIZE - 1)).data
+            rows.extend(page)
+            if len(page) < PAGE_SIZE:
+                break
+            offset += PAGE_SIZE
+    return rows
+
+def current_state(supabase: Client, channel_ids: List[str], user_ids: List[str]) -> Dict[str, Dict]:
+    """Rows in the seed's scope as the database has them now
+
+    The scope is every message in the seeded channels and every direct
+    message channel whose participants are all seed users, with their
+    reactions and participants.
+    """
+    state: Dict[str, Dict] = {}
+
+    def put(table, rows):
+        state[table] = {row_key(table, row): row for row in rows}
+
+    put('messages', fetch_in(supabase, 'messages', 'channel_id', channel_ids))
+    put('reactions', fetch_in(supabase, 'reactions', 'message_id', state['messages']))
+
+    seed_users = set(user_ids)
+    candidates = {row['channel_id'] for row in fetch_in(supabase, 'direct_message_participants', 'user_id', user_ids)}
+    participants = fetch_in(supabase, 'direct_message_participants', 'channel_id', candidates)
+    outside = {row['channel_id'] for row in participants if row['user_id'] not in seed_users}
+    dm_channels = sorted(candidates - outside)
+    put('direct_message_channels', [{'id': channel_id} for channel_id in dm_channels])
+    put('direct_message_participants', [row for row in participants if row['channel_id'] not in outside])
+    put('direct_messages', fetch_in(supabase, 'direct_messages', 'channel_id', dm_channels))
+    put('direct_message_reactions', fetch_in(supabase, 'direct_message_reactions', 'message_id', state['direct_messages']))
+    return state
+
+def diff(desired: Dict[str, Dict], current: Dict[str, Dict]) -> Dict[str, Dict[str, List]]:
+    """Per table: rows to insert, rows whose fingerprint changed, and rows to delete"""
+    plan = {}
+    for table in SYNCED_COLUMNS:
+        want, have = desired[table], current.get(table, {})
+        plan[table] = {
+            'insert': [row for key, row in want.items() if key not in have],
+            'update': [row for key, row in want.items()
+                       if key in have and fingerprint(table, row) != fingerprint(table, have[key])],
+            'delete': [row for key, row in have.items() if key not in want],
+        }
+    return plan
+
+def apply_plan(supabase: Client, plan: Dict[str, Dict[str, List]]) -> None:
+    """Deletes children first, then inserts and updates parents first, tables of a wave in parallel"""
+    def delete(table):
+        rows = plan[table]['delete']
+        if table == 'direct_message_participants':
+            for row in rows:
+                execute(supabase.table(table).delete().eq('channel_id', row['channel_id']).eq('user_id', row['user_id']))
+            return
+        # messages.parent_id has no ON DELETE CASCADE: replies go before the messages they answer
+        for batch in reversed(layers(rows, 'parent_id')) if table == 'messages' else [rows]:
+            ids = [row['id'] for row in batch]
+            for i in range(0, len(ids), FILTER_BATCH_SIZE):
+                execute(supabase.table(table).delete().in_('id', ids[i:i + FILTER_BATCH_SIZE]))
+
+    def write(table):
+        rows = plan[table]['insert'] + plan[table]['update']
+        # New replies after the new messages they answer
+        for batch in layers(rows, 'parent_id') if table == 'messages' else [rows]:
+            for i in range(0, len(batch), WRITE_BATCH_SIZE):
+                chunk = batch[i:i + WRITE_BATCH_SIZE]
+                if table == 'direct_message_participants':
+                    # No key to upsert on; a participant is only ever added or removed
+                    execute(supabase.table(table).insert(chunk))
+                else:
+                    execute(supabase.table(table).upsert(chunk, on_conflict='id'))
+
+    deleting = [table for table in SYNCED_COLUMNS if plan[table]['delete']]
+    writing = [table for table in SYNCED_COLUMNS if plan[table]['insert'] or plan[table]['update']]
+    with metrics.stage('sync_delete'):
+        run_waves(delete_waves(deleting), delete)
+    with metrics.stage('sync_write'):
+        run_waves(insert_waves(writing), write)
+
+def sync_messages(supabase: Client, messages_data, direct_messages_data, user_mapping: Dict[str, str],
+                  channel_mapping: Dict[str, str], dry_run: bool = False) -> Dict[str, Dict[str, List]]:
+    """Bring messages, direct messages and their reactions in line with the seed files
+
+    Only the differences are written: an edited message is one upsert, a
+    removed one is one delete, and unchanged records cost nothing beyond the
+    bulk reads.
+    """
+    desired = desired_state(messages_data, direct_messages_data, user_mapping, channel_mapping)
+    with metrics.stage('sync_read'):
+        current = current_state(supabase, sorted(set(channel_mapping.values())), sorted(set(user_mapping.values())))
+    plan = diff(desired, current)
+
+    for table, changes in plan.items():
+        counts = {action: len(rows) for action, rows in changes.items()}
+        print(f"  {table}: +{counts['insert']} ~{counts['update']} -{counts['delete']}"
+              f" ({len(desired[table]) - counts['insert'] - counts['update']} unchanged)")
+    if not dry_run:
+        apply_plan(supabase, plan)
+        metrics.item('sync_writes', sum(len(rows) for changes in plan.values() for rows in changes.values()))
+    return plan